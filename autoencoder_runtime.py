@@ -0,0 +1,141 @@
+"""Inference backends for the autoencoder.
+
+- ``numpy``: the Dense stack of ``autoencoder.h5`` read with h5py and evaluated
+  as plain float32 matmuls; TensorFlow is never imported
+- ``keras``: ``load_model`` + ``model.predict`` (the original path)
+- ``tf_function``: the Keras model behind a ``tf.function`` with a fixed input
+  signature, so repeated calls skip ``predict``'s per-call setup
+
+All three return float32 reconstructions, and the Keras backends inherit
+``NumpyAutoencoder.verdicts``, so every backend scores the same way: 1 (attack)
+where ``mae >= threshold``, like the kmeans and svm detectors. The original
+detector returned 1 for ``mae < threshold``, i.e. it flagged the windows the
+autoencoder reconstructs well (normal traffic) as attacks.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+AUTOENCODER_BACKENDS = ("numpy", "keras", "tf_function")
+AUTOENCODER_BACKEND = os.environ.get("AUTOENCODER_BACKEND", "numpy")
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+}
+
+
+def reconstruction_error(reconstructions, data) -> np.ndarray:
+    """Per-row mean absolute error (``tf.keras.losses.mae``) in float32"""
+    diff = np.asarray(reconstructions, dtype=np.float32) - np.asarray(
+        data, dtype=np.float32
+    )
+    return np.mean(np.abs(diff), axis=-1, dtype=np.float32)
+
+
+def load_dense_layers(path):
+    """[(kernel, bias, activation name)] of a Keras 2 HDF5 Dense-only model"""
+    import h5py
+
+    with h5py.File(path, "r") as f:
+        config = json.loads(f.attrs["model_config"])
+        weights = f["model_weights"]
+        layers = []
+        for layer in config["config"]["layers"]:
+            kind, cfg = layer["class_name"], layer["config"]
+            if kind == "InputLayer":
+                continue
+            if kind != "Dense":
+                raise ValueError(f"Unsupported layer {cfg['name']} ({kind})")
+            if cfg["activation"] not in ACTIVATIONS:
+                raise ValueError(f"Unsupported activation {cfg['activation']}")
+            group = weights[cfg["name"]]
+            names = [
+                n.decode() if isinstance(n, bytes) else n
+                for n in group.attrs["weight_names"]
+            ]
+            params = {n.rsplit("/", 1)[-1].split(":")[0]: group[n][()] for n in names}
+            layers.append(
+                (
+                    params["kernel"].astype(np.float32),
+                    (
+                        params["bias"].astype(np.float32)
+                        if cfg.get("use_bias", True)
+                        else None
+                    ),
+                    cfg["activation"],
+                )
+            )
+    return layers
+
+
+class NumpyAutoencoder:
+    backend = "numpy"
+
+    def __init__(self, path):
+        self.layers = load_dense_layers(path)
+        self.input_dim = self.layers[0][0].shape[0]
+
+    def reconstruct(self, data) -> np.ndarray:
+        x = np.asarray(data, dtype=np.float32)
+        for kernel, bias, activation in self.layers:
+            x = x @ kernel
+            if bias is not None:
+                x += bias
+            x = ACTIVATIONS[activation](x)
+        return x
+
+    def verdicts(self, data, threshold) -> np.ndarray:
+        """1 (attack) where the reconstruction error reaches the threshold"""
+        data = np.asarray(data, dtype=np.float32)
+        errors = reconstruction_error(self.reconstruct(data), data)
+        return (errors >= threshold).astype(int)
+
+
+class KerasAutoencoder(NumpyAutoencoder):
+    backend = "keras"
+
+    def __init__(self, path):
+        from tensorflow.keras.models import load_model
+
+        self.model = load_model(path, compile=False)
+        self.input_dim = self.model.input_shape[-1]
+
+    def reconstruct(self, data) -> np.ndarray:
+        return self.model.predict(np.asarray(data, dtype=np.float32), verbose=0)
+
+
+class TFFunctionAutoencoder(KerasAutoencoder):
+    backend = "tf_function"
+
+    def __init__(self, path):
+        import tensorflow as tf
+
+        super().__init__(path)
+        self._forward = tf.function(
+            lambda x: self.model(x, training=False),
+            input_signature=[tf.TensorSpec([None, self.input_dim], tf.float32)],
+        )
+
+    def reconstruct(self, data) -> np.ndarray:
+        return self._forward(np.asarray(data, dtype=np.float32)).numpy()
+
+
+def load_autoencoder(path, backend=AUTOENCODER_BACKEND):
+    if backend == "numpy":
+        model = NumpyAutoencoder(path)
+    elif backend == "keras":
+        model = KerasAutoencoder(path)
+    elif backend == "tf_function":
+        model = TFFunctionAutoencoder(path)
+    else:
+        raise ValueError(f"backend must be one of {AUTOENCODER_BACKENDS}")
+    logger.info(f"Autoencoder loaded with {backend} backend")
+    return model
@@ -0,0 +1,136 @@
+"""Size- or deadline-triggered micro-batching for captured packets."""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collects items and hands them to ``on_flush`` as a list.
+
+    A batch is flushed as soon as it holds ``max_size`` items or its oldest item
+    has waited ``max_latency`` seconds, whichever comes first. The deadline is
+    enforced by a background flusher thread so quiet networks still produce
+    verdicts. Both limits can be changed at runtime with ``configure``.
+
+    ``pending`` (optional) reports work waiting outside the buffer, such as
+    finished flows: an empty batch is then still handed to ``on_flush``, on a
+    manual flush or at most once per ``max_latency`` from the flusher.
+    """
+
+    def __init__(self, on_flush, max_size=5000, max_latency=2.0, pending=None):
+        self.on_flush = on_flush
+        self.pending = pending
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self.buffer = []
+        self.first_item_at = None
+        self.lock = threading.Lock()
+        self.flushed_batches = 0
+        self.flush_reasons = {"size": 0, "deadline": 0, "manual": 0}
+        self._last_pending_check = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, item):
+        with self.lock:
+            if not self.buffer:
+                self.first_item_at = time.monotonic()
+            self.buffer.append(item)
+            if len(self.buffer) < self.max_size:
+                return
+            batch = self._take()
+        self._emit(batch, "size")
+
+    def flush(self, reason="manual"):
+        """Flush whatever is buffered right now"""
+        with self.lock:
+            batch = self._take()
+        self._emit(batch, reason)
+
+    def configure(self, max_size=None, max_latency=None):
+        if max_size is not None:
+            if int(max_size) < 1:
+                raise ValueError("max_size must be >= 1")
+            self.max_size = int(max_size)
+        if max_latency is not None:
+            if float(max_latency) <= 0:
+                raise ValueError("max_latency must be > 0")
+            self.max_latency = float(max_latency)
+        logger.info(f"Batching set to {self.max_size} packets / {self.max_latency}s")
+
+    def start(self):
+        """Start the background deadline flusher (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="batch-flusher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, flush=True):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        if flush:
+            self.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            pending = len(self.buffer)
+            age = time.monotonic() - self.first_item_at if self.first_item_at else 0.0
+        return {
+            "max_packets": self.max_size,
+            "max_latency": self.max_latency,
+            "pending": pending,
+            "oldest_pending_age": round(age, 3),
+            "flushed_batches": self.flushed_batches,
+            "flush_reasons": dict(self.flush_reasons),
+        }
+
+    def _take(self):
+        batch, self.buffer = self.buffer, []
+        self.first_item_at = None
+        return batch
+
+    def _has_pending(self) -> bool:
+        if self.pending is None:
+            return False
+        try:
+            return bool(self.pending())
+        except Exception as e:
+            logger.error(f"Pending check failed: {e}")
+            return False
+
+    def _emit(self, batch, reason):
+        if not batch and not self._has_pending():
+            return
+        self.flushed_batches += 1
+        self.flush_reasons[reason] = self.flush_reasons.get(reason, 0) + 1
+        try:
+            self.on_flush(batch)
+        except Exception as e:
+            logger.error(f"Batch flush failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(min(0.1, self.max_latency / 4)):
+            with self.lock:
+                due = (
+                    self.first_item_at is not None
+                    and time.monotonic() - self.first_item_at >= self.max_latency
+                )
+                batch = self._take() if due else None
+            if batch:
+                self._emit(batch, "deadline")
+                continue
+            now = time.monotonic()
+            if now - self._last_pending_check >= self.max_latency:
+                self._last_pending_check = now
+                with self.lock:
+                    idle = not self.buffer
+                # Nothing buffered: still flush what ``pending`` holds
+                if idle:
+                    self._emit([], "deadline")
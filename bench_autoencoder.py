@@ -0,0 +1,90 @@
+"""Latency benchmark for the autoencoder inference backends.
+
+Times ``reconstruct`` + verdict for each available backend at several batch
+sizes and checks that every backend gives the same verdicts as the first one
+(numpy) on the same scaled inputs.
+
+    python bench_autoencoder.py
+    python bench_autoencoder.py --rows 1 16 256 --repeat 500
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from autoencoder_runtime import AUTOENCODER_BACKENDS, load_autoencoder
+
+MODEL_DIR = Path(__file__).parent / "Model"
+
+
+def sample_inputs(rows, width, seed=0):
+    """MinMax-scaled inputs, mostly inside the training range"""
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-0.1, 1.5, size=(rows, width)).astype(np.float32)
+
+
+def time_backend(model, data, threshold, repeat):
+    model.verdicts(data, threshold)  # warm-up / tracing
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        model.verdicts(data, threshold)
+        samples[i] = time.perf_counter() - start
+    return samples * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 8, 64, 512])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--backends", nargs="+", default=list(AUTOENCODER_BACKENDS))
+    args = parser.parse_args()
+
+    threshold = np.load(MODEL_DIR / "autoencoder_train_info.npz")["threshold"].item()
+    models = {}
+    for backend in args.backends:
+        start = time.perf_counter()
+        try:
+            models[backend] = load_autoencoder(MODEL_DIR / "autoencoder.h5", backend)
+        except ImportError as e:
+            print(f"{backend}: skipped ({e})")
+            continue
+        print(f"{backend}: loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    if not models:
+        return
+    width = next(iter(models.values())).input_dim
+    # Points pulled onto the learned manifold plus noise, so errors straddle
+    # the threshold and the verdict comparison exercises both outcomes
+    check = sample_inputs(10_000, width)
+    for _ in range(3):
+        check = models[next(iter(models))].reconstruct(check)
+    noise = np.random.default_rng(1).normal(0, 0.03, check.shape)
+    check = (check + noise).astype(np.float32)
+    reference = None
+    for backend, model in models.items():
+        verdicts = model.verdicts(check, threshold)
+        if reference is None:
+            reference = (backend, verdicts, model.reconstruct(check))
+            print(f"{backend}: {int(verdicts.sum())}/{len(check)} rows flagged")
+            continue
+        mismatches = int((verdicts != reference[1]).sum())
+        max_diff = float(np.abs(model.reconstruct(check) - reference[2]).max())
+        print(
+            f"{backend} vs {reference[0]}: {mismatches} verdict mismatches "
+            f"in {len(check)} rows, max reconstruction diff {max_diff:.3g}"
+        )
+
+    print(f"\n{'backend':<14}{'rows':>6}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for rows in args.rows:
+        data = sample_inputs(rows, width, seed=rows)
+        for backend, model in models.items():
+            ms = time_backend(model, data, threshold, args.repeat)
+            p50, p95 = np.percentile(ms, [50, 95])
+            print(f"{backend:<14}{rows:>6}{p50:>10.4f}{p95:>10.4f}{ms.mean():>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
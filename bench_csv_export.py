@@ -0,0 +1,88 @@
+"""Memory benchmark for the batch CSV export.
+
+Archives synthetic batches of growing size in a temporary flow store, then
+exports each one as CSV twice, every run in a fresh process so its peak RSS is
+its own: ``full`` reads the whole batch and renders it in one piece (the old
+endpoint), ``streamed`` goes through ``iter_batch_flows`` chunk by chunk like
+``/api/download/csv``. Streamed peak memory should stay flat as rows grow.
+
+    python bench_csv_export.py
+    python bench_csv_export.py --rows 10000 100000 1000000
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from flow_meter import CIC_TIMESTAMP_FORMAT, FLOW_COLUMNS
+from replay import peak_rss_mb
+
+
+def synthetic_flows(rows, seed=0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {}
+    for col in FLOW_COLUMNS:
+        if col in ("Flow ID", "Src IP", "Dst IP"):
+            data[col] = [f"10.0.{i % 256}.{i % 200}" for i in range(rows)]
+        elif col == "Timestamp":
+            data[col] = datetime(2024, 5, 17, 14).strftime(CIC_TIMESTAMP_FORMAT)
+        elif col in ("Src Port", "Dst Port", "Protocol"):
+            data[col] = rng.integers(0, 65535, rows)
+        else:
+            data[col] = rng.random(rows) * 1e6
+    return pd.DataFrame(data)
+
+
+def archive(root, rows):
+    from flow_store import FlowStore
+
+    files = FlowStore(root).write_batch(
+        synthetic_flows(rows), f"bench_{rows}", datetime.now(), is_attack=True
+    )
+    return {"batch_name": f"bench_{rows}", "flows_files": files}
+
+
+def export(batch, mode):
+    """Render the CSV, discarding the output; returns (MB, seconds, peak MB)"""
+    from flow_store import iter_batch_flows, read_batch_flows
+
+    start = time.perf_counter()
+    size = 0
+    if mode == "full":
+        size = len(read_batch_flows(batch).to_csv(index=False))
+    else:
+        for i, chunk in enumerate(iter_batch_flows(batch)):
+            size += len(chunk.to_csv(index=False, header=i == 0))
+    return size / 1e6, time.perf_counter() - start, peak_rss_mb()
+
+
+def in_fresh_process(fn, *args):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000, 500_000]
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_flow_store_") as root:
+        print(f"{'rows':>9}{'mode':>10}{'csv MB':>10}{'seconds':>10}{'peak MB':>10}")
+        for rows in args.rows:
+            batch = in_fresh_process(archive, root, rows)
+            for mode in ("full", "streamed"):
+                size, seconds, peak = in_fresh_process(export, batch, mode)
+                print(f"{rows:>9}{mode:>10}{size:>10.1f}{seconds:>10.2f}{peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
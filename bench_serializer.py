@@ -0,0 +1,92 @@
+"""Micro-benchmark: serializing flow documents as the endpoints used to vs
+``serializer.dumps``.
+
+The documents look like flows read back from MongoDB: every CICFlowMeter
+column, an ObjectId, a datetime and some NaN / Infinity rates.
+
+    python bench_serializer.py
+    python bench_serializer.py --docs 1000 --repeat 50
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import math
+import time
+
+from bson import ObjectId, json_util
+import numpy as np
+
+from flow_meter import FLOW_COLUMNS
+import serializer
+
+
+def flow_documents(n, seed=0) -> list:
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n):
+        doc = {"_id": ObjectId()}
+        for col in FLOW_COLUMNS:
+            if col in ("Flow ID", "Src IP", "Dst IP", "Timestamp"):
+                doc[col] = f"10.0.{i % 256}.{i % 200}"
+            elif col in ("Src Port", "Dst Port", "Protocol"):
+                doc[col] = int(rng.integers(0, 65535))
+            else:
+                doc[col] = float(rng.random() * 1e6)
+        doc["Flow Byts/s"] = math.inf if i % 10 == 0 else doc["Flow Byts/s"]
+        doc["Flow Pkts/s"] = math.nan if i % 7 == 0 else doc["Flow Pkts/s"]
+        doc["flow_time"] = datetime.now(timezone.utc)
+        doc["batch_index"] = i // 500
+        docs.append(doc)
+    return docs
+
+
+def json_util_round_trip(docs) -> bytes:
+    """Old /api/batches/all: json_util -> json.loads -> jsonify"""
+    return json.dumps(json.loads(json_util.dumps(docs))).encode()
+
+
+def clean_and_dump(docs) -> bytes:
+    """Old /api/flows: per-value NaN/Inf cleaning, then the stdlib encoder"""
+
+    def clean_value(val):
+        if isinstance(val, float) and (math.isinf(val) or math.isnan(val)):
+            return None
+        return val
+
+    cleaned = [{k: clean_value(v) for k, v in d.items()} for d in docs]
+    return json.dumps(cleaned, default=str).encode()
+
+
+def fast(docs) -> bytes:
+    return serializer.dumps(docs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    docs = flow_documents(args.docs)
+    print(f"{args.docs} flow documents x {args.repeat} runs")
+    print(f"{'serializer':<22}{'p50 ms':>10}{'min ms':>10}{'docs/s':>12}{'KB':>8}")
+    for name, fn in (
+        ("json_util round-trip", json_util_round_trip),
+        ("clean + json.dumps", clean_and_dump),
+        ("serializer (orjson)", fast),
+    ):
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            out = fn(docs)
+            samples.append(time.perf_counter() - start)
+        p50 = float(np.median(samples)) * 1000
+        print(
+            f"{name:<22}{p50:>10.2f}{min(samples) * 1000:>10.2f}"
+            f"{args.docs / (p50 / 1000):>12.0f}{len(out) / 1024:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
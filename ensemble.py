@@ -0,0 +1,118 @@
+"""Ensemble mode: every detector scores the same aggregated feature rows.
+
+The flows are aggregated once over the union of the detectors' feature
+columns; each detector then takes its own columns from that frame, the
+detectors run in parallel, and their per-window verdicts are combined by
+voting:
+
+- ``any``: a window is an attack if any detector says so
+- ``majority``: more than half of the detectors that produced a verdict
+- ``weighted``: sum of the weights of the detectors voting attack, divided by
+  the total weight, is at least ``threshold``
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENSEMBLE_MODELS = ("autoencoder", "kmeans", "svm")
+VOTING_MODES = ("any", "majority", "weighted")
+ENSEMBLE_VOTING = os.environ.get("ENSEMBLE_VOTING", "majority")
+# "autoencoder:1,kmeans:1,svm:1"
+ENSEMBLE_WEIGHTS = os.environ.get("ENSEMBLE_WEIGHTS", "")
+ENSEMBLE_THRESHOLD = float(os.environ.get("ENSEMBLE_THRESHOLD", 0.5))
+
+
+def parse_weights(text) -> dict:
+    weights = {name: 1.0 for name in ENSEMBLE_MODELS}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, value = item.partition(":")
+        weights[name.strip()] = float(value)
+    return weights
+
+
+class Ensemble:
+    def __init__(
+        self,
+        voting=ENSEMBLE_VOTING,
+        weights=None,
+        threshold=ENSEMBLE_THRESHOLD,
+        max_workers=len(ENSEMBLE_MODELS),
+    ):
+        self.voting = "majority"
+        self.weights = parse_weights(ENSEMBLE_WEIGHTS)
+        self.threshold = threshold
+        self.configure(voting=voting, weights=weights)
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="detector"
+        )
+
+    def configure(self, voting=None, weights=None, threshold=None):
+        if voting is not None:
+            if voting not in VOTING_MODES:
+                raise ValueError(f"voting must be one of {VOTING_MODES}")
+            self.voting = voting
+        if weights is not None:
+            unknown = set(weights) - set(ENSEMBLE_MODELS)
+            if unknown:
+                raise ValueError(f"Unknown models in weights: {sorted(unknown)}")
+            if any(float(w) < 0 for w in weights.values()):
+                raise ValueError("weights must be >= 0")
+            self.weights = {**self.weights, **{k: float(v) for k, v in weights.items()}}
+        if threshold is not None:
+            if not 0 <= float(threshold) <= 1:
+                raise ValueError("threshold must be between 0 and 1")
+            self.threshold = float(threshold)
+
+    def settings(self) -> dict:
+        return {
+            "models": list(ENSEMBLE_MODELS),
+            "voting": self.voting,
+            "weights": self.weights,
+            "threshold": self.threshold,
+        }
+
+    def score(self, features, snapshots, detectors):
+        """Run each snapshot's detector on its columns of ``features`` in
+        parallel; returns ``(verdicts, per_model)``.
+
+        ``detectors`` maps model name -> ``detect(features, bundle)``. Models
+        that fail (empty or wrong-length result) are left out of the vote.
+        """
+        if features is None or features.empty:
+            return np.array([]), {}
+        futures = {
+            snapshot.name: self.pool.submit(
+                detectors[snapshot.name], features[list(snapshot.columns)], snapshot
+            )
+            for snapshot in snapshots
+        }
+        per_model = {}
+        for name, future in futures.items():
+            preds = future.result()
+            if len(preds) != len(features):
+                logger.warning(f"{name} produced no verdicts; left out of the vote")
+                continue
+            per_model[name] = np.asarray(preds, dtype=int)
+        return self.vote(per_model, len(features)), per_model
+
+    def vote(self, per_model, rows) -> np.ndarray:
+        if not per_model:
+            return np.array([])
+        votes = np.vstack(list(per_model.values()))  # models x windows
+        if self.voting == "any":
+            return votes.any(axis=0).astype(int)
+        if self.voting == "majority":
+            return (votes.sum(axis=0) * 2 > len(per_model)).astype(int)
+        weights = np.array([self.weights.get(name, 1.0) for name in per_model])
+        total = weights.sum()
+        if total == 0:
+            return np.zeros(rows, dtype=int)
+        return ((weights @ votes) / total >= self.threshold).astype(int)
+
+
+ensemble = Ensemble()
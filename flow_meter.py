@@ -0,0 +1,551 @@
+"""In-process replacement for the CICFlowMeter-4.0 subprocess.
+
+Builds bidirectional flow records with the same column names and units as the
+CSV written by ``cfm`` (times in microseconds, lengths in payload bytes), so
+``inference.WindowBuilder`` and the trained models see identical inputs.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+from scapy.all import IP, TCP, UDP
+from scapy.layers.inet6 import IPv6
+
+from raw_capture import RawFrame, ip_to_str, parse_headers
+
+logger = logging.getLogger(__name__)
+
+# CICFlowMeter defaults (microseconds)
+FLOW_TIMEOUT = int(float(os.environ.get("FLOW_ACTIVE_TIMEOUT", 120)) * 1_000_000)
+ACTIVITY_TIMEOUT = 5_000_000
+SUBFLOW_GAP = 1_000_000
+# Streaming flow table only: a flow with no packets for this long is finished
+IDLE_TIMEOUT = int(float(os.environ.get("FLOW_IDLE_TIMEOUT", 30)) * 1_000_000)
+EXPIRY_INTERVAL = 1_000_000
+
+CIC_TIMESTAMP_FORMAT = "%d/%m/%Y %I:%M:%S %p"
+
+FLOW_COLUMNS = [
+    "Flow ID",
+    "Src IP",
+    "Src Port",
+    "Dst IP",
+    "Dst Port",
+    "Protocol",
+    "Timestamp",
+    "Flow Duration",
+    "Tot Fwd Pkts",
+    "Tot Bwd Pkts",
+    "TotLen Fwd Pkts",
+    "TotLen Bwd Pkts",
+    "Fwd Pkt Len Max",
+    "Fwd Pkt Len Min",
+    "Fwd Pkt Len Mean",
+    "Fwd Pkt Len Std",
+    "Bwd Pkt Len Max",
+    "Bwd Pkt Len Min",
+    "Bwd Pkt Len Mean",
+    "Bwd Pkt Len Std",
+    "Flow Byts/s",
+    "Flow Pkts/s",
+    "Flow IAT Mean",
+    "Flow IAT Std",
+    "Flow IAT Max",
+    "Flow IAT Min",
+    "Fwd IAT Tot",
+    "Fwd IAT Mean",
+    "Fwd IAT Std",
+    "Fwd IAT Max",
+    "Fwd IAT Min",
+    "Bwd IAT Tot",
+    "Bwd IAT Mean",
+    "Bwd IAT Std",
+    "Bwd IAT Max",
+    "Bwd IAT Min",
+    "Fwd PSH Flags",
+    "Bwd PSH Flags",
+    "Fwd URG Flags",
+    "Bwd URG Flags",
+    "Fwd Header Len",
+    "Bwd Header Len",
+    "Fwd Pkts/s",
+    "Bwd Pkts/s",
+    "Pkt Len Min",
+    "Pkt Len Max",
+    "Pkt Len Mean",
+    "Pkt Len Std",
+    "Pkt Len Var",
+    "FIN Flag Cnt",
+    "SYN Flag Cnt",
+    "RST Flag Cnt",
+    "PSH Flag Cnt",
+    "ACK Flag Cnt",
+    "URG Flag Cnt",
+    "CWE Flag Count",
+    "ECE Flag Cnt",
+    "Down/Up Ratio",
+    "Pkt Size Avg",
+    "Fwd Seg Size Avg",
+    "Bwd Seg Size Avg",
+    "Fwd Byts/b Avg",
+    "Fwd Pkts/b Avg",
+    "Fwd Blk Rate Avg",
+    "Bwd Byts/b Avg",
+    "Bwd Pkts/b Avg",
+    "Bwd Blk Rate Avg",
+    "Subflow Fwd Pkts",
+    "Subflow Fwd Byts",
+    "Subflow Bwd Pkts",
+    "Subflow Bwd Byts",
+    "Init Fwd Win Byts",
+    "Init Bwd Win Byts",
+    "Fwd Act Data Pkts",
+    "Fwd Seg Size Min",
+    "Active Mean",
+    "Active Std",
+    "Active Max",
+    "Active Min",
+    "Idle Mean",
+    "Idle Std",
+    "Idle Max",
+    "Idle Min",
+    "Label",
+]
+
+FIN, SYN, RST, PSH, ACK, URG, ECE, CWR = 0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80
+
+# Header fields of a single packet, the only thing the flow meter needs
+PacketInfo = namedtuple(
+    "PacketInfo",
+    [
+        "ts",
+        "src",
+        "dst",
+        "sport",
+        "dport",
+        "proto",
+        "payload_len",
+        "header_len",
+        "flags",
+        "window",
+    ],
+)
+
+
+def decode_frame(frame: RawFrame):
+    """PacketInfo straight from raw frame bytes (no scapy dissection)"""
+    h = parse_headers(frame.data, frame.linktype)
+    if h is None or h.proto not in (6, 17):
+        return None
+    return PacketInfo(
+        round(frame.ts * 1_000_000),
+        ip_to_str(h.src),
+        ip_to_str(h.dst),
+        h.sport,
+        h.dport,
+        h.proto,
+        h.payload_len,
+        h.header_len,
+        h.tcp_flags,
+        h.window,
+    )
+
+
+def _l4_length(ip) -> int:
+    """Transport length from the IP header, as ``parse_headers`` computes it:
+    an Ethernet trailer (scapy ``Padding``) is not part of it"""
+    if isinstance(ip, IP):
+        if ip.len is not None:
+            return ip.len - (ip.ihl or 5) * 4
+    elif ip.plen is not None:
+        return ip.plen
+    return len(ip.payload)
+
+
+def decode_packet(pkt):
+    """Return PacketInfo for TCP/UDP over IPv4/IPv6, None otherwise"""
+    if isinstance(pkt, RawFrame):
+        return decode_frame(pkt)
+    if pkt.haslayer(IP):
+        ip = pkt[IP]
+    elif pkt.haslayer(IPv6):
+        ip = pkt[IPv6]
+    else:
+        return None
+
+    ts = round(float(pkt.time) * 1_000_000)
+    l4_len = _l4_length(ip)
+    if pkt.haslayer(TCP):
+        l4 = pkt[TCP]
+        header_len = (l4.dataofs or 5) * 4
+        return PacketInfo(
+            ts,
+            ip.src,
+            ip.dst,
+            l4.sport,
+            l4.dport,
+            6,
+            max(l4_len - header_len, 0),
+            header_len,
+            int(l4.flags),
+            l4.window,
+        )
+    if pkt.haslayer(UDP):
+        l4 = pkt[UDP]
+        udp_len = l4.len if l4.len is not None else l4_len
+        return PacketInfo(
+            ts, ip.src, ip.dst, l4.sport, l4.dport, 17, max(udp_len - 8, 0), 8, 0, 0
+        )
+    return None
+
+
+class RunningStats:
+    """Welford running mean/std plus min/max/total, O(1) memory per feature"""
+
+    __slots__ = ("n", "mean", "m2", "min", "max", "total")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = 0
+        self.max = 0
+        self.total = 0
+
+    def add(self, x):
+        self.n += 1
+        if self.n == 1:
+            self.min = self.max = x
+        elif x < self.min:
+            self.min = x
+        elif x > self.max:
+            self.max = x
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self):
+        # CICFlowMeter (commons-math) reports the sample standard deviation
+        return (self.m2 / (self.n - 1)) ** 0.5 if self.n > 1 else 0.0
+
+    @property
+    def var(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+
+class Flow:
+    """Running statistics of one bidirectional flow, forward = first packet's side"""
+
+    def __init__(self, info: PacketInfo):
+        self.src, self.dst = info.src, info.dst
+        self.sport, self.dport = info.sport, info.dport
+        self.proto = info.proto
+        self.start = info.ts
+        self.last = info.ts
+        self.last_fwd = self.last_bwd = None
+
+        self.fwd_len = RunningStats()
+        self.bwd_len = RunningStats()
+        self.all_len = RunningStats()
+        self.flow_iat = RunningStats()
+        self.fwd_iat = RunningStats()
+        self.bwd_iat = RunningStats()
+        self.active = RunningStats()
+        self.idle = RunningStats()
+
+        self.fwd_header = self.bwd_header = 0
+        self.fwd_header_min = 0
+        self.fwd_act_data = 0
+        self.fwd_psh = self.bwd_psh = self.fwd_urg = self.bwd_urg = 0
+        self.flag_counts = dict.fromkeys((FIN, SYN, RST, PSH, ACK, URG, ECE, CWR), 0)
+        self.init_fwd_win = -1
+        self.init_bwd_win = -1
+        self.fin_fwd = self.fin_bwd = False
+        self.rst = False
+        # Active/idle and subflow tracking as done by CICFlowMeter
+        self.start_active = self.end_active = info.ts
+        self.sf_count = 0
+        self.sf_last = -1
+
+    def is_forward(self, info: PacketInfo) -> bool:
+        return info.src == self.src and info.sport == self.sport
+
+    def add(self, info: PacketInfo):
+        ts, length, flags = info.ts, info.payload_len, info.flags
+
+        if ts - self.end_active > ACTIVITY_TIMEOUT:
+            if self.end_active > self.start_active:
+                self.active.add(self.end_active - self.start_active)
+            self.idle.add(ts - self.end_active)
+            self.start_active = self.end_active = ts
+        else:
+            self.end_active = ts
+
+        if self.sf_last == -1 or ts - self.sf_last > SUBFLOW_GAP:
+            self.sf_count += 1
+        self.sf_last = ts
+
+        if self.all_len.n:
+            self.flow_iat.add(ts - self.last)
+        self.all_len.add(length)
+
+        if self.is_forward(info):
+            if self.last_fwd is None:
+                if info.proto == 6:
+                    self.init_fwd_win = info.window
+                self.fwd_header_min = info.header_len
+            else:
+                self.fwd_iat.add(ts - self.last_fwd)
+                self.fwd_header_min = min(self.fwd_header_min, info.header_len)
+            self.last_fwd = ts
+            self.fwd_len.add(length)
+            self.fwd_header += info.header_len
+            self.fwd_act_data += length > 0
+            self.fwd_psh += bool(flags & PSH)
+            self.fwd_urg += bool(flags & URG)
+            self.fin_fwd |= bool(flags & FIN)
+        else:
+            if self.last_bwd is None:
+                if info.proto == 6:
+                    self.init_bwd_win = info.window
+            else:
+                self.bwd_iat.add(ts - self.last_bwd)
+            self.last_bwd = ts
+            self.bwd_len.add(length)
+            self.bwd_header += info.header_len
+            self.bwd_psh += bool(flags & PSH)
+            self.bwd_urg += bool(flags & URG)
+            self.fin_bwd |= bool(flags & FIN)
+
+        if flags:
+            for mask in self.flag_counts:
+                if flags & mask:
+                    self.flag_counts[mask] += 1
+        self.rst |= bool(flags & RST)
+        self.last = ts
+
+    @property
+    def finished(self) -> bool:
+        return self.rst or (self.fin_fwd and self.fin_bwd)
+
+    def to_record(self) -> dict:
+        active = self.active
+        if self.end_active > self.start_active:
+            active.add(self.end_active - self.start_active)
+            self.start_active = self.end_active
+
+        duration = self.last - self.start
+        seconds = duration / 1_000_000
+        fl, bl, pl = self.fwd_len, self.bwd_len, self.all_len
+        fi, bi, fa, idle = self.fwd_iat, self.bwd_iat, self.flow_iat, self.idle
+        n_fwd, n_bwd = fl.n, bl.n
+        tot_fwd, tot_bwd = fl.total, bl.total
+        sf_count = max(self.sf_count, 1)
+        flags = self.flag_counts
+
+        return {
+            "Flow ID": f"{self.src}-{self.dst}-{self.sport}-{self.dport}-{self.proto}",
+            "Src IP": self.src,
+            "Src Port": self.sport,
+            "Dst IP": self.dst,
+            "Dst Port": self.dport,
+            "Protocol": self.proto,
+            "Timestamp": datetime.fromtimestamp(self.start / 1_000_000).strftime(
+                CIC_TIMESTAMP_FORMAT
+            ),
+            "Flow Duration": duration,
+            "Tot Fwd Pkts": n_fwd,
+            "Tot Bwd Pkts": n_bwd,
+            "TotLen Fwd Pkts": tot_fwd,
+            "TotLen Bwd Pkts": tot_bwd,
+            "Fwd Pkt Len Max": fl.max,
+            "Fwd Pkt Len Min": fl.min,
+            "Fwd Pkt Len Mean": fl.mean,
+            "Fwd Pkt Len Std": fl.std,
+            "Bwd Pkt Len Max": bl.max,
+            "Bwd Pkt Len Min": bl.min,
+            "Bwd Pkt Len Mean": bl.mean,
+            "Bwd Pkt Len Std": bl.std,
+            "Flow Byts/s": (tot_fwd + tot_bwd) / seconds if seconds > 0 else 0,
+            "Flow Pkts/s": (n_fwd + n_bwd) / seconds if seconds > 0 else 0,
+            "Flow IAT Mean": fa.mean,
+            "Flow IAT Std": fa.std,
+            "Flow IAT Max": fa.max,
+            "Flow IAT Min": fa.min,
+            "Fwd IAT Tot": fi.total,
+            "Fwd IAT Mean": fi.mean,
+            "Fwd IAT Std": fi.std,
+            "Fwd IAT Max": fi.max,
+            "Fwd IAT Min": fi.min,
+            "Bwd IAT Tot": bi.total,
+            "Bwd IAT Mean": bi.mean,
+            "Bwd IAT Std": bi.std,
+            "Bwd IAT Max": bi.max,
+            "Bwd IAT Min": bi.min,
+            "Fwd PSH Flags": self.fwd_psh,
+            "Bwd PSH Flags": self.bwd_psh,
+            "Fwd URG Flags": self.fwd_urg,
+            "Bwd URG Flags": self.bwd_urg,
+            "Fwd Header Len": self.fwd_header,
+            "Bwd Header Len": self.bwd_header,
+            "Fwd Pkts/s": n_fwd / seconds if seconds > 0 else 0,
+            "Bwd Pkts/s": n_bwd / seconds if seconds > 0 else 0,
+            "Pkt Len Min": pl.min,
+            "Pkt Len Max": pl.max,
+            "Pkt Len Mean": pl.mean,
+            "Pkt Len Std": pl.std,
+            "Pkt Len Var": pl.var,
+            "FIN Flag Cnt": flags[FIN],
+            "SYN Flag Cnt": flags[SYN],
+            "RST Flag Cnt": flags[RST],
+            "PSH Flag Cnt": flags[PSH],
+            "ACK Flag Cnt": flags[ACK],
+            "URG Flag Cnt": flags[URG],
+            "CWE Flag Count": flags[CWR],
+            "ECE Flag Cnt": flags[ECE],
+            "Down/Up Ratio": n_bwd // n_fwd if n_fwd > 0 else 0,
+            "Pkt Size Avg": (tot_fwd + tot_bwd) / (n_fwd + n_bwd),
+            "Fwd Seg Size Avg": fl.mean,
+            "Bwd Seg Size Avg": bl.mean,
+            # Bulk features are 0 in practically every CICFlowMeter-4.0 output
+            "Fwd Byts/b Avg": 0,
+            "Fwd Pkts/b Avg": 0,
+            "Fwd Blk Rate Avg": 0,
+            "Bwd Byts/b Avg": 0,
+            "Bwd Pkts/b Avg": 0,
+            "Bwd Blk Rate Avg": 0,
+            "Subflow Fwd Pkts": n_fwd // sf_count,
+            "Subflow Fwd Byts": tot_fwd // sf_count,
+            "Subflow Bwd Pkts": n_bwd // sf_count,
+            "Subflow Bwd Byts": tot_bwd // sf_count,
+            "Init Fwd Win Byts": self.init_fwd_win,
+            "Init Bwd Win Byts": self.init_bwd_win,
+            "Fwd Act Data Pkts": self.fwd_act_data,
+            "Fwd Seg Size Min": self.fwd_header_min,
+            "Active Mean": active.mean,
+            "Active Std": active.std,
+            "Active Max": active.max,
+            "Active Min": active.min,
+            "Idle Mean": idle.mean,
+            "Idle Std": idle.std,
+            "Idle Max": idle.max,
+            "Idle Min": idle.min,
+            "Label": "No Label",
+        }
+
+
+def flow_key(info: PacketInfo):
+    """Direction-independent 5-tuple key"""
+    a = (info.src, info.sport)
+    b = (info.dst, info.dport)
+    return (a, b, info.proto) if a <= b else (b, a, info.proto)
+
+
+class FlowTable:
+    """Long-lived flow table keyed by 5-tuple.
+
+    Packets update per-flow running statistics as they arrive; a flow is emitted
+    as a finished record on FIN (both sides) / RST, after ``idle_timeout`` without
+    packets, or once it has been open for ``active_timeout``. Finished records
+    queue up until ``drain`` hands them to detection.
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, active_timeout=FLOW_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.flows = {}
+        self.finished = []
+        self.lock = threading.Lock()
+        self._last_expiry = 0
+        self._last_ts = None
+        self._last_seen = 0.0
+
+    def add(self, info: PacketInfo):
+        key = flow_key(info)
+        with self.lock:
+            flow = self.flows.get(key)
+            if flow is not None and (
+                info.ts - flow.start > self.active_timeout
+                or info.ts - flow.last > self.idle_timeout
+            ):
+                self.finished.append(flow.to_record())
+                flow = None
+            if flow is None:
+                flow = self.flows[key] = Flow(info)
+
+            flow.add(info)
+            if flow.finished:
+                self.finished.append(flow.to_record())
+                del self.flows[key]
+            self._last_ts = info.ts
+            self._last_seen = time.monotonic()
+
+        # Sweep the whole table at most once per second of packet time
+        if info.ts - self._last_expiry > EXPIRY_INTERVAL:
+            self.expire(info.ts)
+
+    def add_packet(self, pkt):
+        info = decode_packet(pkt)
+        if info is not None:
+            self.add(info)
+
+    def expire(self, now_us: int) -> int:
+        """Finish flows that hit the idle or active timeout at time ``now_us``"""
+        with self.lock:
+            self._last_expiry = now_us
+            expired = [
+                key
+                for key, flow in self.flows.items()
+                if now_us - flow.last > self.idle_timeout
+                or now_us - flow.start > self.active_timeout
+            ]
+            for key in expired:
+                self.finished.append(self.flows.pop(key).to_record())
+        return len(expired)
+
+    def expire_idle(self) -> int:
+        """Expire flows while no packets arrive.
+
+        Packet time is advanced by the wall-clock time elapsed since the last
+        packet, which keeps replayed captures on their own timeline.
+        """
+        if self._last_ts is None:
+            return 0
+        elapsed = time.monotonic() - self._last_seen
+        return self.expire(self._last_ts + int(elapsed * 1_000_000))
+
+    def flush(self):
+        """Finish every open flow (end of capture)"""
+        with self.lock:
+            self.finished.extend(flow.to_record() for flow in self.flows.values())
+            self.flows.clear()
+
+    def has_finished(self) -> bool:
+        return bool(self.finished)
+
+    def drain(self) -> pd.DataFrame:
+        """Take all finished flow records accumulated so far"""
+        with self.lock:
+            records, self.finished = self.finished, []
+        return pd.DataFrame(records, columns=FLOW_COLUMNS)
+
+    def __len__(self):
+        return len(self.flows)
+
+
+def packets_to_flows(packets) -> pd.DataFrame:
+    """Assemble scapy packets / RawFrames into a CICFlowMeter-style flow table"""
+    table = FlowTable()
+    for pkt in packets:
+        table.add_packet(pkt)
+    table.flush()
+    flows = table.drain()
+    logger.debug(f"Assembled {len(flows)} flows from {len(packets)} packets")
+    return flows
@@ -0,0 +1,306 @@
+"""Columnar flow archive.
+
+Every batch's flows are written once, with their ``Label``, into a Parquet
+dataset partitioned by the hour the flow started
+(``flow_store/hour=2024051714/<batch>.parquet``). Column types are fixed by
+``normalize`` so files from either flow extractor share one schema, and
+``query`` pushes column projection and filters on Src IP, Dst IP, Protocol,
+Label, batch and time range down to the scan: whole hours are pruned by
+partition and row groups by their column statistics.
+
+Per-batch readers go through ``read_batch_flows``, which also understands the
+single Parquet files and CSVs archived before the dataset existed. Old benign
+batches are merged into ``compacted_<n>.parquet`` segments per hour (see
+``retention``); readers pick a batch's row groups out of them.
+"""
+
+import logging
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from flow_meter import CIC_TIMESTAMP_FORMAT
+from mongo_schema import LOCAL_TZ
+
+logger = logging.getLogger(__name__)
+
+FLOW_STORE_DIR = Path(
+    os.environ.get("FLOW_STORE_DIR", Path(__file__).parent / "flow_store")
+)
+FLOWS_SUFFIX = ".parquet"
+FLOWS_COMPRESSION = "zstd"
+# Small row groups keep per-batch reads streaming in bounded memory
+ROW_GROUP_ROWS = 10_000
+# Rows per chunk when a batch is read incrementally
+CHUNK_ROWS = 10_000
+# Columns added by the store; not part of a batch's CICFlowMeter columns
+STORE_COLUMNS = ["flow_time", "batch"]
+STRING_COLUMNS = ["Flow ID", "Src IP", "Dst IP", "Timestamp", "Label", "batch"]
+INT_COLUMNS = ["Src Port", "Dst Port", "Protocol"]
+PARTITIONING = ds.partitioning(pa.schema([("hour", pa.int64())]), flavor="hive")
+
+
+def batch_label(is_attack) -> str:
+    return "Attack" if is_attack else "Benign"
+
+
+def local_time(value) -> pd.Timestamp:
+    """``value`` as a naive local time, like ``flow_time``; aware values are
+    converted to the local zone first rather than having their offset dropped"""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert(LOCAL_TZ).tz_localize(None)
+    return ts
+
+
+def hour_key(ts) -> int:
+    """Partition key of a timestamp: 2024-05-17 14:xx -> 2024051714"""
+    return int(pd.Timestamp(ts).strftime("%Y%m%d%H"))
+
+
+def normalize(flows: pd.DataFrame, is_attack, batch_name, created_at) -> pa.Table:
+    """Flows plus Label / flow_time / batch, as a table with the store's types"""
+    df = flows.assign(Label=batch_label(is_attack), batch=batch_name)
+    flow_time = pd.to_datetime(
+        df["Timestamp"], format=CIC_TIMESTAMP_FORMAT, errors="coerce"
+    )
+    # Flows without a parseable start time are filed under the batch time
+    fallback = local_time(created_at)
+    df["flow_time"] = flow_time.fillna(fallback).astype("datetime64[us]")
+    fields = []
+    for col in df.columns:
+        if col in STRING_COLUMNS:
+            df[col] = df[col].astype(str)
+            fields.append(pa.field(col, pa.string()))
+        elif col == "flow_time":
+            fields.append(pa.field(col, pa.timestamp("us")))
+        elif col in INT_COLUMNS:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(-1).astype("int64")
+            fields.append(pa.field(col, pa.int64()))
+        else:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+            fields.append(pa.field(col, pa.float64()))
+    return pa.Table.from_pandas(df, schema=pa.schema(fields), preserve_index=False)
+
+
+class FlowStore:
+    def __init__(self, root=FLOW_STORE_DIR):
+        self.root = Path(root)
+
+    def write_batch(self, flows, batch_name, created_at, is_attack=False) -> list:
+        """Archive one batch's flows; returns the files written (one per hour)"""
+        table = normalize(flows, is_attack, batch_name, created_at)
+        hours = pc.strftime(table["flow_time"], format="%Y%m%d%H")
+        files = []
+        for hour in pc.unique(hours).to_pylist():
+            part = table.filter(pc.equal(hours, hour))
+            path = self.root / f"hour={hour}" / f"{batch_name}{FLOWS_SUFFIX}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            pq.write_table(
+                part,
+                path,
+                compression=FLOWS_COMPRESSION,
+                row_group_size=ROW_GROUP_ROWS,
+            )
+            files.append(str(path))
+        return files
+
+    def dataset(self):
+        return ds.dataset(self.root, format="parquet", partitioning=PARTITIONING)
+
+    def query(
+        self,
+        columns=None,
+        src_ip=None,
+        dst_ip=None,
+        protocol=None,
+        label=None,
+        batch=None,
+        start=None,
+        end=None,
+        limit=None,
+    ) -> pd.DataFrame:
+        """Flows matching every given filter, only ``columns`` read.
+
+        ``src_ip`` / ``dst_ip`` / ``protocol`` / ``label`` / ``batch`` take a
+        value or a list of values; ``start`` / ``end`` bound the flow start
+        time (end exclusive).
+        """
+        if not self.root.exists():
+            return pd.DataFrame(columns=columns or [])
+        dataset = self.dataset()
+        filters = []
+        for col, value in (
+            ("Src IP", src_ip),
+            ("Dst IP", dst_ip),
+            ("Protocol", protocol),
+            ("Label", label),
+            ("batch", batch),
+        ):
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple)) else [value]
+            if col == "Protocol":
+                values = [int(v) for v in values]
+            filters.append(ds.field(col).isin(values))
+        if start is not None:
+            start = local_time(start)
+            filters.append(ds.field("hour") >= hour_key(start))
+            filters.append(
+                ds.field("flow_time") >= pa.scalar(start, pa.timestamp("us"))
+            )
+        if end is not None:
+            end = local_time(end)
+            filters.append(ds.field("hour") <= hour_key(end))
+            filters.append(ds.field("flow_time") < pa.scalar(end, pa.timestamp("us")))
+
+        expression = None
+        for f in filters:
+            expression = f if expression is None else expression & f
+        if columns:
+            unknown = set(columns) - set(dataset.schema.names)
+            if unknown:
+                raise ValueError(f"Unknown columns: {sorted(unknown)}")
+        if limit is not None:
+            table = dataset.head(int(limit), columns=columns, filter=expression)
+        else:
+            table = dataset.to_table(columns=columns, filter=expression)
+        return table.to_pandas()
+
+
+def batch_flows_paths(batch: dict) -> list:
+    """The archived flow files of a batch document, newest format first"""
+    if batch.get("flows_files"):
+        return [Path(p) for p in batch["flows_files"]]
+    path = batch.get("flows_file_path") or batch.get("csv_file_path")
+    return [Path(path)] if path else []
+
+
+def _batch_files(batch: dict) -> list:
+    paths = [p for p in batch_flows_paths(batch) if p.exists()]
+    if not paths:
+        raise FileNotFoundError(f"No flow file for batch {batch.get('batch_name')}")
+    return paths
+
+
+def batch_row_groups(parquet: pq.ParquetFile, batch_name) -> list:
+    """Row groups of ``batch_name`` in a flow file.
+
+    A compacted file holds several batches, each in row groups of its own, so
+    the ``batch`` column statistics tell them apart; every row group of a
+    per-batch file (or one without the column) belongs to the batch.
+    """
+    metadata = parquet.metadata
+    index = parquet.schema_arrow.get_field_index("batch")
+    groups = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(index).statistics if index >= 0 else None
+        if (
+            stats is None
+            or not stats.has_min_max
+            or batch_name is None
+            or stats.min == stats.max == batch_name
+        ):
+            groups.append(i)
+    return groups
+
+
+def batch_columns(batch: dict) -> list:
+    """Column names of a batch's archived flows, ``Label`` included"""
+    paths = _batch_files(batch)
+    if paths[0].suffix == FLOWS_SUFFIX:
+        names = pq.read_schema(paths[0]).names
+        return [c for c in names if c not in STORE_COLUMNS]
+    header = pd.read_csv(paths[0], nrows=0).columns.tolist()
+    return header + ([] if "Label" in header else ["Label"])
+
+
+def _check_columns(batch, columns):
+    if columns is None:
+        return batch_columns(batch)
+    unknown = set(columns) - set(batch_columns(batch))
+    if unknown:
+        raise ValueError(f"Unknown columns: {sorted(unknown)}")
+    return list(columns)
+
+
+def read_batch_flows(batch: dict, columns=None) -> pd.DataFrame:
+    """Load a batch's archived flows, ``Label`` included.
+
+    ``columns`` limits what is read (Parquet only reads those columns).
+    Raises ``FileNotFoundError`` when the batch has no flow file on disk.
+    """
+    paths = _batch_files(batch)
+    columns = _check_columns(batch, columns)
+    if paths[0].suffix == FLOWS_SUFFIX:
+        chunks = list(iter_batch_flows(batch, columns))
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(chunks, ignore_index=True)
+    # Legacy CSV archives carry no label (or a stale one)
+    df = pd.read_csv(paths[0])
+    df["Label"] = batch_label(batch.get("is_attack", False))
+    return df[columns]
+
+
+def iter_batch_flows(batch: dict, columns=None, chunk_rows=CHUNK_ROWS):
+    """Yield a batch's flows as DataFrames of at most ``chunk_rows`` rows,
+    holding about one row group in memory at a time"""
+    paths = _batch_files(batch)
+    columns = _check_columns(batch, columns)
+    if paths[0].suffix == FLOWS_SUFFIX:
+        for path in paths:
+            # pre_buffer would read ahead whole files
+            parquet = pq.ParquetFile(path, pre_buffer=False)
+            groups = batch_row_groups(parquet, batch.get("batch_name"))
+            if not groups:
+                continue
+            for record_batch in parquet.iter_batches(
+                chunk_rows, row_groups=groups, columns=columns
+            ):
+                if record_batch.num_rows:
+                    yield record_batch.to_pandas()
+        return
+    label = batch_label(batch.get("is_attack", False))
+    file_columns = [c for c in columns if c != "Label"]
+    for chunk in pd.read_csv(paths[0], chunksize=chunk_rows, usecols=file_columns):
+        chunk["Label"] = label
+        yield chunk[columns]
+
+
+def count_batch_flows(batch: dict) -> int:
+    paths = _batch_files(batch)
+    if paths[0].suffix == FLOWS_SUFFIX:
+        # From the Parquet footers, no data pages read
+        total = 0
+        for path in paths:
+            parquet = pq.ParquetFile(path)
+            for i in batch_row_groups(parquet, batch.get("batch_name")):
+                total += parquet.metadata.row_group(i).num_rows
+        return total
+    with open(paths[0], "rb") as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def read_batch_page(batch: dict, offset=0, limit=500, columns=None) -> pd.DataFrame:
+    """Rows ``offset`` .. ``offset + limit`` of a batch's flows"""
+    columns = _check_columns(batch, columns)
+    chunks, seen = [], 0
+    for chunk in iter_batch_flows(batch, columns):
+        start, seen = seen, seen + len(chunk)
+        if seen <= offset:
+            continue
+        chunks.append(chunk.iloc[max(offset - start, 0) :])
+        if sum(len(c) for c in chunks) >= limit:
+            break
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True).iloc[:limit]
+
+
+flow_store = FlowStore()
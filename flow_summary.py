@@ -0,0 +1,263 @@
+"""Incrementally maintained flow rollups behind ``/api/flows/summary``.
+
+Every ingested batch of flows is folded into per-minute buckets (flow count
+and counters of source IPs, destination IPs, destination ports and protocols)
+plus all-time totals, so a summary never rescans the flows collection.
+Answers are cached until the next batch arrives; an all-time summary is read
+straight from the totals.
+
+Buckets are kept for ``SUMMARY_RETENTION_MINUTES``. Counters of finished
+buckets are trimmed to their ``SUMMARY_BUCKET_KEYS`` largest entries, so
+top-N over a time range is exact for everything but very long tails; the
+totals are trimmed to their ``SUMMARY_TOTAL_KEYS`` largest entries per
+dimension before they are persisted, so their document stays bounded. Dirty
+buckets and the totals are written to MongoDB (``flow_summary``) every
+``SUMMARY_PERSIST_INTERVAL`` seconds and reloaded at startup.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+import heapq
+import logging
+import os
+import threading
+
+from bson import ObjectId
+import pandas as pd
+from pymongo import ReplaceOne
+
+from flow_meter import CIC_TIMESTAMP_FORMAT
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_RETENTION_MINUTES = int(os.environ.get("SUMMARY_RETENTION_MINUTES", 7 * 1440))
+SUMMARY_BUCKET_KEYS = int(os.environ.get("SUMMARY_BUCKET_KEYS", 500))
+SUMMARY_TOTAL_KEYS = int(os.environ.get("SUMMARY_TOTAL_KEYS", 5000))
+SUMMARY_PERSIST_INTERVAL = float(os.environ.get("SUMMARY_PERSIST_INTERVAL", 30))
+COLLECTION = "flow_summary"
+TOTALS_ID = "totals"
+# summary key -> flow column
+DIMENSIONS = {
+    "source_ips": "Src IP",
+    "destination_ips": "Dst IP",
+    "destination_ports": "Dst Port",
+    "protocols": "Protocol",
+}
+# Cached answers per (start, end, top); cleared on every batch
+CACHE_SIZE = 64
+
+
+def _new_bucket() -> dict:
+    return {"flows": 0, **{name: Counter() for name in DIMENSIONS}}
+
+
+def _trim(bucket, n):
+    for name in DIMENSIONS:
+        if len(bucket[name]) > n:
+            bucket[name] = Counter(dict(bucket[name].most_common(n)))
+
+
+def _top(counter, n) -> list:
+    return [
+        {"name": k, "value": v}
+        for k, v in heapq.nlargest(n, counter.items(), key=lambda kv: kv[1])
+    ]
+
+
+class FlowSummary:
+    def __init__(self, database=None):
+        self.database = database
+        self.lock = threading.Lock()
+        self.buckets = {}  # minute (naive datetime) -> bucket
+        self.totals = _new_bucket()
+        self.dirty = set()  # minutes (or TOTALS_ID) not yet persisted
+        self.version = 0
+        self._cache = {}
+        # Flows inserted by this process get later ids and are counted by
+        # add(); a rebuild only scans the ones before
+        self._since = ObjectId()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, flows: pd.DataFrame):
+        """Fold one batch of flows into the rollups"""
+        if flows is None or flows.empty:
+            return
+        minutes = pd.to_datetime(
+            flows["Timestamp"], format=CIC_TIMESTAMP_FORMAT, errors="coerce"
+        ).dt.floor("min")
+        frame = pd.DataFrame(
+            {name: flows[col].astype(str) for name, col in DIMENSIONS.items()}
+        )
+        frame["minute"] = minutes
+        frame = frame.dropna(subset=["minute"])
+        # Counted per (minute, value) in pandas; Python only sees the groups
+        counts = {name: frame.groupby(["minute", name]).size() for name in DIMENSIONS}
+        per_minute = frame.groupby("minute").size()
+
+        with self.lock:
+            for minute, n in per_minute.items():
+                minute = minute.to_pydatetime()
+                self.buckets.setdefault(minute, _new_bucket())["flows"] += int(n)
+                self.dirty.add(minute)
+            self.totals["flows"] += len(frame)
+            for name, series in counts.items():
+                for (minute, value), n in series.items():
+                    self.buckets[minute.to_pydatetime()][name][value] += int(n)
+                    self.totals[name][value] += int(n)
+            self.dirty.add(TOTALS_ID)
+            self._expire()
+            self.version += 1
+            self._cache.clear()
+
+    def _expire(self):
+        """Drop buckets past retention; trim finished ones (lock held)"""
+        if not self.buckets:
+            return
+        newest = max(self.buckets)
+        cutoff = newest - timedelta(minutes=SUMMARY_RETENTION_MINUTES)
+        for minute in [m for m in self.buckets if m < cutoff]:
+            del self.buckets[minute]
+            self.dirty.discard(minute)
+        for minute, bucket in self.buckets.items():
+            if minute != newest:
+                _trim(bucket, SUMMARY_BUCKET_KEYS)
+
+    def summary(self, start=None, end=None, top=10) -> dict:
+        """Top ``top`` values per dimension and per-minute flow counts for
+        ``start`` <= minute < ``end`` (naive datetimes; None = unbounded)"""
+        key = (start, end, top)
+        with self.lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            minutes = sorted(
+                m
+                for m in self.buckets
+                if (start is None or m >= start) and (end is None or m < end)
+            )
+            if start is None and end is None:
+                merged = self.totals
+            else:
+                merged = _new_bucket()
+                for minute in minutes:
+                    for name in DIMENSIONS:
+                        merged[name].update(self.buckets[minute][name])
+                    merged["flows"] += self.buckets[minute]["flows"]
+            result = {
+                "total_flows": merged["flows"],
+                **{f"top_{name}": _top(merged[name], top) for name in DIMENSIONS},
+                "traffic_over_time": [
+                    {"time": m.isoformat(), "count": self.buckets[m]["flows"]}
+                    for m in minutes
+                ],
+                "version": self.version,
+            }
+            if len(self._cache) >= CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = result
+            return result
+
+    # ---- persistence ----
+
+    @staticmethod
+    def _to_doc(_id, bucket) -> dict:
+        # IPs contain dots, so counters are stored as [value, count] pairs
+        return {
+            "_id": _id,
+            "flows": bucket["flows"],
+            **{name: list(bucket[name].items()) for name in DIMENSIONS},
+        }
+
+    @staticmethod
+    def _merge_doc(bucket, doc):
+        bucket["flows"] += doc.get("flows", 0)
+        for name in DIMENSIONS:
+            bucket[name].update(dict(doc.get(name, [])))
+
+    def persist(self) -> int:
+        """Write dirty buckets and the totals; returns how many documents"""
+        if self.database is None:
+            return 0
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            if TOTALS_ID in dirty:
+                _trim(self.totals, SUMMARY_TOTAL_KEYS)
+            docs = [
+                self._to_doc(
+                    _id, self.totals if _id == TOTALS_ID else self.buckets[_id]
+                )
+                for _id in dirty
+                if _id == TOTALS_ID or _id in self.buckets
+            ]
+        if not docs:
+            return 0
+        try:
+            self.database[COLLECTION].bulk_write(
+                [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs],
+                ordered=False,
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist flow summary: {e}")
+            with self.lock:
+                self.dirty |= dirty
+            return 0
+        return len(docs)
+
+    def load(self, flows_collection=None) -> bool:
+        """Restore persisted rollups; with none saved, rebuild them once from
+        ``flows_collection``"""
+        if self.database is None:
+            return False
+        collection = self.database[COLLECTION]
+        cutoff = datetime.now() - timedelta(minutes=SUMMARY_RETENTION_MINUTES)
+        totals = collection.find_one({"_id": TOTALS_ID})
+        if totals is not None:
+            # Merged, so flows ingested while loading are kept
+            with self.lock:
+                self._merge_doc(self.totals, totals)
+                for doc in collection.find({"_id": {"$gte": cutoff}}):
+                    bucket = self.buckets.setdefault(doc["_id"], _new_bucket())
+                    self._merge_doc(bucket, doc)
+                self.version += 1
+                self._cache.clear()
+            logger.info(f"Loaded flow summary ({len(self.buckets)} minute buckets)")
+            return True
+        if flows_collection is not None:
+            self.rebuild(flows_collection)
+        return False
+
+    def rebuild(self, flows_collection, chunk=50_000):
+        """Fold in every flow stored before this process started, ``chunk``
+        documents at a time; newer ones are already counted by ``add``"""
+        columns = ["Timestamp", *DIMENSIONS.values()]
+        projection = {"_id": 0, **{c: 1 for c in columns}}
+        rows = []
+        for doc in flows_collection.find({"_id": {"$lt": self._since}}, projection):
+            rows.append(doc)
+            if len(rows) >= chunk:
+                self.add(pd.DataFrame(rows, columns=columns))
+                rows = []
+        if rows:
+            self.add(pd.DataFrame(rows, columns=columns))
+        logger.info(f"Rebuilt flow summary from {self.totals['flows']} flows")
+
+    def _run(self):
+        while not self._stop.wait(SUMMARY_PERSIST_INTERVAL):
+            self.persist()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="flow-summary", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.persist()
+
+
+flow_summary = FlowSummary()
@@ -35,6 +35,8 @@ const BatchDetailPage = () => {
   const [note, setNote] = useState("");
   const [batchMeta, setBatchMeta] = useState(null);
   const [searchQuery, setSearchQuery] = useState("");
+  const [totalRows, setTotalRows] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     const fetchBatchData = async () => {
@@ -51,11 +53,16 @@ const BatchDetailPage = () => {
         setBatchMeta(batchData);
         setNote(batchData?.note || "");
 
-        if (batchData.csv_file_path) {
+        if (
+          batchData.flows_files?.length ||
+          batchData.flows_file_path ||
+          batchData.csv_file_path
+        ) {
           try {
             const csvResult = await getCsvData(id);
             setColumns(csvResult?.columns ?? []);
             setRows(csvResult?.rows ?? []);
+            setTotalRows(csvResult?.total ?? 0);
           } catch (csvError) {
             setColumns([]);
             setRows([]);
@@ -84,6 +91,19 @@ const BatchDetailPage = () => {
     }
   };
 
+  const handleLoadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const csvResult = await getCsvData(id, { offset: rows.length });
+      setRows((prev) => prev.concat(csvResult?.rows ?? []));
+      setTotalRows(csvResult?.total ?? 0);
+    } catch (err) {
+      console.error("Failed to load more rows:", err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleUpdate = async () => {
     try {
       await updateBatch(id, { note });
@@ -276,6 +296,18 @@ const BatchDetailPage = () => {
               </TableBody>
             </Table>
           </TableContainer>
+          {rows.length < totalRows && (
+            <Button
+              variant="outlined"
+              onClick={handleLoadMore}
+              disabled={loadingMore}
+              sx={{ mt: 2 }}
+            >
+              {loadingMore
+                ? "Loading..."
+                : `Load more (${rows.length} of ${totalRows} rows)`}
+            </Button>
+          )}
         </Paper>
       )}
     </Box>
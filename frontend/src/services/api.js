@@ -159,9 +159,11 @@ api.interceptors.request.use(
     return Promise.reject(error);
   }
 );
-export const getCsvData = async (batchId) => {
+export const getCsvData = async (batchId, { offset = 0, limit = 500 } = {}) => {
   try {
-    const response = await axios.get(`${API_BASE}/csv/${batchId}`);
+    const response = await axios.get(`${API_BASE}/csv/${batchId}`, {
+      params: { offset, limit },
+    });
 
     // Check if response exists
     if (!response.data) {
@@ -182,6 +184,7 @@ export const getCsvData = async (batchId) => {
     return {
       columns: parsedData.columns,
       rows: parsedData.rows,
+      total: parsedData.meta?.total ?? parsedData.rows.length,
     };
   } catch (error) {
     console.error("Failed to fetch CSV data:", error);
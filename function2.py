@@ -1,33 +1,62 @@
 from datetime import datetime
-from scapy.all import sniff, wrpcap, IP, TCP, UDP, ICMP
+from scapy.all import IP
 import time
 import os
 import numpy as np
 import pandas as pd
 import subprocess
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-import joblib
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import threading
+import queue
 import logging
 from pathlib import Path
-from keras.losses import MeanSquaredError
-from pymongo import MongoClient
 from dotenv import load_dotenv
 from flask_socketio import SocketIO
 from flask import Flask
 import sys
-from bson import ObjectId, json_util
-import shutil
+from bson import ObjectId
 from datetime import datetime
 import pytz
-import shutil
 from pathlib import Path
 import pytz
 from datetime import datetime
 from model_state import get_model
 from socket_instance import socketio, app
+from flow_meter import FlowTable, packets_to_flows
+from batching import MicroBatcher
+from live_feed import LiveFeed
+from packet_columns import (
+    PROTO_ICMP,
+    PROTO_TCP,
+    PROTO_UDP,
+    TCP_FLAGS,
+    PacketColumns,
+    as_columns,
+)
+from metrics import stage_timer, timed
+from work_queue import WorkQueue
+from mongo_writer import BulkWriter
+from flow_store import flow_store
+from flow_summary import flow_summary
+from retention import open_artifact, pcap_suffix, retention, tmp_path
+from mongo_schema import flow_times
+from model_registry import model_registry, models_for
+from ensemble import ensemble
+from inference import (
+    union_spec,
+    window_builder,
+    window_verdicts,
+)
+from raw_capture import (
+    RawFrame,
+    ip_to_str,
+    pack_frames,
+    parse_headers,
+    to_scapy,
+    unpack_frames,
+    write_pcap,
+)
 
 
 logging.basicConfig(
@@ -49,53 +78,90 @@ CFM_PATH = CICFLOWMETER_DIR / "cfm.bat"
 BATCH_DIR = BASE_DIR / "batches"
 BATCH_DIR.mkdir(parents=True, exist_ok=True)
 MODEL_DIR = BASE_DIR / "Model"
-CHUNK_SIZE = 5000
+CHUNK_SIZE = int(os.environ.get("BATCH_MAX_PACKETS", 5000))
+# A batch is processed once it has CHUNK_SIZE packets or is this many seconds old
+BATCH_MAX_LATENCY = float(os.environ.get("BATCH_MAX_LATENCY", 2.0))
+# Packets the sniff callback may queue before it starts dropping
+CAPTURE_QUEUE_SIZE = int(os.environ.get("CAPTURE_QUEUE_SIZE", 50000))
+FEED_QUEUE_SIZE = 1000
+# Live feed: one summary frame per interval plus at most FEED_MAX_ROWS sampled
+# packet rows per client and interval
+FEED_INTERVAL = float(os.environ.get("FEED_INTERVAL", 1.0))
+FEED_SAMPLE_RATE = float(os.environ.get("FEED_SAMPLE_RATE", 1.0))
+FEED_MAX_ROWS = int(os.environ.get("FEED_MAX_ROWS", 20))
+VN_TZ = pytz.timezone("Asia/Ho_Chi_Minh")
+# "threads" = analyze batches on the thread pool, "processes" = on worker
+# processes that load the models once (CPU-bound work runs outside the GIL)
+EXECUTION_MODE = os.environ.get("EXECUTION_MODE", "threads")
+BATCH_WORKERS = 12
+PROCESS_WORKERS = int(
+    os.environ.get("PROCESS_WORKERS", max(1, (os.cpu_count() or 2) - 1))
+)
+# Batches waiting for a worker; what happens beyond that is BATCH_QUEUE_POLICY
+# ("block", "drop_oldest" or "sample", see work_queue.py)
+BATCH_QUEUE_SIZE = int(os.environ.get("BATCH_QUEUE_SIZE", 24))
+BATCH_QUEUE_POLICY = os.environ.get("BATCH_QUEUE_POLICY", "block")
+# Batches picked up while the queue is this full skip pcap archiving
+BATCH_DEGRADE_AT = float(os.environ.get("BATCH_DEGRADE_AT", 0.5))
+# Batch and flow documents are written in unordered bulk writes of up to
+# MONGO_BULK_MAX_DOCS, at the latest MONGO_BULK_MAX_LATENCY seconds after queuing
+MONGO_BULK_MAX_DOCS = int(os.environ.get("MONGO_BULK_MAX_DOCS", 1000))
+MONGO_BULK_MAX_LATENCY = float(os.environ.get("MONGO_BULK_MAX_LATENCY", 1.0))
+# "python" = in-process flow meter, "cicflowmeter" = legacy cfm.bat subprocess
+FLOW_EXTRACTOR = os.environ.get("FLOW_EXTRACTOR", "python")
 
 for directory in [OUTPUT_DIR, CSV_OUTPUT_DIR, BATCH_DIR, CICFLOWMETER_DIR, MODEL_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
 
-custom_objects = {"mse": MeanSquaredError()}
-try:
-    AU_MODEL = load_model(MODEL_DIR / "autoencoder.h5", compile=False)
-    KMEANS_MODEL = joblib.load(MODEL_DIR / "kmeans_model.pkl")
-    SVM_MODEL = joblib.load(MODEL_DIR / "ocsvm_model.joblib")
+load_dotenv()
+
+# Models load on first use (model_registry); MongoDB and Socket.IO are handed
+# in by the server through configure_backends()
+db = None
+batches_collection = None
+alerts_collection = None
+mongo_writer = BulkWriter(
+    max_docs=MONGO_BULK_MAX_DOCS, max_latency=MONGO_BULK_MAX_LATENCY
+)
 
-    ANOMALY_DATA = np.load(MODEL_DIR / "autoencoder_train_info.npz")
-    AUTOENCODER_THRESHOLD = ANOMALY_DATA["threshold"].item()
 
-    SCALER_AU = joblib.load(MODEL_DIR / "scaler_autoencoder.pkl")
-    SCALER_KMEANS = joblib.load(MODEL_DIR / "scaler_kmeans.pkl")
-    SCALER_SVM = joblib.load(MODEL_DIR / "scaler_svm.pkl")
+def configure_backends(database=None, emitter=None):
+    """Set the MongoDB database and/or Socket.IO emitter (server startup, replay)"""
+    global db, batches_collection, alerts_collection, socketio
+    if database is not None:
+        db = database
+        batches_collection = db["batches"]
+        alerts_collection = db["alerts"]
+        mongo_writer.database = db
+        flow_summary.database = db
+        retention.database = db
+    if emitter is not None:
+        socketio = emitter
+        live_feed.socketio = emitter
 
-    KMEANS_MAPPING = joblib.load(MODEL_DIR / "kmeans_label_mapping.pkl")
-    logger.info("ML models loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load ML models: {e}")
-    raise
-load_dotenv()
 
+def configure_storage(batch_dir):
+    """Point batch pcaps, the flow store and retention at ``batch_dir`` (replay).
+
+    Process-mode workers get the same directory through the pool initializer.
+    """
+    global BATCH_DIR
+    BATCH_DIR = Path(batch_dir)
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    flow_store.root = BATCH_DIR / "flow_store"
+    retention.batch_dir = BATCH_DIR
 
-try:
-    client = MongoClient(os.environ.get("MONGO_URI"))
-    db = client["network_monitor"]
-    batches_collection = db["batches"]
-    alerts_collection = db["alerts"]
-    logger.info("Connected to MongoDB")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {e}")
-    raise
 
-packet_count = 0
-packet_buffer = []
 file_index = 0
 all_predictions = []
-executor = ThreadPoolExecutor(max_workers=12)
 lock = threading.Lock()
 sniff_thread = None
 sniff_control = threading.Event()
 is_sniffing = False
 total_packet_count = 0
+# Flows live across batches; each batch scores the flows finished since the last one
+flow_table = FlowTable()
 
 
 def extract_features_with_cicflowmeter(pcap_path: Path, output_dir: Path) -> Path:
@@ -128,90 +194,6 @@ def extract_features_with_cicflowmeter(pcap_path: Path, output_dir: Path) -> Pat
         return None
 
 
-def aggregate_features(csv_file: Path) -> pd.DataFrame:
-    """Aggregate network flow features"""
-    try:
-        data = pd.read_csv(csv_file)
-        if data.empty:
-            logger.warning("Empty CSV file: %s", csv_file)
-            return None
-
-        model = get_model()
-        logger.info(f"Aggregating features for model: {model}")
-
-        if model == "autoencoder":
-            selected_cols = [
-                "Flow Duration_mean",
-                "Fwd IAT Tot_std",
-                "Fwd IAT Max_std",
-                "Fwd IAT Std_mean",
-                "Fwd IAT Std_std",
-                "Bwd IAT Max_mean",
-            ]
-            config = {
-                "Flow Duration": ["mean"],
-                "Fwd IAT Tot": ["std"],
-                "Fwd IAT Max": ["std"],
-                "Fwd IAT Std": ["mean", "std"],
-                "Bwd IAT Max": ["mean"],
-            }
-        elif model == "kmeans":
-            selected_cols = [
-                "Flow Duration_mean",
-                "Fwd IAT Tot_std",
-                "Fwd IAT Max_std",
-                "Fwd IAT Std_mean",
-                "Fwd IAT Std_std",
-                "Bwd IAT Max_mean",
-            ]
-            config = {
-                "Flow Duration": ["mean"],
-                "Fwd IAT Tot": ["std"],
-                "Fwd IAT Max": ["std"],
-                "Fwd IAT Std": ["mean", "std"],
-                "Bwd IAT Max": ["mean"],
-            }
-        elif model == "svm":
-            selected_cols = [
-                "Flow Duration_mean",
-                "Fwd IAT Tot_mean",
-                "Fwd IAT Tot_std",
-                "Bwd IAT Max_mean",
-                "Bwd IAT Std_mean",
-            ]
-            config = {
-                "Flow Duration": ["mean"],
-                "Fwd IAT Tot": ["mean", "std"],
-                "Bwd IAT Max": ["mean"],
-                "Bwd IAT Std": ["mean"],
-            }
-        else:
-            logger.error(f"Unknown model: {model}")
-            return None
-
-        # Check for missing columns
-        missing = [col for col in config if col not in data.columns]
-        if missing:
-            logger.warning("Missing columns in CSV: %s", missing)
-            return None
-
-        # Aggregation
-        aggregated = {}
-        for col, aggs in config.items():
-            for agg in aggs:
-                key = f"{col}_{agg}"
-                aggregated[key] = [data[col].agg(agg)]
-
-        df = pd.DataFrame(aggregated).reindex(columns=selected_cols)
-        df = df.astype(np.float32)
-        logger.debug(f"Aggregated features: {df}")
-        return df
-
-    except Exception as e:
-        logger.error("Feature aggregation failed: %s", e)
-        return None
-
-
 def extract_basic_features(packets, model):
     # Định nghĩa danh sách feature cho từng model
     if model == "autoencoder" or model == "kmeans":
@@ -236,13 +218,14 @@ def extract_basic_features(packets, model):
         return None
 
     # Tính toán các đặc trưng cơ bản
-    times = [float(pkt.time) for pkt in packets]
-    duration = max(times) - min(times) if len(times) > 1 else 0
+    cols = as_columns(packets)
+    times = cols.ts
+    duration = float(times.max() - times.min()) if len(times) > 1 else 0
 
-    lengths = [len(pkt) for pkt in packets]
-    mean_len = np.mean(lengths) if lengths else 0
-    std_len = np.std(lengths) if lengths else 0
-    max_len = np.max(lengths) if lengths else 0
+    lengths = cols.length
+    mean_len = float(lengths.mean()) if len(lengths) else 0
+    std_len = float(lengths.std()) if len(lengths) else 0
+    max_len = int(lengths.max()) if len(lengths) else 0
 
     # Tùy model, build dict feature phù hợp
     feature_dict = {
@@ -260,20 +243,16 @@ def extract_basic_features(packets, model):
     return {col: feature_dict.get(col, 0) for col in selected_cols}
 
 
-def detect_anomalies_AU(features: pd.DataFrame) -> np.ndarray:
+def detect_anomalies_AU(features: pd.DataFrame, bundle=None) -> np.ndarray:
     try:
         if features is None or features.empty:
             return np.array([])
 
+        bundle = bundle or model_registry.get("autoencoder")
         features = features.astype("float32")
-        features_scaled = SCALER_AU.transform(features)
+        features_scaled = bundle.scaler.transform(features)
 
-        def predict(model, data, threshold):
-            reconstructions = model.predict(data)
-            loss = tf.keras.losses.mae(reconstructions, data)
-            return (loss.numpy() < threshold).astype(int)
-
-        preds = predict(AU_MODEL, features_scaled, AUTOENCODER_THRESHOLD)
+        preds = bundle.model.verdicts(features_scaled, bundle.threshold)
         logger.debug("Anomaly predictions: %s", preds.tolist())
         return preds
 
@@ -281,7 +260,7 @@ def detect_anomalies_AU(features: pd.DataFrame) -> np.ndarray:
         logger.error("Anomaly detection failed: %s", e)
         return np.array([])
 
-def detect_anomalies_KMEANS(features: pd.DataFrame) -> np.ndarray:
+def detect_anomalies_KMEANS(features: pd.DataFrame, bundle=None) -> np.ndarray:
     """Detect anomalies using KMeans model with proper cluster-to-label mapping."""
     try:
         if features is None or features.empty:
@@ -296,14 +275,15 @@ def detect_anomalies_KMEANS(features: pd.DataFrame) -> np.ndarray:
             "Bwd IAT Max_mean",
         ]
 
+        bundle = bundle or model_registry.get("kmeans")
         features = features[expected_columns]
         features.replace([np.inf, -np.inf], np.nan, inplace=True)
         features.fillna(0, inplace=True)
 
-        features_scaled = SCALER_KMEANS.transform(features)
+        features_scaled = bundle.scaler.transform(features)
 
-        raw_predictions = KMEANS_MODEL.predict(features_scaled)
-        predictions = np.array([KMEANS_MAPPING[c] for c in raw_predictions])
+        raw_predictions = bundle.model.predict(features_scaled)
+        predictions = np.array([bundle.mapping[c] for c in raw_predictions])
 
         logger.debug(f"KMeans raw clusters: {raw_predictions}")
         logger.debug(f"KMeans mapped predictions: {predictions}")
@@ -314,7 +294,7 @@ def detect_anomalies_KMEANS(features: pd.DataFrame) -> np.ndarray:
         return np.array([])
 
 
-def detect_anomalies_SVM(features: pd.DataFrame) -> np.ndarray:
+def detect_anomalies_SVM(features: pd.DataFrame, bundle=None) -> np.ndarray:
     try:
         if features is None or features.empty:
             return np.array([])
@@ -327,10 +307,11 @@ def detect_anomalies_SVM(features: pd.DataFrame) -> np.ndarray:
             "Bwd IAT Std_mean",
         ]
 
+        bundle = bundle or model_registry.get("svm")
         features = features[expected_columns]
         features = features.astype(np.float32)
 
-        raw_preds = SVM_MODEL.predict(features)
+        raw_preds = bundle.model.predict(features)
 
         # Map -1 → 1 (attack), 1 → 0 (benign)
         predictions = np.array([1 if x == -1 else 0 for x in raw_preds])
@@ -345,125 +326,134 @@ def detect_anomalies_SVM(features: pd.DataFrame) -> np.ndarray:
         return np.array([])
 
 
+DETECTORS = {
+    "autoencoder": detect_anomalies_AU,
+    "kmeans": detect_anomalies_KMEANS,
+    "svm": detect_anomalies_SVM,
+}
+
+
 def analyze_packet_stats(packets):
-    """Analyze packet statistics"""
+    """Analyze packet statistics (scapy packets or PacketColumns)"""
+    cols = as_columns(packets)
+    n = len(cols)
     stats = {
-        "total_packets": len(packets),
+        "total_packets": n,
         "total_bytes": 0,
         "protocol_distribution": {"TCP": 0, "UDP": 0, "ICMP": 0, "Other": 0},
-        "flag_count": {
-            flag: 0 for flag in ["SYN", "ACK", "FIN", "RST", "PSH", "URG", "ECE", "CWR"]
-        },
-        "src_ips": set(),
-        "dst_ips": set(),
+        "flag_count": {flag: 0 for flag in TCP_FLAGS},
         "start_time": None,
         "end_time": None,
     }
 
-    if not packets:
+    if n == 0:
         return stats
 
-    stats["start_time"] = datetime.fromtimestamp(float(packets[0].time))
-    stats["end_time"] = datetime.fromtimestamp(float(packets[-1].time))
-
-    for pkt in packets:
-        stats["total_bytes"] += len(pkt)
-
-        if pkt.haslayer(TCP):
-            stats["protocol_distribution"]["TCP"] += 1
-            tcp_layer = pkt.getlayer(TCP)
-            for flag, mask in [
-                ("SYN", 0x02),
-                ("ACK", 0x10),
-                ("FIN", 0x01),
-                ("RST", 0x04),
-                ("PSH", 0x08),
-                ("URG", 0x20),
-                ("ECE", 0x40),
-                ("CWR", 0x80),
-            ]:
-                if tcp_layer.flags & mask:
-                    stats["flag_count"][flag] += 1
-        elif pkt.haslayer(UDP):
-            stats["protocol_distribution"]["UDP"] += 1
-        elif pkt.haslayer(ICMP):
-            stats["protocol_distribution"]["ICMP"] += 1
-        else:
-            stats["protocol_distribution"]["Other"] += 1
-
-        if pkt.haslayer(IP):
-            stats["src_ips"].add(pkt[IP].src)
-            stats["dst_ips"].add(pkt[IP].dst)
-
-    stats["src_ip_count"] = len(stats["src_ips"])
-    stats["dst_ip_count"] = len(stats["dst_ips"])
-    stats["average_packet_size"] = (
-        stats["total_bytes"] / stats["total_packets"]
-        if stats["total_packets"] > 0
-        else 0
-    )
+    # Aware (host local time): serialized with the right offset, stored as UTC
+    stats["start_time"] = datetime.fromtimestamp(cols.ts[0]).astimezone()
+    stats["end_time"] = datetime.fromtimestamp(cols.ts[-1]).astimezone()
+    stats["total_bytes"] = int(cols.length.sum(dtype=np.uint64))
+
+    proto_counts = np.bincount(cols.proto, minlength=256)
+    tcp = int(proto_counts[PROTO_TCP])
+    udp = int(proto_counts[PROTO_UDP])
+    icmp = int(proto_counts[PROTO_ICMP])
+    stats["protocol_distribution"] = {
+        "TCP": tcp,
+        "UDP": udp,
+        "ICMP": icmp,
+        "Other": n - tcp - udp - icmp,
+    }
+
+    tcp_flags = cols.tcp_flags[cols.proto == PROTO_TCP]
+    stats["flag_count"] = {
+        flag: int(np.count_nonzero(tcp_flags & mask))
+        for flag, mask in TCP_FLAGS.items()
+    }
 
-    del stats["src_ips"]
-    del stats["dst_ips"]
+    ipv4 = cols.ip_version == 4
+    stats["src_ip_count"] = int(np.unique(cols.src[ipv4]).size)
+    stats["dst_ip_count"] = int(np.unique(cols.dst[ipv4]).size)
+    stats["average_packet_size"] = stats["total_bytes"] / n
 
     return stats
 
 
-def save_batch_to_db(pcap_path, packets, index, is_attack=False, csv_path: Path = None):
-    """Save batch to MongoDB with proper file handling"""
-    try:
-        stats = analyze_packet_stats(packets)
-        vietnam_tz = pytz.timezone("Asia/Ho_Chi_Minh")
-        current_time = datetime.now(vietnam_tz)
-
-        timestamp_str = current_time.strftime("%Y%m%d_%H%M%S")
-        batch_name = f"batch_{timestamp_str}"
-        batch_dir = BATCH_DIR / batch_name
-        batch_dir.mkdir(parents=True, exist_ok=True)
+def batch_pcap_path(batch_name: str, compress: bool = True) -> Path:
+    """Where a batch's pcap is archived (``retention.PCAP_COMPRESSION`` unless
+    uncompressed)"""
+    suffix = pcap_suffix() if compress else ".pcap"
+    return BATCH_DIR / batch_name / f"{batch_name}{suffix}"
+
+
+def write_batch_pcap(packets, pcap_file: Path):
+    """Write the batch pcap once, from the captured bytes and timestamps, to
+    its temporary name next to ``pcap_file``"""
+    pcap_file.parent.mkdir(parents=True, exist_ok=True)
+    with open_artifact(tmp_path(pcap_file), "wb") as f:
+        write_pcap(f, packets)
+
+
+def archive_batch(
+    packets,
+    batch_name: str,
+    created_at,
+    is_attack=False,
+    flows=None,
+    columns: PacketColumns = None,
+    pcap_file: Path = None,
+) -> dict:
+    """Batch stats plus the batch pcap (written by ``write_batch_pcap``, moved
+    into place here) and the labeled flows (in the flow store)"""
+    stats = analyze_packet_stats(columns if columns is not None else packets)
+
+    if pcap_file is not None:
+        # Atomic: the archived pcap is either complete or absent
+        os.replace(tmp_path(pcap_file), pcap_file)
+
+    flows_files = []
+    if flows is not None:
+        try:
+            flows_files = flow_store.write_batch(
+                flows, batch_name, created_at, is_attack
+            )
+        except Exception as e:
+            logger.warning(f"Could not archive flows: {e}")
+
+    return {
+        "batch_name": batch_name,
+        "created_at": created_at,
+        "pcap_file_path": str(pcap_file) if pcap_file else None,
+        "flows_files": flows_files,
+        **stats,
+    }
 
-        pcap_file = batch_dir / f"{batch_name}.pcap"
-        wrpcap(str(pcap_file), packets)
 
-        batch_csv = None
-        if csv_path and csv_path.exists():
-            batch_csv = batch_dir / f"{batch_name}.csv"
-            try:
-                shutil.copy2(str(csv_path), str(batch_csv))
-            except Exception as e:
-                logger.warning(f"Could not copy CSV file: {e}")
-        if batch_csv:
-            df = pd.read_csv(batch_csv)
-            df["Label"] = "Attack" if is_attack else "Benign"
-            df.to_csv(batch_csv, index=False)
+def save_batch_to_db(
+    batch: dict,
+    index,
+    is_attack=False,
+    windows: list = None,
+    detection: dict = None,
+):
+    """Save an archived batch to MongoDB and notify clients"""
+    try:
+        current_time = batch["created_at"]
+        batch_name = batch["batch_name"]
 
         batch_doc = {
-            "batch_name": batch_name,
-            "created_at": current_time,
-            "pcap_file_path": str(pcap_file),
-            "csv_file_path": str(batch_csv) if batch_csv else None,
-            **stats,
+            **batch,
             "note": f"Processed at {current_time.isoformat()}",
             "is_attack": is_attack,
+            "windows": windows or [],
+            **(detection or {}),
         }
 
-        result = batches_collection.insert_one(batch_doc)
-        batch_id = result.inserted_id
-
-        socket_batch = {
-            **batch_doc,
-            "_id": {"$oid": str(batch_id)},
-            "created_at": batch_doc["created_at"].isoformat(),
-            "start_time": (
-                batch_doc["start_time"].isoformat()
-                if batch_doc.get("start_time")
-                else None
-            ),
-            "end_time": (
-                batch_doc["end_time"].isoformat() if batch_doc.get("end_time") else None
-            ),
-        }
+        # Written in the background; the id is assigned now
+        batch_id = mongo_writer.insert("batches", batch_doc)
 
-        socketio.emit("new_batch", socket_batch)
+        # Encoded by serializer.SocketJSON (ObjectId -> {"$oid"}, ISO times)
+        socketio.emit("new_batch", batch_doc)
 
         if is_attack:
             alert_data = {
@@ -481,122 +471,440 @@ def save_batch_to_db(pcap_path, packets, index, is_attack=False, csv_path: Path
         return None
 
 
-io_executor = ThreadPoolExecutor(max_workers=8)
-
-
-def process_packet_batch(buffer: list, index: int):
-    """Process packet batch with improved file handling"""
-    model = get_model()
-
-    pcap_path = None
+def analyze_batch(
+    buffer: list,
+    index: int,
+    flows: pd.DataFrame = None,
+    model=None,
+    degraded: bool = False,
+):
+    """CPU-bound part of a batch: flows, windows, detection and archive files
+
+    ``flows`` are the finished records from the streaming flow table; when not
+    given they are assembled from ``buffer`` alone. ``degraded`` batches (the
+    work queue is falling behind) are not archived as pcap. Runs in a worker
+    thread or, in process mode, in a worker process; the result is picklable.
+    """
+    created_at = datetime.now(pytz.timezone("Asia/Ho_Chi_Minh"))
+    # The index keeps names unique when batches close within the same second
+    batch_name = f"batch_{created_at.strftime('%Y%m%d_%H%M%S')}_{index}"
+    cicflowmeter = FLOW_EXTRACTOR == "cicflowmeter"
+    pcap_file = None
     csv_path = None
+    snapshots = []
+    timings = {}
 
     try:
-        pcap_path = OUTPUT_DIR / f"temp_capture_{index}.pcap"
-        wrpcap(str(pcap_path), buffer)
-        csv_path = extract_features_with_cicflowmeter(pcap_path, CSV_OUTPUT_DIR)
-
-        features = aggregate_features(csv_path) if csv_path else None
+        # One model snapshot per detector for the whole batch, even if the
+        # selection or the artifacts change meanwhile
+        model = model or get_model()
+        for name in models_for(model):
+            snapshots.append(model_registry.acquire(name))
+        # Ensemble: aggregated once over the union of the detectors' columns
+        spec = union_spec([(s.columns, s.config) for s in snapshots])
+
+        # Decoded once; batch stats and basic features share these arrays
+        columns = PacketColumns.from_packets(buffer)
+
+        # A batch of only flows (capture stopped, flows idled out) has no pcap
+        if buffer and (cicflowmeter or not degraded):
+            with timed(timings, "pcap_write"):
+                # The one pcap write: CICFlowMeter (which can't read it
+                # compressed) extracts from it and archive_batch moves it
+                pcap_file = batch_pcap_path(batch_name, compress=not cicflowmeter)
+                write_batch_pcap(buffer, pcap_file)
+
+        with timed(timings, "flow_extraction"):
+            if cicflowmeter:
+                csv_path = extract_features_with_cicflowmeter(
+                    tmp_path(pcap_file), CSV_OUTPUT_DIR
+                )
+                flows = pd.read_csv(csv_path) if csv_path else None
+            elif flows is None:
+                flows = packets_to_flows(buffer)
+
+        with timed(timings, "aggregation"):
+            # One feature row per window, all scored by a single predict call
+            features, windows = window_builder.build(flows, model, spec)
         logger.info(f"Using model: {model} for predictions")
 
-        if model == "autoencoder":
-            predictions = (
-                detect_anomalies_AU(features) if features is not None else np.array([])
-            )
-        elif model == "kmeans":
-            predictions = (
-                detect_anomalies_KMEANS(features)
-                if features is not None
-                else np.array([])
-            )
-        elif model == "svm":
-            predictions = (
-                detect_anomalies_SVM(features) if features is not None else np.array([])
-            )
-        else:
-            logger.error(f"Invalid model selected: {model}")
-            predictions = np.array([])
-
-        logger.info(f"Using model: {model} for predictions")
+        with timed(timings, "inference"):
+            per_model = {}
+            if features is None:
+                predictions = np.array([])
+            elif model == "ensemble":
+                predictions, per_model = ensemble.score(features, snapshots, DETECTORS)
+            else:
+                predictions = DETECTORS[model](features, snapshots[0])
+                per_model = {model: predictions}
 
         is_attack = bool(predictions.any())
+        verdicts = window_verdicts(
+            windows, predictions, per_model if model == "ensemble" else None
+        )
+        detection = {
+            "model": model,
+            "model_versions": {s.name: s.version for s in snapshots},
+            # Fraction of windows each detector flagged
+            "model_scores": {
+                name: round(float(np.mean(votes)), 4) if len(votes) else None
+                for name, votes in per_model.items()
+            },
+        }
+        if model == "ensemble":
+            detection["voting"] = ensemble.voting
+
+        with timed(timings, "archive"):
+            batch = archive_batch(
+                buffer,
+                batch_name,
+                created_at,
+                is_attack,
+                flows,
+                columns,
+                pcap_file=None if degraded else pcap_file,
+            )
+            batch["degraded"] = degraded
 
-        batch_id = save_batch_to_db(pcap_path, buffer, index, is_attack, csv_path)
-
-        if features is not None:
-            try:
-                df = pd.read_csv(csv_path)
-                if not df.empty:
-                    flow_dicts = df.replace({np.nan: None}).to_dict(orient="records")
-                    for flow in flow_dicts:
-                        flow["batch_index"] = index
-                    flows_collection = db["flows"]
-                    flows_collection.insert_many(flow_dicts)
-                    logger.info(f"Inserted {len(flow_dicts)} flows for batch {index}")
-            except Exception as e:
-                logger.error(f"Failed to insert flows for batch {index}: {e}")
-
-        batch_result = {
-            "batch": index,
-            "timestamp": time.time(),
+        return {
+            "index": index,
+            "is_attack": is_attack,
             "predictions": predictions.tolist(),
-            "batch_id": str(batch_id) if batch_id else None,
+            "windows": verdicts,
+            "detection": detection,
+            "batch": batch,
+            "flows": flows if features is not None else None,
+            "timings": timings,
         }
-        all_predictions.append(batch_result)
-
-    except Exception as e:
-        logger.error("Error processing batch %d: %s", index, e)
     finally:
+        for snapshot in snapshots:
+            model_registry.release(snapshot)
 
-        for temp_file in [pcap_path, csv_path]:
+        # The pcap is left behind only if the batch failed or was degraded
+        staged = tmp_path(pcap_file) if pcap_file else None
+        for temp_file in [staged, csv_path]:
             if temp_file and temp_file.exists():
                 try:
                     temp_file.unlink()
                 except Exception as e:
                     logger.warning(f"Could not delete temporary file {temp_file}: {e}")
+        if staged and staged.parent.is_dir() and not any(staged.parent.iterdir()):
+            staged.parent.rmdir()
+
+
+def persist_batch(result: dict):
+    """MongoDB writes and Socket.IO notifications for an analyzed batch"""
+    index = result["index"]
+    batch_id = save_batch_to_db(
+        result["batch"],
+        index,
+        result["is_attack"],
+        windows=result["windows"],
+        detection=result["detection"],
+    )
+
+    flows = result["flows"]
+    try:
+        if flows is not None and not flows.empty:
+            flow_dicts = flows.replace({np.nan: None}).to_dict(orient="records")
+            # Sortable time; Timestamp stays the CICFlowMeter string
+            times = flow_times(flows["Timestamp"])
+            label = "Attack" if result["is_attack"] else "Benign"
+            for flow, flow_time in zip(flow_dicts, times):
+                flow["batch_index"] = index
+                flow["flow_time"] = flow_time
+                flow["Label"] = label
+            mongo_writer.insert_many("flows", flow_dicts)
+            logger.info(f"Queued {len(flow_dicts)} flows for batch {index}")
+            flow_summary.add(flows)
+    except Exception as e:
+        logger.error(f"Failed to queue flows for batch {index}: {e}")
+
+    batch_result = {
+        "batch": index,
+        "timestamp": time.time(),
+        "predictions": result["predictions"],
+        "windows": result["windows"],
+        **result["detection"],
+        "batch_id": str(batch_id) if batch_id else None,
+    }
+    all_predictions.append(batch_result)
+    return batch_id
+
+
+def process_packet_batch(
+    buffer: list, index: int, flows: pd.DataFrame = None, degraded: bool = False
+):
+    """Analyze a batch (in this thread or a worker process) and persist it"""
+    batch_start = time.perf_counter()
+    try:
+        if EXECUTION_MODE == "processes":
+            # Raw bytes + arrays cross the process boundary, not scapy objects
+            payload = {
+                "frames": pack_frames(buffer),
+                "index": index,
+                "flows": flows,
+                "model": get_model(),
+                "generation": model_registry.generation,
+                "windows": window_builder.settings(),
+                "ensemble": ensemble.settings(),
+                "degraded": degraded,
+            }
+            result = _process_pool().submit(_analyze_in_worker, payload).result()
+        else:
+            result = analyze_batch(buffer, index, flows, degraded=degraded)
+        stage_timer.record_all(result["timings"])
+
+        with stage_timer.time("persistence"):
+            persist_batch(result)
+        stage_timer.record("batch_total", time.perf_counter() - batch_start)
+
+    except Exception as e:
+        logger.error("Error processing batch %d: %s", index, e)
+
+
+# ---- process-pool execution ----
+
+_worker_pool = None
+
+
+def _init_process_worker(model, generation, batch_dir):
+    """Worker initializer: use the parent's batch directory and load the
+    selected model(s) once per process"""
+    if Path(batch_dir) != BATCH_DIR:
+        configure_storage(batch_dir)
+    model_registry.generation = generation
+    model_registry.warm_up(models_for(model), background=False)
+
+
+def _analyze_in_worker(payload):
+    model_registry.sync(payload["generation"])
+    window_builder.configure(**payload["windows"])
+    settings = payload["ensemble"]
+    ensemble.configure(
+        voting=settings["voting"],
+        weights=settings["weights"],
+        threshold=settings["threshold"],
+    )
+    return analyze_batch(
+        unpack_frames(payload["frames"]),
+        payload["index"],
+        payload["flows"],
+        payload["model"],
+        payload["degraded"],
+    )
+
+
+def _process_pool():
+    global _worker_pool
+    with lock:
+        if _worker_pool is None:
+            # spawn: forking a process that already runs capture threads is unsafe
+            _worker_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker,
+                initargs=(get_model(), model_registry.generation, str(BATCH_DIR)),
+            )
+        return _worker_pool
+
+
+def shutdown_executors(wait: bool = True):
+    """Stop the batch worker threads and, in process mode, the worker processes,
+    then write out what the MongoDB writer still buffers"""
+    work_queue.shutdown(wait=wait)
+    if _worker_pool is not None:
+        _worker_pool.shutdown(wait=wait)
+    mongo_writer.stop(flush=True)
 
 
 from model_state import get_total_packet_count, set_total_packet_count
 
 
-def handle_packet(packet):
-    global packet_count, packet_buffer, file_index
+def submit_batch(buffer: list):
+    """Flush callback of the micro-batcher: hand a batch to the worker pool"""
+    global file_index
+
+    flows = None
+    if FLOW_EXTRACTOR == "python":
+        with stage_timer.time("flow_drain"):
+            flow_table.expire_idle()
+            flows = flow_table.drain()
+    if not buffer and (flows is None or flows.empty):
+        return
 
     with lock:
-        packet_count += 1
+        current_index = file_index
+        file_index += 1
+    # Bounded: blocks, or sheds a batch, per the queue's overflow policy
+    work_queue.submit(buffer, current_index, flows)
+
+
+work_queue = WorkQueue(
+    process_packet_batch,
+    maxsize=BATCH_QUEUE_SIZE,
+    policy=BATCH_QUEUE_POLICY,
+    workers=BATCH_WORKERS,
+    degrade_at=BATCH_DEGRADE_AT,
+)
+
+
+def flows_pending() -> bool:
+    """Whether finished flows wait for a batch (idle flows are expired first),
+    so they are scored even when no packets arrive"""
+    if FLOW_EXTRACTOR != "python":
+        return False
+    flow_table.expire_idle()
+    return flow_table.has_finished()
+
+
+batcher = MicroBatcher(
+    submit_batch,
+    max_size=CHUNK_SIZE,
+    max_latency=BATCH_MAX_LATENCY,
+    pending=flows_pending,
+)
+
+
+def flush_capture():
+    """Process everything still buffered (capture stopped)"""
+    if FLOW_EXTRACTOR == "python":
+        flow_table.flush()
+    batcher.flush()
+
+
+# Capture path: the sniff callback only enqueues. The batch stage (flow table +
+# micro-batcher) and the feed stage (summary + Socket.IO emit) each run on their
+# own thread, so nothing slow ever sits on scapy's callback thread.
+capture_queue = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+feed_queue = queue.Queue(maxsize=FEED_QUEUE_SIZE)
+capture_stats = {
+    "captured": 0,
+    "processed": 0,
+    "queue_full_drops": 0,
+    "feed_drops": 0,
+    "kernel_drops": None,
+}
+_stage_threads = []
+
+
+def _feed_row(candidate) -> dict:
+    """A ``new_packet`` row; built only for the packets the live feed sends"""
+    ts, packet, (src, dst, proto, length), total = candidate
+    if isinstance(packet, RawFrame):
+        packet = to_scapy(packet)
+    return {
+        "timestamp": datetime.fromtimestamp(ts, VN_TZ).isoformat(),
+        "src_ip": src,
+        "dst_ip": dst,
+        "protocol": proto,
+        "length": length,
+        "info": packet.summary(),
+        "total_packet_count": total,
+    }
+
+
+live_feed = LiveFeed(
+    socketio,
+    build_row=_feed_row,
+    interval=FEED_INTERVAL,
+    sample_rate=FEED_SAMPLE_RATE,
+    max_rows_per_client=FEED_MAX_ROWS,
+)
 
-        # ✅ increment total_packet_count via setter
-        current_total = get_total_packet_count()
-        set_total_packet_count(current_total + 1)
 
+def handle_packet(packet):
+    """Sniff callback (scapy packet or RawFrame): bounded enqueue, nothing else"""
+    capture_stats["captured"] += 1
+    try:
+        capture_queue.put_nowait(packet)
+    except queue.Full:
+        capture_stats["queue_full_drops"] += 1
+
+
+def _batch_stage():
+    while True:
+        packet = capture_queue.get()
         try:
-            if packet.haslayer(IP):
-                vietnam_tz = pytz.timezone("Asia/Ho_Chi_Minh")
-                vn_time = datetime.now(vietnam_tz)
-
-                packet_data = {
-                    "timestamp": vn_time.isoformat(),
-                    "src_ip": packet[IP].src,
-                    "dst_ip": packet[IP].dst,
-                    "protocol": packet[IP].proto,
-                    "length": len(packet),
-                    "info": packet.summary(),
-                    "total_packet_count": get_total_packet_count(),  # ✅ updated
-                }
-
-                socketio.emit("new_packet", packet_data)
+            start = time.perf_counter()
+            if FLOW_EXTRACTOR == "python":
+                flow_table.add_packet(packet)
+            batcher.add(packet)
+            stage_timer.record("capture", time.perf_counter() - start)
 
+            total = get_total_packet_count() + 1
+            set_total_packet_count(total)
+            capture_stats["processed"] += 1
+
+            try:
+                feed_queue.put_nowait((packet, total))
+            except queue.Full:
+                capture_stats["feed_drops"] += 1
         except Exception as e:
-            logger.error(f"Error emitting packet: {e}")
+            logger.error(f"Error processing packet: {e}")
+        finally:
+            capture_queue.task_done()
 
-        packet_buffer.append(packet)
 
-        if packet_count >= CHUNK_SIZE:
-            current_buffer = packet_buffer.copy()
-            current_index = file_index
-            file_index += 1
+def _feed_fields(packet):
+    """(src, dst, proto, length) of an IPv4 packet or RawFrame, None otherwise"""
+    if isinstance(packet, RawFrame):
+        h = parse_headers(packet.data, packet.linktype)
+        if h is None or h.ip_version != 4:
+            return None
+        return ip_to_str(h.src), ip_to_str(h.dst), h.proto, len(packet.data)
+    if packet.haslayer(IP):
+        ip = packet[IP]
+        return ip.src, ip.dst, ip.proto, len(packet)
+    return None
 
-            packet_buffer.clear()
-            packet_count = 0
 
-            executor.submit(process_packet_batch, current_buffer, current_index)
+def _feed_stage():
+    while True:
+        packet, total = feed_queue.get()
+        try:
+            fields = _feed_fields(packet)
+            if fields:
+                src, dst, proto, length = fields
+                live_feed.observe(src, proto, length)
+                live_feed.offer((time.time(), packet, fields, total))
+        except Exception as e:
+            logger.error(f"Error emitting packet: {e}")
+
+
+def start_pipeline():
+    """Start the consumer stages once; they idle on their queues between captures"""
+    with lock:
+        if _stage_threads:
+            return
+        for name, target in [
+            ("batch-stage", _batch_stage),
+            ("feed-stage", _feed_stage),
+        ]:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            _stage_threads.append(thread)
+        live_feed.start()
+        mongo_writer.start()
+    if EXECUTION_MODE == "processes":
+        # Spawn the workers (and load their models) before the first batch
+        pool = _process_pool()
+        for _ in range(PROCESS_WORKERS):
+            pool.submit(int)
+
+
+def drain_pipeline(timeout: float = 5.0) -> bool:
+    """Wait until every queued packet went through the batch stage"""
+    deadline = time.monotonic() + timeout
+    while capture_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return not capture_queue.unfinished_tasks
+
+
+def pipeline_stats() -> dict:
+    return {
+        **capture_stats,
+        "queue_depth": capture_queue.qsize(),
+        "queue_capacity": CAPTURE_QUEUE_SIZE,
+        "feed_queue_depth": feed_queue.qsize(),
+    }
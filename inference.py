@@ -0,0 +1,207 @@
+"""Windowed, multi-row inference input.
+
+Instead of collapsing every flow of a batch into one aggregate row, the flows
+are cut into windows and each window becomes one row of means/stds:
+
+- ``sliding``: fixed-size windows over the flow stream (in drain order)
+- ``host``: one window per source host
+- ``batch``: a single window over the whole batch (the original behaviour)
+
+All rows are written into a reused float32 buffer and scored with one model
+call, so a batch yields per-window verdicts for the cost of a single predict.
+"""
+
+import logging
+import os
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# model -> (feature columns in model order, {flow column: [aggregations]})
+AE_KMEANS_COLUMNS = [
+    "Flow Duration_mean",
+    "Fwd IAT Tot_std",
+    "Fwd IAT Max_std",
+    "Fwd IAT Std_mean",
+    "Fwd IAT Std_std",
+    "Bwd IAT Max_mean",
+]
+AE_KMEANS_CONFIG = {
+    "Flow Duration": ["mean"],
+    "Fwd IAT Tot": ["std"],
+    "Fwd IAT Max": ["std"],
+    "Fwd IAT Std": ["mean", "std"],
+    "Bwd IAT Max": ["mean"],
+}
+SVM_COLUMNS = [
+    "Flow Duration_mean",
+    "Fwd IAT Tot_mean",
+    "Fwd IAT Tot_std",
+    "Bwd IAT Max_mean",
+    "Bwd IAT Std_mean",
+]
+SVM_CONFIG = {
+    "Flow Duration": ["mean"],
+    "Fwd IAT Tot": ["mean", "std"],
+    "Bwd IAT Max": ["mean"],
+    "Bwd IAT Std": ["mean"],
+}
+FEATURE_SPECS = {
+    "autoencoder": (AE_KMEANS_COLUMNS, AE_KMEANS_CONFIG),
+    "kmeans": (AE_KMEANS_COLUMNS, AE_KMEANS_CONFIG),
+    "svm": (SVM_COLUMNS, SVM_CONFIG),
+}
+
+
+def union_spec(specs):
+    """One (columns, config) covering every spec, so flows are aggregated once"""
+    columns, config = [], {}
+    for spec_columns, spec_config in specs:
+        columns += [col for col in spec_columns if col not in columns]
+        for col, aggs in spec_config.items():
+            merged = config.setdefault(col, [])
+            merged += [agg for agg in aggs if agg not in merged]
+    return columns, config
+
+
+FEATURE_SPECS["ensemble"] = union_spec(list(FEATURE_SPECS.values()))
+
+WINDOW_MODES = ("sliding", "host", "batch")
+INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "sliding")
+# Flows per sliding window and the step between window starts
+WINDOW_FLOWS = int(os.environ.get("INFERENCE_WINDOW_FLOWS", 200))
+WINDOW_STRIDE = int(os.environ.get("INFERENCE_WINDOW_STRIDE", 100))
+# Initial buffer rows; grows geometrically when a batch needs more
+INITIAL_ROWS = 256
+
+
+def feature_spec(model):
+    """(selected columns, aggregation config) for ``model``"""
+    if model not in FEATURE_SPECS:
+        raise ValueError(f"Unknown model: {model}")
+    return FEATURE_SPECS[model]
+
+
+def window_starts(n, window, stride):
+    """Start offsets of sliding windows over ``n`` flows; the last one ends at n"""
+    if n <= window:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.arange(0, n - window + 1, stride, dtype=np.int64)
+    if starts[-1] != n - window:
+        starts = np.append(starts, n - window)
+    return starts
+
+
+def _aggregate(values, agg):
+    """mean / sample std along axis 1, NaN-skipping like pandas"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if agg == "mean":
+            return np.nanmean(values, axis=1)
+        if agg == "std":
+            return np.nanstd(values, axis=1, ddof=1)
+    raise ValueError(f"Unsupported aggregation: {agg}")
+
+
+class WindowBuilder:
+    def __init__(self, mode=INFERENCE_MODE, window=WINDOW_FLOWS, stride=WINDOW_STRIDE):
+        self.configure(mode, window, stride)
+        # One buffer per worker thread, reused across batches
+        self._local = threading.local()
+
+    def configure(self, mode=None, window=None, stride=None):
+        if mode is not None:
+            if mode not in WINDOW_MODES:
+                raise ValueError(f"mode must be one of {WINDOW_MODES}")
+            self.mode = mode
+        if window is not None:
+            if int(window) < 1:
+                raise ValueError("window must be >= 1")
+            self.window = int(window)
+        if stride is not None:
+            if int(stride) < 1:
+                raise ValueError("stride must be >= 1")
+            self.stride = int(stride)
+
+    def settings(self) -> dict:
+        return {"mode": self.mode, "window": self.window, "stride": self.stride}
+
+    def _buffer(self, rows, width):
+        buf = getattr(self._local, "buf", None)
+        if buf is None or buf.shape[0] < rows or buf.shape[1] != width:
+            capacity = max(INITIAL_ROWS, rows if buf is None else 2 * buf.shape[0])
+            while capacity < rows:
+                capacity *= 2
+            buf = np.empty((capacity, width), dtype=np.float32)
+            self._local.buf = buf
+        return buf[:rows]
+
+    def build(self, flows: pd.DataFrame, model, spec=None):
+        """Aggregate ``flows`` into one feature row per window.
+
+        ``spec`` is ``(columns, config)``; defaults to ``feature_spec(model)``.
+
+        Returns ``(features, windows)``: a DataFrame over the shared float32
+        buffer (valid until this thread's next ``build``) and a list describing
+        each row. ``(None, [])`` when there is nothing to score.
+        """
+        if flows is None or flows.empty:
+            return None, []
+        selected_cols, config = spec or feature_spec(model)
+        selected_cols = list(selected_cols)
+
+        missing = [col for col in config if col not in flows.columns]
+        if missing:
+            logger.warning(f"Missing flow columns for {model}: {missing}")
+            return None, []
+
+        if self.mode == "host" and "Src IP" in flows.columns:
+            grouped = flows.groupby("Src IP", sort=False).agg(config)
+            grouped.columns = [f"{col}_{agg}" for col, agg in grouped.columns]
+            out = self._buffer(len(grouped), len(selected_cols))
+            out[:] = grouped.reindex(columns=selected_cols).to_numpy(np.float32)
+            windows = [
+                {"host": host, "flows": int(n)}
+                for host, n in flows.groupby("Src IP", sort=False).size().items()
+            ]
+        else:
+            n = len(flows)
+            window = n if self.mode == "batch" else self.window
+            starts = window_starts(n, window, self.stride)
+            span = min(window, n)
+            index = starts[:, None] + np.arange(span)
+            out = self._buffer(len(starts), len(selected_cols))
+            position = {name: i for i, name in enumerate(selected_cols)}
+            for col, aggs in config.items():
+                values = flows[col].to_numpy(np.float64)[index]
+                for agg in aggs:
+                    out[:, position[f"{col}_{agg}"]] = _aggregate(values, agg)
+            windows = [
+                {"start": int(s), "end": int(s) + span} for s in starts.tolist()
+            ]
+
+        # A one-flow window or host has no sample std; score it as 0 rather
+        # than let NaN reach the models
+        out[np.isnan(out)] = 0.0
+        return pd.DataFrame(out, columns=selected_cols, copy=False), windows
+
+
+def window_verdicts(windows, predictions, per_model=None) -> list:
+    """Attach each window's prediction (1 = attack), and in ensemble mode each
+    detector's vote, to its description"""
+    if len(predictions) != len(windows):
+        return []
+    verdicts = [
+        {**window, "prediction": int(p)} for window, p in zip(windows, predictions)
+    ]
+    if per_model:
+        for i, verdict in enumerate(verdicts):
+            verdict["votes"] = {name: int(v[i]) for name, v in per_model.items()}
+    return verdicts
+
+
+window_builder = WindowBuilder()
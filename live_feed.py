@@ -0,0 +1,231 @@
+"""Coalescing publisher for the live packet feed.
+
+Instead of one Socket.IO emit per captured packet, packets are only counted as
+they arrive. Once per ``interval`` the publisher emits a single
+``traffic_summary`` frame (rates, top talkers, protocol mix) and a bounded
+number of sampled ``new_packet`` rows to each client, so the emit volume does
+not grow with the traffic rate.
+
+Packets offered for rows go through a reservoir of ``max_rows_per_client``
+per interval (uniform over the interval's packets), and ``build_row`` only
+runs on the ones kept, at publish time; the per-packet cost is a counter and
+an occasional slot swap.
+"""
+
+from collections import Counter, deque
+import logging
+import random
+import threading
+import time
+
+from model_state import get_total_packet_count
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_NAMES = {1: "ICMP", 6: "TCP", 17: "UDP", 58: "ICMPv6"}
+# Frames already queued on a client's transport before we stop sending it rows
+MAX_PENDING_FRAMES = 50
+
+
+class LiveFeed:
+    def __init__(
+        self,
+        socketio,
+        interval=1.0,
+        sample_rate=1.0,
+        max_rows_per_client=20,
+        build_row=None,
+    ):
+        self.socketio = socketio
+        self.build_row = build_row or (lambda candidate: candidate)
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.max_rows_per_client = max_rows_per_client
+        self.lock = threading.Lock()
+        self.clients = {}  # sid -> {"outbox": deque, "dropped": int}
+        self._reset_window()
+        self._sample_credit = 0.0
+        self._reservoir = []  # (sequence, candidate)
+        self._offered = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.frames_sent = 0
+        self.rows_sent = 0
+
+    def _reset_window(self):
+        self.window_start = time.monotonic()
+        self.window_packets = 0
+        self.window_bytes = 0
+        self.talkers = Counter()
+        self.protocols = Counter()
+
+    # ---- producer side (feed stage thread) ----
+
+    def observe(self, src, proto, length):
+        """Count one packet in the current summary window"""
+        with self.lock:
+            self.window_packets += 1
+            self.window_bytes += length
+            self.talkers[src] += 1
+            self.protocols[PROTOCOL_NAMES.get(proto, "Other")] += 1
+
+    def offer(self, candidate):
+        """Consider one packet for this interval's rows.
+
+        ``sample_rate`` = 1/N keeps a deterministic 1-in-N; of those, a
+        reservoir keeps a uniform ``max_rows_per_client``. ``candidate`` is
+        whatever ``build_row`` turns into a row.
+        """
+        if not self.clients or not self.max_rows_per_client:
+            return
+        self._sample_credit += self.sample_rate
+        if self._sample_credit < 1.0:
+            return
+        self._sample_credit -= 1.0
+        with self.lock:
+            self._offered += 1
+            if len(self._reservoir) < self.max_rows_per_client:
+                self._reservoir.append((self._offered, candidate))
+                return
+            slot = random.randrange(self._offered)
+            if slot < len(self._reservoir):
+                self._reservoir[slot] = (self._offered, candidate)
+
+    def _take_rows(self) -> list:
+        """Rows for the kept candidates, in capture order (resets the reservoir)"""
+        with self.lock:
+            kept, self._reservoir, self._offered = self._reservoir, [], 0
+        rows = []
+        for _, candidate in sorted(kept, key=lambda item: item[0]):
+            try:
+                rows.append(self.build_row(candidate))
+            except Exception as e:
+                logger.debug(f"Live feed row skipped: {e}")
+        return rows
+
+    def publish_row(self, row: dict):
+        """Queue a row for every client, dropping the oldest on overflow"""
+        with self.lock:
+            for client in self.clients.values():
+                outbox = client["outbox"]
+                if len(outbox) == outbox.maxlen:
+                    client["dropped"] += 1
+                outbox.append(row)
+
+    # ---- clients ----
+
+    def add_client(self, sid):
+        with self.lock:
+            self.clients[sid] = {
+                "outbox": deque(maxlen=self.max_rows_per_client),
+                "dropped": 0,
+            }
+
+    def remove_client(self, sid):
+        with self.lock:
+            self.clients.pop(sid, None)
+
+    def _pending_frames(self, sid) -> int:
+        """Frames waiting in the client's Engine.IO queue (0 if unknown)"""
+        try:
+            server = self.socketio.server
+            eio_sid = server.manager.eio_sid_from_sid(sid, "/")
+            return server.eio.sockets[eio_sid].queue.qsize()
+        except Exception:
+            return 0
+
+    # ---- publisher thread ----
+
+    def configure(self, interval=None, sample_rate=None, max_rows_per_client=None):
+        if interval is not None:
+            if float(interval) <= 0:
+                raise ValueError("interval must be > 0")
+            self.interval = float(interval)
+        if sample_rate is not None:
+            if not 0 <= float(sample_rate) <= 1:
+                raise ValueError("sample_rate must be between 0 and 1")
+            self.sample_rate = float(sample_rate)
+        if max_rows_per_client is not None:
+            if int(max_rows_per_client) < 0:
+                raise ValueError("max_rows_per_client must be >= 0")
+            self.max_rows_per_client = int(max_rows_per_client)
+            with self.lock:
+                for client in self.clients.values():
+                    client["outbox"] = deque(
+                        client["outbox"], maxlen=self.max_rows_per_client
+                    )
+                del self._reservoir[self.max_rows_per_client :]
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def summary_frame(self, total_packet_count=None) -> dict:
+        with self.lock:
+            elapsed = max(time.monotonic() - self.window_start, 1e-6)
+            frame = {
+                "timestamp": time.time(),
+                "packets_per_sec": round(self.window_packets / elapsed, 2),
+                "bytes_per_sec": round(self.window_bytes / elapsed, 2),
+                "top_talkers": [
+                    {"ip": ip, "packets": n} for ip, n in self.talkers.most_common(5)
+                ],
+                "protocol_mix": dict(self.protocols),
+                "total_packet_count": total_packet_count,
+            }
+            self._reset_window()
+        return frame
+
+    def flush(self, total_packet_count=None):
+        """Emit one summary frame and each client's sampled rows"""
+        frame = self.summary_frame(total_packet_count)
+        self.socketio.emit("traffic_summary", frame)
+        self.frames_sent += 1
+
+        for row in self._take_rows():
+            self.publish_row(row)
+
+        with self.lock:
+            batches = []
+            for sid, client in self.clients.items():
+                rows = list(client["outbox"])
+                client["outbox"].clear()
+                batches.append((sid, client, rows))
+
+        for sid, client, rows in batches:
+            if not rows:
+                continue
+            if self._pending_frames(sid) > MAX_PENDING_FRAMES:
+                # Slow consumer: shed its rows rather than growing its queue
+                client["dropped"] += len(rows)
+                continue
+            for row in rows:
+                self.socketio.emit("new_packet", row, to=sid)
+            self.rows_sent += len(rows)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "interval": self.interval,
+                "sample_rate": self.sample_rate,
+                "max_rows_per_client": self.max_rows_per_client,
+                "clients": len(self.clients),
+                "frames_sent": self.frames_sent,
+                "rows_sent": self.rows_sent,
+                "dropped_rows": {sid: c["dropped"] for sid, c in self.clients.items()},
+            }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.clients:
+                continue
+            try:
+                self.flush(get_total_packet_count())
+            except Exception as e:
+                logger.error(f"Live feed publish failed: {e}")
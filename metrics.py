@@ -0,0 +1,104 @@
+"""Per-stage latency recording for the capture/detection pipeline."""
+
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+import numpy as np
+
+# Samples kept per stage; older ones are discarded
+MAX_SAMPLES = 100_000
+
+
+class StageTimer:
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        samples = self.samples.get(stage)
+        if samples is None:
+            with self.lock:
+                samples = self.samples.setdefault(stage, deque(maxlen=self.max_samples))
+        samples.append(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record_all(self, timings: dict):
+        """Record durations measured elsewhere, e.g. in a worker process"""
+        for stage, seconds in timings.items():
+            self.record(stage, seconds)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self) -> dict:
+        """count / mean / p50 / p95 / p99 / max per stage, in milliseconds"""
+        result = {}
+        for stage, samples in list(self.samples.items()):
+            if not samples:
+                continue
+            ms = np.fromiter(samples, dtype=np.float64) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            result[stage] = {
+                "count": int(ms.size),
+                "mean_ms": round(float(ms.mean()), 4),
+                "p50_ms": round(float(p50), 4),
+                "p95_ms": round(float(p95), 4),
+                "p99_ms": round(float(p99), 4),
+                "max_ms": round(float(ms.max()), 4),
+            }
+        return result
+
+
+@contextmanager
+def timed(timings: dict, stage: str):
+    """Like ``StageTimer.time`` but into a plain dict that can cross processes"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - start
+
+
+class StartupTimer:
+    """Wall-clock duration of each startup phase, in the order they finish"""
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self.last) * 1000, 1)
+        self.last = now
+
+    def summary(self) -> dict:
+        result = {
+            "phases_ms": dict(self.phases),
+            "total_ms": round((self.last - self.start) * 1000, 1),
+        }
+        try:
+            import psutil
+
+            # Includes interpreter start and imports before this module
+            created = psutil.Process().create_time()
+            result["since_process_start_ms"] = round(
+                (time.time() - (time.perf_counter() - self.last) - created) * 1000, 1
+            )
+        except Exception:
+            pass
+        return result
+
+
+stage_timer = StageTimer()
+startup_timer = StartupTimer()
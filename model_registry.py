@@ -0,0 +1,226 @@
+"""Lazily loaded, hot-swappable detection models.
+
+Each model (with its scaler and side files) is loaded from ``Model/`` the first
+time it is used or selected, instead of all of them at import. TensorFlow is
+only imported if the autoencoder is loaded with a Keras backend.
+
+A loaded model is an immutable ``ModelBundle`` snapshot (model, scaler, feature
+spec, version). Batches pin one with ``acquire``/``release`` (or ``pinned``);
+``reload`` loads new artifacts and swaps them in atomically, and the previous
+snapshot is released once the last batch pinning it is done.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+import itertools
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+
+from autoencoder_runtime import AUTOENCODER_BACKEND, load_autoencoder
+from ensemble import ENSEMBLE_MODELS
+from inference import feature_spec
+from metrics import stage_timer
+from model_state import get_model
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = Path(__file__).parent / "Model"
+MODEL_NAMES = ("autoencoder", "kmeans", "svm")
+# What /api/model/select accepts; "ensemble" runs all three detectors
+SELECTABLE_MODELS = MODEL_NAMES + ("ensemble",)
+# Loaded at startup in the background: "" (none), "current" or "all"
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "current")
+
+
+def models_for(selection):
+    """The detector models behind a selection"""
+    return ENSEMBLE_MODELS if selection == "ensemble" else (selection,)
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    name: str
+    model: object
+    scaler: object
+    threshold: float = None  # autoencoder
+    mapping: dict = None  # kmeans cluster -> label
+    columns: tuple = ()  # feature columns, in model order
+    config: dict = None  # {flow column: [aggregations]}
+    version: int = 0
+    load_seconds: float = 0.0
+
+
+def load_bundle(name, model_dir=MODEL_DIR, version=0) -> ModelBundle:
+    """Load one model and its scaler / side files from ``model_dir``"""
+    import joblib
+
+    start = time.perf_counter()
+    if name == "autoencoder":
+        import numpy as np
+
+        bundle = dict(
+            model=load_autoencoder(model_dir / "autoencoder.h5", AUTOENCODER_BACKEND),
+            scaler=joblib.load(model_dir / "scaler_autoencoder.pkl"),
+            threshold=np.load(model_dir / "autoencoder_train_info.npz")[
+                "threshold"
+            ].item(),
+        )
+    elif name == "kmeans":
+        bundle = dict(
+            model=joblib.load(model_dir / "kmeans_model.pkl"),
+            scaler=joblib.load(model_dir / "scaler_kmeans.pkl"),
+            mapping=joblib.load(model_dir / "kmeans_label_mapping.pkl"),
+        )
+    elif name == "svm":
+        bundle = dict(
+            model=joblib.load(model_dir / "ocsvm_model.joblib"),
+            scaler=joblib.load(model_dir / "scaler_svm.pkl"),
+        )
+    else:
+        raise ValueError(f"Unknown model: {name}")
+    columns, config = feature_spec(name)
+    elapsed = time.perf_counter() - start
+    stage_timer.record(f"model_load_{name}", elapsed)
+    logger.info(f"Loaded {name} model v{version} in {elapsed:.2f}s")
+    return ModelBundle(
+        name=name,
+        columns=tuple(columns),
+        config=config,
+        version=version,
+        load_seconds=elapsed,
+        **bundle,
+    )
+
+
+class ModelRegistry:
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = Path(model_dir)
+        self.bundles = {}
+        self.lock = threading.Lock()
+        self._loading = {name: threading.Lock() for name in MODEL_NAMES}
+        self._versions = itertools.count(1)
+        self.refs = Counter()  # (name, version) -> batches pinning it
+        self.retired = {}  # (name, version) -> swapped-out bundle still pinned
+        # Bumped by every reload; worker processes compare it to their own
+        self.generation = 0
+
+    def get(self, name) -> ModelBundle:
+        """The loaded bundle for ``name``, loading it on first use"""
+        bundle = self.bundles.get(name)
+        if bundle is not None:
+            return bundle
+        if name not in self._loading:
+            raise ValueError(f"Unknown model: {name}")
+        # Per-model lock: concurrent batches wait for one load, other models don't
+        with self._loading[name]:
+            bundle = self.bundles.get(name)
+            if bundle is None:
+                bundle = load_bundle(name, self.model_dir, next(self._versions))
+                with self.lock:
+                    self.bundles[name] = bundle
+        return bundle
+
+    def acquire(self, name=None) -> ModelBundle:
+        """Pin the current snapshot of ``name`` (default: the selected model)"""
+        bundle = self.get(name or get_model())
+        with self.lock:
+            # Re-read under the lock so a concurrent swap can't retire it first
+            bundle = self.bundles.get(bundle.name, bundle)
+            self.refs[(bundle.name, bundle.version)] += 1
+        return bundle
+
+    def release(self, bundle: ModelBundle):
+        key = (bundle.name, bundle.version)
+        with self.lock:
+            self.refs[key] -= 1
+            if self.refs[key] > 0:
+                return
+            del self.refs[key]
+            released = self.retired.pop(key, None)
+        if released is not None:
+            logger.info(f"Released {bundle.name} model v{bundle.version}")
+
+    @contextmanager
+    def pinned(self, name=None):
+        bundle = self.acquire(name)
+        try:
+            yield bundle
+        finally:
+            self.release(bundle)
+
+    def reload(self, names=None, model_dir=None) -> dict:
+        """Load fresh artifacts for ``names`` (default: every loaded model) and
+        swap them in. A failed load leaves the current snapshot in place."""
+        if model_dir is not None:
+            self.model_dir = Path(model_dir)
+        names = list(names or self.bundles)
+        for name in names:
+            if name not in self._loading:
+                raise ValueError(f"Unknown model: {name}")
+
+        swapped = {}
+        self.generation += 1
+        for name in names:
+            with self._loading[name]:
+                bundle = load_bundle(name, self.model_dir, next(self._versions))
+                with self.lock:
+                    old = self.bundles.get(name)
+                    self.bundles[name] = bundle
+                    if old is not None and self.refs.get((name, old.version)):
+                        self.retired[(name, old.version)] = old
+            swapped[name] = {
+                "version": bundle.version,
+                "previous_version": old.version if old else None,
+            }
+            logger.info(f"Swapped in {name} model v{bundle.version}")
+        return swapped
+
+    def sync(self, generation):
+        """Reload what is loaded if the parent process reloaded since (workers)"""
+        if generation != self.generation:
+            self.reload()
+            self.generation = generation
+
+    def warm_up(self, names, background=True):
+        """Load ``names`` now, or on a daemon thread when ``background``"""
+
+        def load_all():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    logger.error(f"Warm-up of {name} model failed: {e}")
+
+        if not background:
+            load_all()
+            return None
+        thread = threading.Thread(target=load_all, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        with self.lock:
+            loaded = {
+                name: {
+                    "version": bundle.version,
+                    "load_seconds": round(bundle.load_seconds, 3),
+                    "in_flight": self.refs.get((name, bundle.version), 0),
+                }
+                for name, bundle in self.bundles.items()
+            }
+            retired = [
+                {
+                    "model": name,
+                    "version": version,
+                    "in_flight": self.refs[(name, version)],
+                }
+                for name, version in self.retired
+            ]
+        return {"loaded": loaded, "retired": retired, "available": list(MODEL_NAMES)}
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,141 @@
+"""MongoDB indexes, the flow time field and keyset pagination.
+
+Flows carry ``flow_time``, a real datetime parsed from the CICFlowMeter
+``Timestamp`` string (which sorts lexically, not by time). Every listing is
+sorted by ``(time field, _id)`` descending and backed by a compound index, and
+pages are fetched with an opaque cursor naming the last row served: the next
+page is "rows before that one", so a deep page costs the same as the first
+instead of skipping over everything before it.
+"""
+
+import base64
+from datetime import datetime, timezone
+import json
+import logging
+
+from bson import ObjectId
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from flow_meter import CIC_TIMESTAMP_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# collection -> (time field, filterable fields)
+LISTINGS = {
+    "flows": ("flow_time", ["batch_index", "Src IP", "Dst IP", "Protocol", "Label"]),
+    "batches": ("created_at", ["is_attack"]),
+}
+# Filtered counts stop here and are reported as a lower bound
+COUNT_CAP = 10_000
+COUNT_MODES = ("exact", "estimated", "none")
+# Flow timestamps are local time of the capturing host
+LOCAL_TZ = datetime.now().astimezone().tzinfo
+
+
+def ensure_indexes(db):
+    """Create the listing indexes (a no-op for those that already exist)"""
+    for name, (time_field, fields) in LISTINGS.items():
+        collection = db[name]
+        collection.create_index([(time_field, DESCENDING), ("_id", DESCENDING)])
+        for field in fields:
+            collection.create_index(
+                [(field, ASCENDING), (time_field, DESCENDING), ("_id", DESCENDING)]
+            )
+    logger.info("MongoDB indexes ensured")
+
+
+def flow_times(timestamps: pd.Series) -> list:
+    """CICFlowMeter Timestamp strings -> UTC datetimes (None if unparseable)"""
+    parsed = pd.to_datetime(timestamps, format=CIC_TIMESTAMP_FORMAT, errors="coerce")
+    parsed = parsed.dt.tz_localize(LOCAL_TZ).dt.tz_convert(timezone.utc)
+    return [None if pd.isna(t) else t.to_pydatetime() for t in parsed]
+
+
+def backfill_flow_times(db, chunk=5000) -> int:
+    """Add ``flow_time`` to flows stored before it existed"""
+    collection = db["flows"]
+    updated = 0
+    while True:
+        pending = collection.find({"flow_time": {"$exists": False}}, {"Timestamp": 1})
+        docs = list(pending.limit(chunk))
+        if not docs:
+            break
+        times = flow_times(pd.Series([d.get("Timestamp") for d in docs], dtype=object))
+        collection.bulk_write(
+            [
+                UpdateOne({"_id": d["_id"]}, {"$set": {"flow_time": t}})
+                for d, t in zip(docs, times)
+            ],
+            ordered=False,
+        )
+        updated += len(docs)
+    if updated:
+        logger.info(f"Backfilled flow_time on {updated} flows")
+    return updated
+
+
+def encode_cursor(doc, time_field) -> str:
+    value = doc.get(time_field)
+    value = value.isoformat() if value is not None else None
+    raw = json.dumps([value, str(doc["_id"])]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def keyset_filter(cursor, time_field) -> dict:
+    """Rows after ``cursor`` in (time desc, _id desc) order; ValueError if
+    the cursor is malformed"""
+    try:
+        value, oid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        oid = ObjectId(oid)
+        value = datetime.fromisoformat(value) if value is not None else None
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if value is None:
+        # Rows without a time sort last; only _id orders them
+        return {time_field: None, "_id": {"$lt": oid}}
+    return {
+        "$or": [
+            {time_field: {"$lt": value}},
+            {time_field: value, "_id": {"$lt": oid}},
+            {time_field: None},
+        ]
+    }
+
+
+def fetch_page(
+    collection, query, time_field, limit, cursor=None, projection=None, skip=0
+):
+    """One page in (time desc, _id desc) order; returns ``(docs, next_cursor)``.
+
+    ``skip`` is the old offset paging, honoured only without a cursor.
+    """
+    if cursor:
+        query = {"$and": [query, keyset_filter(cursor, time_field)]}
+    found = collection.find(query, projection).sort(
+        [(time_field, DESCENDING), ("_id", DESCENDING)]
+    )
+    if skip and not cursor:
+        found = found.skip(skip)
+    docs = list(found.limit(limit + 1))
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], time_field)
+    return docs, next_cursor
+
+
+def count(collection, query, mode="estimated") -> dict:
+    """``{"total": n, "exact": bool}``, or {} for mode "none".
+
+    "estimated" reads the collection metadata when unfiltered and stops
+    counting at ``COUNT_CAP`` matches otherwise.
+    """
+    if mode == "none":
+        return {}
+    if mode == "exact":
+        return {"total": collection.count_documents(query), "exact": True}
+    if not query:
+        return {"total": collection.estimated_document_count(), "exact": False}
+    total = collection.count_documents(query, limit=COUNT_CAP)
+    return {"total": total, "exact": total < COUNT_CAP}
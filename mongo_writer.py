@@ -0,0 +1,234 @@
+"""Buffered, asynchronous MongoDB writer for batch and flow documents.
+
+Batch workers hand documents to the writer and move on; a background thread
+flushes each collection's buffer with one unordered ``bulk_write`` once it
+holds ``max_docs`` documents or its oldest document is ``max_latency`` seconds
+old. ``_id``s are assigned on submit, so callers know a document's id before
+it is written and a retried insert is idempotent (duplicate-key errors are
+treated as already written).
+
+Failed writes are retried with exponential backoff up to ``max_retries``
+times. Memory is bounded: past ``max_buffered`` documents the oldest are
+dropped and counted. Works with pymongo, mongomock or any database object whose
+collections implement ``bulk_write``.
+"""
+
+from collections import deque
+import logging
+import threading
+import time
+
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class BulkWriter:
+    def __init__(
+        self,
+        database=None,
+        max_docs=1000,
+        max_latency=1.0,
+        max_buffered=100_000,
+        max_retries=5,
+        retry_backoff=0.5,
+    ):
+        self.database = database
+        self.max_docs = max_docs
+        self.max_latency = max_latency
+        self.max_buffered = max_buffered
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.cond = threading.Condition()
+        self.buffers = {}  # collection -> deque of (enqueued, attempts, doc)
+        self.buffered = 0
+        self.retry_at = 0.0
+        self.in_flight = 0
+        self._stop = False
+        self._thread = None
+        self.counters = {
+            "written": 0,
+            "flushes": 0,
+            "retries": 0,
+            "dropped": 0,
+            "failed": 0,
+        }
+        self.last_error = None
+
+    # ---- producers ----
+
+    def insert(self, collection: str, doc: dict) -> ObjectId:
+        """Queue one document; returns its ``_id``"""
+        return self.insert_many(collection, [doc])[0]
+
+    def insert_many(self, collection: str, docs: list) -> list:
+        now = time.monotonic()
+        ids = []
+        with self.cond:
+            buffer = self.buffers.setdefault(collection, deque())
+            for doc in docs:
+                ids.append(doc.setdefault("_id", ObjectId()))
+                buffer.append((now, 0, doc))
+            self.buffered += len(docs)
+            self._shed()
+            if len(buffer) >= self.max_docs:
+                self.cond.notify_all()
+        return ids
+
+    def _shed(self):
+        """Drop the oldest documents over the memory bound (lock held)"""
+        while self.buffered > self.max_buffered:
+            buffer = max(self.buffers.values(), key=len)
+            buffer.popleft()
+            self.buffered -= 1
+            self.counters["dropped"] += 1
+
+    # ---- flushing ----
+
+    def _due(self, now) -> list:
+        """Collections ready to flush (lock held)"""
+        if now < self.retry_at:
+            return []
+        return [
+            name
+            for name, buffer in self.buffers.items()
+            if buffer
+            and (
+                self._stop
+                or len(buffer) >= self.max_docs
+                or now - buffer[0][0] >= self.max_latency
+            )
+        ]
+
+    def _next_wakeup(self, now) -> float:
+        """Seconds until the oldest buffered document (or a retry) is due"""
+        if now < self.retry_at:
+            return max(self.retry_at - now, 0.01)
+        oldest = [b[0][0] for b in self.buffers.values() if b]
+        if not oldest:
+            return self.max_latency
+        return max(min(oldest) + self.max_latency - now, 0.01)
+
+    def _take(self, name):
+        buffer = self.buffers[name]
+        n = min(len(buffer), self.max_docs)
+        entries = [buffer.popleft() for _ in range(n)]
+        self.buffered -= n
+        self.in_flight += n
+        return entries
+
+    def _write(self, name, entries):
+        """One unordered bulk write; failed entries go back to the buffer"""
+        try:
+            collection = self.database[name]
+            result = collection.bulk_write(
+                [InsertOne(doc) for _, _, doc in entries], ordered=False
+            )
+            written, failed = result.inserted_count, []
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            retry = {err["index"] for err in errors if err["code"] != DUPLICATE_KEY}
+            written = len(entries) - len(retry)
+            failed = [entries[i] for i in sorted(retry)]
+            if retry:
+                self.last_error = errors[0].get("errmsg")
+        except PyMongoError as e:
+            written, failed = 0, entries
+            self.last_error = str(e)
+        except Exception as e:
+            # e.g. bson InvalidDocument or no database yet: never let it end
+            # the writer thread; retried, then counted as failed
+            logger.error(f"Bulk write to {name} failed: {e}")
+            written, failed = 0, entries
+            self.last_error = str(e)
+
+        with self.cond:
+            self.in_flight -= len(entries)
+            self.counters["written"] += written
+            self.counters["flushes"] += 1
+            if not failed:
+                return
+            retry = []
+            for enqueued, attempts, doc in failed:
+                if attempts + 1 > self.max_retries:
+                    self.counters["failed"] += 1
+                else:
+                    retry.append((enqueued, attempts + 1, doc))
+            if retry:
+                self.counters["retries"] += len(retry)
+                self.buffers[name].extendleft(reversed(retry))
+                self.buffered += len(retry)
+                attempts = max(a for _, a, _ in retry)
+                self.retry_at = time.monotonic() + self.retry_backoff * 2 ** (
+                    attempts - 1
+                )
+                self._shed()
+            logger.warning(
+                f"Bulk write to {name}: {len(failed)} documents failed "
+                f"({len(retry)} will be retried): {self.last_error}"
+            )
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Write everything buffered now (retries included, up to ``timeout``)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.cond:
+                if not self.buffered and not self.in_flight:
+                    return True
+                if time.monotonic() >= deadline:
+                    return False
+                wait = self.retry_at - time.monotonic()
+                names = [n for n, b in self.buffers.items() if b] if wait <= 0 else []
+                batches = [(n, self._take(n)) for n in names]
+            if not batches:
+                time.sleep(min(max(wait, 0.01), 0.5))
+                continue
+            for name, entries in batches:
+                self._write(name, entries)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                due = self._due(time.monotonic())
+                while not due and not self._stop:
+                    self.cond.wait(self._next_wakeup(time.monotonic()))
+                    due = self._due(time.monotonic())
+                if self._stop and not due:
+                    return
+                batches = [(name, self._take(name)) for name in due]
+            for name, entries in batches:
+                self._write(name, entries)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(
+            target=self._run, name="mongo-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, flush=True, timeout: float = 10.0):
+        with self.cond:
+            self._stop = True
+            self.cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        if flush:
+            self.flush(timeout)
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "buffered": self.buffered,
+                "in_flight": self.in_flight,
+                "by_collection": {n: len(b) for n, b in self.buffers.items()},
+                "max_docs": self.max_docs,
+                "max_latency": self.max_latency,
+                **self.counters,
+                "last_error": self.last_error,
+            }
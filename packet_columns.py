@@ -0,0 +1,114 @@
+"""Columnar view of a packet batch.
+
+Each packet is decoded once into a handful of NumPy arrays so batch statistics
+can be computed with vectorized operations instead of per-packet ``haslayer``
+calls.
+"""
+
+from dataclasses import dataclass
+import socket
+import struct
+
+import numpy as np
+from scapy.all import IP, TCP
+from scapy.layers.inet6 import IPv6
+
+from raw_capture import RawFrame, parse_headers
+
+PROTO_ICMP, PROTO_TCP, PROTO_UDP = 1, 6, 17
+
+TCP_FLAGS = {
+    "SYN": 0x02,
+    "ACK": 0x10,
+    "FIN": 0x01,
+    "RST": 0x04,
+    "PSH": 0x08,
+    "URG": 0x20,
+    "ECE": 0x40,
+    "CWR": 0x80,
+}
+
+
+def ipv4_to_int(addr: str) -> int:
+    return struct.unpack("!I", socket.inet_aton(addr))[0]
+
+
+@dataclass
+class PacketColumns:
+    ts: np.ndarray  # float64 epoch seconds
+    length: np.ndarray  # uint32 wire length
+    ip_version: np.ndarray  # uint8, 4 / 6 / 0 for non-IP
+    proto: np.ndarray  # uint8 IP protocol / IPv6 next header
+    tcp_flags: np.ndarray  # uint8
+    src: np.ndarray  # uint32 IPv4 source, 0 otherwise
+    dst: np.ndarray  # uint32 IPv4 destination, 0 otherwise
+
+    def __len__(self):
+        return len(self.ts)
+
+    @classmethod
+    def empty(cls, n=0):
+        return cls(
+            ts=np.zeros(n, dtype=np.float64),
+            length=np.zeros(n, dtype=np.uint32),
+            ip_version=np.zeros(n, dtype=np.uint8),
+            proto=np.zeros(n, dtype=np.uint8),
+            tcp_flags=np.zeros(n, dtype=np.uint8),
+            src=np.zeros(n, dtype=np.uint32),
+            dst=np.zeros(n, dtype=np.uint32),
+        )
+
+    @classmethod
+    def from_packets(cls, packets):
+        """Decode scapy packets or RawFrames into preallocated columns (one pass)"""
+        if packets and isinstance(packets[0], RawFrame):
+            return cls.from_frames(packets)
+        cols = cls.empty(len(packets))
+        for i, pkt in enumerate(packets):
+            cols.ts[i] = float(pkt.time)
+            cols.length[i] = len(pkt)
+            ip = pkt.getlayer(IP)
+            if ip is not None:
+                cols.ip_version[i] = 4
+                cols.proto[i] = ip.proto
+                cols.src[i] = ipv4_to_int(ip.src)
+                cols.dst[i] = ipv4_to_int(ip.dst)
+            else:
+                ip = pkt.getlayer(IPv6)
+                if ip is None:
+                    continue
+                cols.ip_version[i] = 6
+                cols.proto[i] = ip.nh
+            if cols.proto[i] == PROTO_TCP:
+                tcp = ip.getlayer(TCP)
+                if tcp is not None:
+                    cols.tcp_flags[i] = int(tcp.flags)
+        return cols
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Fill the columns from fixed-offset header fields of raw frames"""
+        cols = cls.empty(len(frames))
+        ts, length, version = cols.ts, cols.length, cols.ip_version
+        proto, tcp_flags, src, dst = cols.proto, cols.tcp_flags, cols.src, cols.dst
+        for i, frame in enumerate(frames):
+            ts[i] = frame.ts
+            length[i] = len(frame.data)
+            h = parse_headers(frame.data, frame.linktype)
+            if h is None:
+                continue
+            version[i] = h.ip_version
+            proto[i] = h.proto
+            tcp_flags[i] = h.tcp_flags
+            if h.ip_version == 4:
+                src[i] = int.from_bytes(h.src, "big")
+                dst[i] = int.from_bytes(h.dst, "big")
+        return cols
+
+
+def as_columns(packets) -> PacketColumns:
+    return (
+        packets
+        if isinstance(packets, PacketColumns)
+        else PacketColumns.from_packets(packets)
+    )
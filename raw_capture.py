@@ -0,0 +1,372 @@
+"""Raw-frame capture backends.
+
+Frames are kept as ``RawFrame(ts, data, wirelen, linktype)`` and only the
+fixed-offset link/IP/transport header fields the pipeline needs are parsed from
+them. Full scapy packets are built on demand (``to_scapy``), e.g. for the rare
+sampled feed row or the legacy CICFlowMeter path.
+
+Backends:
+- ``AFPacketCapture``: Linux AF_PACKET socket, ``recv_into`` a preallocated buffer
+- ``PcapListenCapture``: libpcap/Npcap through scapy's listen socket, but using
+  ``recv_raw`` so no packet is ever dissected
+- ``PcapFileCapture``: offline replay of a .pcap file (max speed or recorded timing)
+"""
+
+from collections import namedtuple
+import logging
+import socket
+import struct
+import sys
+import time
+
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+ETH_P_ALL = 0x0003
+SNAPLEN = 65535
+
+RawFrame = namedtuple(
+    "RawFrame",
+    ["ts", "data", "wirelen", "linktype"],
+    defaults=(None, LINKTYPE_ETHERNET),
+)
+
+# (ip_version, proto, src, dst, sport, dport, tcp_flags, window, l4_header_len,
+#  payload_len); src/dst are the packed address bytes
+Headers = namedtuple(
+    "Headers",
+    [
+        "ip_version",
+        "proto",
+        "src",
+        "dst",
+        "sport",
+        "dport",
+        "tcp_flags",
+        "window",
+        "header_len",
+        "payload_len",
+    ],
+)
+
+_unpack_u16 = struct.Struct("!H").unpack_from
+_unpack_ports = struct.Struct("!HH").unpack_from
+
+
+def _network_offset(data, linktype):
+    """(offset of the IP header, ethertype) for the supported link types"""
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None, None
+        ethertype = _unpack_u16(data, 12)[0]
+        offset = 14
+        while ethertype in (0x8100, 0x88A8) and len(data) >= offset + 4:  # VLAN
+            ethertype = _unpack_u16(data, offset + 2)[0]
+            offset += 4
+        return offset, ethertype
+    if linktype == LINKTYPE_RAW:
+        if not data:
+            return None, None
+        return 0, 0x0800 if data[0] >> 4 == 4 else 0x86DD
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None, None
+        return 16, _unpack_u16(data, 14)[0]
+    if linktype == LINKTYPE_NULL:
+        if len(data) < 4:
+            return None, None
+        family = struct.unpack_from("=I", data, 0)[0]
+        return 4, 0x0800 if family == 2 else 0x86DD
+    return None, None
+
+
+def parse_headers(data, linktype=LINKTYPE_ETHERNET):
+    """Parse the IP and TCP/UDP header fields of a frame, None if not IP"""
+    offset, ethertype = _network_offset(data, linktype)
+    if offset is None:
+        return None
+
+    if ethertype == 0x0800:
+        if len(data) < offset + 20:
+            return None
+        ihl = (data[offset] & 0x0F) * 4
+        total_len = _unpack_u16(data, offset + 2)[0]
+        fragment_offset = _unpack_u16(data, offset + 6)[0] & 0x1FFF
+        proto = data[offset + 9]
+        src = data[offset + 12 : offset + 16]
+        dst = data[offset + 16 : offset + 20]
+        l4 = offset + ihl
+        l4_len = total_len - ihl
+        version = 4
+        if fragment_offset:  # no transport header in later fragments
+            return Headers(version, proto, src, dst, 0, 0, 0, 0, 0, max(l4_len, 0))
+    elif ethertype == 0x86DD:
+        if len(data) < offset + 40:
+            return None
+        l4_len = _unpack_u16(data, offset + 4)[0]
+        proto = data[offset + 6]
+        src = data[offset + 8 : offset + 24]
+        dst = data[offset + 24 : offset + 40]
+        l4 = offset + 40
+        version = 6
+    else:
+        return None
+
+    if proto == 6 and len(data) >= l4 + 20:
+        sport, dport = _unpack_ports(data, l4)
+        header_len = (data[l4 + 12] >> 4) * 4
+        flags = data[l4 + 13]
+        window = _unpack_u16(data, l4 + 14)[0]
+        payload_len = max(l4_len - header_len, 0)
+        return Headers(
+            version, 6, src, dst, sport, dport, flags, window, header_len, payload_len
+        )
+    if proto == 17 and len(data) >= l4 + 8:
+        sport, dport = _unpack_ports(data, l4)
+        udp_len = _unpack_u16(data, l4 + 4)[0]
+        return Headers(
+            version, 17, src, dst, sport, dport, 0, 0, 8, max(udp_len - 8, 0)
+        )
+    return Headers(version, proto, src, dst, 0, 0, 0, 0, 0, max(l4_len, 0))
+
+
+def ip_to_str(packed: bytes) -> str:
+    if len(packed) == 4:
+        return socket.inet_ntoa(packed)
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+def to_scapy(frame: RawFrame):
+    """Materialize a full scapy packet for one frame"""
+    from scapy.all import Ether, IP, IPv6, Raw
+
+    if frame.linktype == LINKTYPE_ETHERNET:
+        pkt = Ether(frame.data)
+    elif frame.linktype == LINKTYPE_RAW:
+        pkt = (
+            IP(frame.data)
+            if frame.data[:1] and frame.data[0] >> 4 == 4
+            else IPv6(frame.data)
+        )
+    else:
+        from scapy.all import conf
+
+        cls = conf.l2types.get(frame.linktype, Raw)
+        pkt = cls(frame.data)
+    pkt.time = frame.ts
+    return pkt
+
+
+_pcap_header = struct.Struct("<IHHiIII")
+_pcap_record = struct.Struct("<IIII")
+
+
+def write_pcap(f, items) -> int:
+    """Write a classic microsecond pcap from RawFrames (scapy packets are
+    converted) straight from their bytes and timestamps; the link type is the
+    first frame's, as with wrpcap. Returns the bytes written."""
+    frames = [x if isinstance(x, RawFrame) else to_raw_frame(x) for x in items]
+    linktype = frames[0].linktype if frames else LINKTYPE_ETHERNET
+    parts = [_pcap_header.pack(0xA1B2C3D4, 2, 4, 0, 0, SNAPLEN, linktype)]
+    pack = _pcap_record.pack
+    for frame in frames:
+        sec = int(frame.ts)
+        usec = int(round((frame.ts - sec) * 1_000_000))
+        if usec >= 1_000_000:
+            sec, usec = sec + 1, usec - 1_000_000
+        data = frame.data
+        parts.append(pack(sec, usec, len(data), frame.wirelen or len(data)))
+        parts.append(data)
+    blob = b"".join(parts)
+    f.write(blob)
+    return len(blob)
+
+
+# A whole batch as a few arrays plus one bytes blob: cheap to pickle to a
+# worker process, unlike thousands of scapy objects
+FrameBuffer = namedtuple(
+    "FrameBuffer", ["ts", "wirelen", "linktype", "offsets", "data"]
+)
+
+
+def to_raw_frame(pkt) -> RawFrame:
+    """Captured bytes of a scapy packet, with the link type wrpcap would use.
+
+    Dissected packets keep their wire bytes in ``original``; only packets built
+    by hand are serialized, since that recomputes checksums and lengths.
+    """
+    from scapy.all import conf
+
+    data = getattr(pkt, "original", None) or bytes(pkt)
+    linktype = conf.l2types.layer2num.get(type(pkt), LINKTYPE_ETHERNET)
+    return RawFrame(
+        float(pkt.time), data, getattr(pkt, "wirelen", None) or len(data), linktype
+    )
+
+
+def pack_frames(items) -> FrameBuffer:
+    import numpy as np
+
+    frames = [x if isinstance(x, RawFrame) else to_raw_frame(x) for x in items]
+    n = len(frames)
+    ts = np.empty(n, dtype=np.float64)
+    wirelen = np.empty(n, dtype=np.uint32)
+    linktype = np.empty(n, dtype=np.uint16)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    for i, frame in enumerate(frames):
+        ts[i] = frame.ts
+        wirelen[i] = frame.wirelen or len(frame.data)
+        linktype[i] = frame.linktype
+        offsets[i + 1] = offsets[i] + len(frame.data)
+    return FrameBuffer(ts, wirelen, linktype, offsets, b"".join(f.data for f in frames))
+
+
+def unpack_frames(buf: FrameBuffer) -> list:
+    data, offsets = buf.data, buf.offsets.tolist()
+    return [
+        RawFrame(ts, data[offsets[i] : offsets[i + 1]], wirelen, linktype)
+        for i, (ts, wirelen, linktype) in enumerate(
+            zip(buf.ts.tolist(), buf.wirelen.tolist(), buf.linktype.tolist())
+        )
+    ]
+
+
+class AFPacketCapture:
+    """Linux AF_PACKET capture into a preallocated receive buffer"""
+
+    def __init__(self, iface, bufsize=SNAPLEN):
+        self.sock = socket.socket(
+            socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL)
+        )
+        self.sock.bind((iface, 0))
+        self.sock.settimeout(0.5)
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.kernel_drops = 0
+
+    def run(self, callback, stop_event):
+        recv_into = self.sock.recv_into
+        while not stop_event.is_set():
+            try:
+                n = recv_into(self.buf)
+            except socket.timeout:
+                continue
+            callback(RawFrame(time.time(), bytes(self.view[:n]), n, LINKTYPE_ETHERNET))
+
+    def dropped(self):
+        SOL_PACKET, PACKET_STATISTICS = 263, 6
+        raw = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8)
+        self.kernel_drops += struct.unpack("II", raw)[1]  # counters reset on read
+        return self.kernel_drops
+
+    def close(self):
+        self.sock.close()
+
+
+class PcapListenCapture:
+    """libpcap / Npcap capture without dissection (scapy ``recv_raw``)"""
+
+    def __init__(self, iface):
+        from scapy.all import conf
+
+        self.sock = conf.L2listen(iface=iface)
+        self.linktype = LINKTYPE_ETHERNET
+
+    def run(self, callback, stop_event):
+        from scapy.automaton import select_objects
+
+        while not stop_event.is_set():
+            if not select_objects([self.sock], 0.5):
+                continue
+            _, data, ts = self.sock.recv_raw(SNAPLEN)
+            if data:
+                callback(
+                    RawFrame(
+                        float(ts) if ts else time.time(), data, len(data), self.linktype
+                    )
+                )
+
+    def dropped(self):
+        from ctypes import byref
+        from scapy.libs.winpcapy import pcap_stat, pcap_stats
+
+        stat = pcap_stat()
+        if pcap_stats(self.sock.pcap_fd.pcap, byref(stat)) != 0:
+            return None
+        return stat.ps_drop + stat.ps_ifdrop
+
+    def close(self):
+        self.sock.close()
+
+
+class PcapFileCapture:
+    """Replay a classic .pcap file as RawFrames (no scapy involved); .pcap.zst
+    and .pcap.gz archives are decompressed on the fly"""
+
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+
+    def frames(self):
+        path = str(self.path)
+        if path.endswith((".zst", ".gz")):
+            source = pa.input_stream(path, compression="detect", buffer_size=1 << 20)
+        else:
+            source = open(path, "rb")
+        with source as f:
+            header = f.read(24)
+            if len(header) < 24:
+                return
+            magic = header[:4]
+            if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+                endian = "<"
+            elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+                endian = ">"
+            else:
+                raise ValueError(f"{self.path} is not a pcap file (pcapng unsupported)")
+            nano = magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d")
+            linktype = struct.unpack(endian + "I", header[20:24])[0] & 0x0FFFFFFF
+            record = struct.Struct(endian + "IIII")
+            divisor = 1e9 if nano else 1e6
+
+            while True:
+                rec = f.read(16)
+                if len(rec) < 16:
+                    return
+                sec, frac, incl_len, orig_len = record.unpack(rec)
+                data = f.read(incl_len)
+                if len(data) < incl_len:
+                    return
+                yield RawFrame(sec + frac / divisor, data, orig_len, linktype)
+
+    def run(self, callback, stop_event):
+        start_wall = start_ts = None
+        for frame in self.frames():
+            if stop_event.is_set():
+                return
+            if self.realtime:
+                if start_ts is None:
+                    start_wall, start_ts = time.monotonic(), frame.ts
+                delay = (frame.ts - start_ts) - (time.monotonic() - start_wall)
+                if delay > 0:
+                    time.sleep(delay)
+            callback(frame)
+
+    def dropped(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+def open_capture(iface):
+    """Best raw backend for this platform"""
+    if sys.platform.startswith("linux"):
+        return AFPacketCapture(iface)
+    return PcapListenCapture(iface)
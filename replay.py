@@ -0,0 +1,292 @@
+"""Offline pcap replay / benchmark for the whole detection pipeline.
+
+Feeds a pcap file through the same path as live capture
+(handle_packet -> batch stage -> process_packet_batch -> detection ->
+persistence), with in-memory stand-ins for MongoDB and Socket.IO, and reports
+throughput, per-stage latency percentiles, the parent's peak RSS and, in
+process mode, the workers' RSS.
+
+    python replay.py capture.pcap                     # current model, max speed
+    python replay.py capture.pcap --model all         # each model in its own process
+    python replay.py capture.pcap --realtime --decode scapy
+"""
+
+import argparse
+from collections import Counter, defaultdict
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MODELS = ["autoencoder", "kmeans", "svm"]
+
+
+class InMemoryCollection:
+    """The subset of pymongo's Collection API the pipeline uses"""
+
+    def __init__(self):
+        self.docs = []
+        self.lock = threading.Lock()
+
+    def insert_one(self, doc):
+        from bson import ObjectId
+
+        doc.setdefault("_id", ObjectId())
+        with self.lock:
+            self.docs.append(doc)
+        return type("InsertOneResult", (), {"inserted_id": doc["_id"]})()
+
+    def insert_many(self, docs, ordered=True):
+        from bson import ObjectId
+
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        with self.lock:
+            self.docs.extend(docs)
+        return type(
+            "InsertManyResult", (), {"inserted_ids": [d["_id"] for d in docs]}
+        )()
+
+    def bulk_write(self, requests, ordered=True):
+        docs = [op._doc for op in requests]  # InsertOne only
+        self.insert_many(docs)
+        return type("BulkWriteResult", (), {"inserted_count": len(docs)})()
+
+    def count_documents(self, query=None):
+        return len(self.docs)
+
+
+class InMemoryDB:
+    def __init__(self):
+        self.collections = defaultdict(InMemoryCollection)
+
+    def __getitem__(self, name):
+        return self.collections[name]
+
+
+class NullSocketIO:
+    """Counts emits instead of sending them"""
+
+    def __init__(self):
+        self.events = Counter()
+        self.server = None
+
+    def emit(self, event, data=None, **kwargs):
+        self.events[event] += 1
+
+
+def peak_rss_mb():
+    """Peak RSS of this (the parent) process only"""
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+
+
+def workers_rss_mb():
+    """Current RSS summed over the worker processes (0 in thread mode)"""
+    import psutil
+
+    total = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return round(total / (1024 * 1024), 1)
+
+
+def run_replay(
+    pcap,
+    model,
+    realtime=False,
+    decode="raw",
+    batch_size=None,
+    max_latency=None,
+    execution="threads",
+):
+    """Replay ``pcap`` with ``model`` in this process and return the report dict"""
+    import function2
+    from model_state import set_model
+    from metrics import stage_timer
+    from raw_capture import PcapFileCapture, to_scapy
+
+    set_model(model)
+    function2.EXECUTION_MODE = execution
+    database, emitter = InMemoryDB(), NullSocketIO()
+    function2.configure_backends(database=database, emitter=emitter)
+    function2.configure_storage(tempfile.mkdtemp(prefix="replay_batches_"))
+    function2.batcher.configure(max_size=batch_size, max_latency=max_latency)
+    stage_timer.reset()
+
+    function2.start_pipeline()
+    function2.batcher.start()
+
+    capture_queue = function2.capture_queue
+    count = 0
+
+    def on_frame(frame):
+        nonlocal count
+        # Replay is lossless: wait for the batch stage instead of dropping
+        while capture_queue.full():
+            time.sleep(0.0005)
+        function2.handle_packet(to_scapy(frame) if decode == "scapy" else frame)
+        count += 1
+
+    start = time.perf_counter()
+    PcapFileCapture(pcap, realtime=realtime).run(on_frame, threading.Event())
+    capture_done = time.perf_counter()
+
+    function2.drain_pipeline(timeout=600)
+    function2.batcher.stop(flush=False)
+    function2.flush_capture()
+    # Workers exit on shutdown, so take their RSS while they are still up
+    workers_rss = workers_rss_mb()
+    function2.shutdown_executors(wait=True)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "model": model,
+        "decode": decode,
+        "execution": execution,
+        "realtime": realtime,
+        "packets": count,
+        "seconds": round(elapsed, 3),
+        "packets_per_sec": round(count / elapsed, 1) if elapsed else None,
+        "capture_packets_per_sec": (
+            round(count / (capture_done - start), 1) if capture_done > start else None
+        ),
+        "batches": database["batches"].count_documents({}),
+        "flows": database["flows"].count_documents({}),
+        "attack_batches": sum(
+            1 for doc in database["batches"].docs if doc.get("is_attack")
+        ),
+        "stages": stage_timer.summary(),
+        "capture": function2.pipeline_stats(),
+        "work_queue": function2.work_queue.stats(),
+        "mongo_writer": function2.mongo_writer.stats(),
+        "emits": dict(emitter.events),
+        "peak_rss_mb": peak_rss_mb(),
+        "workers_rss_mb": workers_rss,
+        "batch_dir": str(function2.BATCH_DIR),
+    }
+
+
+def print_report(report):
+    print(f"\n=== {report['model']} ({report['decode']}, {report['execution']}) ===")
+    print(
+        f"{report['packets']} packets in {report['seconds']}s -> "
+        f"{report['packets_per_sec']} pkt/s end-to-end, "
+        f"{report['capture_packets_per_sec']} pkt/s ingest"
+    )
+    print(
+        f"batches={report['batches']} attack_batches={report['attack_batches']} "
+        f"flows={report['flows']} peak_rss={report['peak_rss_mb']} MB (parent) "
+        f"workers_rss={report['workers_rss_mb']} MB"
+    )
+    queue = report["work_queue"]
+    print(
+        f"batch queue: shed={queue['shed']} degraded={queue['degraded']} "
+        f"blocked={queue['blocked_seconds']}s wait_max={queue['wait_max_ms']} ms"
+    )
+    writer = report["mongo_writer"]
+    print(
+        f"mongo writer: written={writer['written']} flushes={writer['flushes']} "
+        f"retries={writer['retries']} dropped={writer['dropped']}"
+    )
+    print(
+        f"{'stage':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    for stage, s in report["stages"].items():
+        print(
+            f"{stage:<16}{s['count']:>8}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}"
+            f"{s['p99_ms']:>10.3f}{s['max_ms']:>10.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pcap")
+    parser.add_argument(
+        "--model", default="kmeans", choices=MODELS + ["ensemble", "all"]
+    )
+    parser.add_argument(
+        "--realtime", action="store_true", help="honour recorded timing"
+    )
+    parser.add_argument(
+        "--decode",
+        default="raw",
+        choices=["raw", "scapy"],
+        help="feed RawFrames (raw capture backend) or dissected scapy packets",
+    )
+    parser.add_argument(
+        "--execution",
+        default="threads",
+        choices=["threads", "processes"],
+        help="analyze batches on the thread pool or on worker processes",
+    )
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--max-latency", type=float)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    if args.model != "all":
+        report = run_replay(
+            args.pcap,
+            args.model,
+            args.realtime,
+            args.decode,
+            args.batch_size,
+            args.max_latency,
+            args.execution,
+        )
+        if args.json:
+            print("REPORT " + json.dumps(report))
+        else:
+            print_report(report)
+        return
+
+    # One process per model so peak RSS is measured per model
+    for model in MODELS:
+        cmd = [
+            sys.executable,
+            __file__,
+            args.pcap,
+            "--model",
+            model,
+            "--decode",
+            args.decode,
+            "--execution",
+            args.execution,
+            "--json",
+        ]
+        if args.realtime:
+            cmd.append("--realtime")
+        if args.batch_size:
+            cmd += ["--batch-size", str(args.batch_size)]
+        if args.max_latency:
+            cmd += ["--max-latency", str(args.max_latency)]
+        out = subprocess.run(
+            cmd, capture_output=True, text=True, cwd=os.path.dirname(__file__) or "."
+        )
+        line = next(
+            (l for l in out.stdout.splitlines() if l.startswith("REPORT ")), None
+        )
+        if line is None:
+            print(f"\n=== {model} failed ===\n{out.stderr[-2000:]}")
+            continue
+        print_report(json.loads(line[len("REPORT ") :]))
+
+
+if __name__ == "__main__":
+    main()
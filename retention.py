@@ -0,0 +1,470 @@
+"""Batch artifact retention: compressed pcaps, expiry and compaction.
+
+Batch pcaps are written compressed (``PCAP_COMPRESSION``: zstd, gzip or none;
+the codec follows the file suffix, so readers need no configuration). They
+stay classic pcap, not pcapng: ``PcapFileCapture`` (replay) and CICFlowMeter
+read only classic pcap, and compaction cuts batches out of an hour archive by
+byte range, which relies on pcap's single global header. A
+background sweep every ``RETENTION_INTERVAL`` seconds then:
+
+- compacts benign batches whose hour ended ``COMPACT_AFTER_MINUTES`` ago: their
+  pcaps are concatenated into ``archive/benign_<hour>_<n>.pcap.zst`` (each
+  batch keeps its byte range in ``pcap_range``) and their flow files into
+  ``compacted_<n>.parquet`` per flow store partition, and the batch documents
+  are pointed at the merged files. Every sweep writes new segments ``<n>``, so
+  a late batch never makes an hour's earlier segments be rewritten;
+- expires artifacts of attack batches after ``RETAIN_ATTACK_DAYS`` and of
+  benign ones after ``RETAIN_BENIGN_HOURS`` (both default to 0, which keeps
+  them forever, as before retention existed);
+- while the artifacts take more than ``RETAIN_MAX_GB``, expires the oldest
+  benign batches, then the oldest attack batches.
+
+Expired batches keep their document (stats, detection, windows) with
+``artifacts_expired`` set and no file paths; a shared archive is deleted
+with the last batch referencing it.
+"""
+
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+from pathlib import Path
+import shutil
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from flow_store import FLOWS_COMPRESSION, batch_flows_paths, flow_store
+
+logger = logging.getLogger(__name__)
+
+PCAP_COMPRESSION = os.environ.get("PCAP_COMPRESSION", "zstd")
+# 0 = keep forever
+RETAIN_ATTACK_DAYS = float(os.environ.get("RETAIN_ATTACK_DAYS", 0))
+RETAIN_BENIGN_HOURS = float(os.environ.get("RETAIN_BENIGN_HOURS", 0))
+# 0 = no total size cap
+RETAIN_MAX_GB = float(os.environ.get("RETAIN_MAX_GB", 0))
+COMPACT_AFTER_MINUTES = float(os.environ.get("COMPACT_AFTER_MINUTES", 60))
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", 300))
+PCAP_SUFFIXES = {"zstd": ".pcap.zst", "gzip": ".pcap.gz", "none": ".pcap"}
+PCAP_HEADER_BYTES = 24
+COMPACTED_FLOWS = "compacted"
+COPY_CHUNK = 1 << 20
+
+
+def pcap_suffix() -> str:
+    return PCAP_SUFFIXES.get(PCAP_COMPRESSION, ".pcap")
+
+
+def open_artifact(path, mode="rb"):
+    """Open a batch file, (de)compressing by its suffix (.zst, .gz)"""
+    if "w" in mode:
+        return pa.output_stream(str(path), compression="detect")
+    return pa.input_stream(str(path), compression="detect")
+
+
+def _copy(src, dst, length=None) -> int:
+    """Copy ``length`` bytes (all if None) between streams; returns the count"""
+    copied = 0
+    while length is None or copied < length:
+        n = COPY_CHUNK if length is None else min(COPY_CHUNK, length - copied)
+        chunk = src.read(n)
+        if not chunk:
+            break
+        if dst is not None:
+            dst.write(chunk)
+        copied += len(chunk)
+    return copied
+
+
+def iter_batch_pcap(batch: dict):
+    """Yield a batch's packets as an uncompressed pcap, cut out of the hour
+    archive if it was compacted. Raises ``FileNotFoundError`` if missing."""
+    path = batch.get("pcap_file_path")
+    if not path or not os.path.exists(path):
+        raise FileNotFoundError(f"No pcap for batch {batch.get('batch_name')}")
+    pcap_range = batch.get("pcap_range")
+    with open_artifact(path) as f:
+        yield f.read(PCAP_HEADER_BYTES)
+        if pcap_range:
+            start, end = pcap_range
+            _copy(f, None, start - PCAP_HEADER_BYTES)
+            remaining = end - start
+        else:
+            remaining = None
+        while remaining is None or remaining > 0:
+            n = COPY_CHUNK if remaining is None else min(COPY_CHUNK, remaining)
+            chunk = f.read(n)
+            if not chunk:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def next_segment(directory: Path, stem: str) -> int:
+    """Number of the next ``<stem>_<n>.*`` file in ``directory``"""
+    taken = [-1]
+    for path in directory.glob(f"{stem}_*"):
+        n = path.name.split(".")[0].rsplit("_", 1)[1]
+        if n.isdigit():
+            taken.append(int(n))
+    return max(taken) + 1
+
+
+def tmp_path(target: Path) -> Path:
+    """Where ``target`` is written before it is moved into place"""
+    # Dot-prefixed: skipped by flow store dataset discovery; same suffix, so
+    # the same codec
+    return target.with_name(f".tmp-{target.name}")
+
+
+class Retention:
+    def __init__(self, database=None, batch_dir=None):
+        self.database = database
+        self.batch_dir = Path(batch_dir or Path(__file__).parent / "batches")
+        self.last_sweep = None
+        self.totals = {"compacted": 0, "expired": 0, "freed_bytes": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def archive_dir(self) -> Path:
+        return self.batch_dir / "archive"
+
+    # ---- file bookkeeping ----
+
+    def _shared(self, path: Path, batch_id) -> bool:
+        """Whether another live batch still references ``path``"""
+        return (
+            self.database["batches"].count_documents(
+                {
+                    "_id": {"$ne": batch_id},
+                    "$or": [{"pcap_file_path": str(path)}, {"flows_files": str(path)}],
+                },
+                limit=1,
+            )
+            > 0
+        )
+
+    def _unlink(self, path: Path) -> int:
+        """Delete a file (and a flow store partition it leaves empty)"""
+        size = path.stat().st_size
+        path.unlink()
+        if path.parent.parent == flow_store.root and not any(path.parent.iterdir()):
+            path.parent.rmdir()
+        return size
+
+    def _batch_path(self, batch: dict) -> Path:
+        pcap = batch.get("pcap_file_path")
+        if pcap and Path(pcap).parent != self.archive_dir:
+            return Path(pcap).parent
+        # Degraded or compacted batches
+        return self.batch_dir / batch["batch_name"]
+
+    def delete_artifacts(self, batch: dict):
+        """Delete a batch's files that no other batch shares; returns
+        ``(deleted, failed, freed_bytes)``"""
+        paths = [Path(batch["pcap_file_path"])] if batch.get("pcap_file_path") else []
+        paths.extend(batch_flows_paths(batch))
+        deleted, failed, freed = [], [], 0
+        for path in paths:
+            try:
+                if not path.exists() or self._shared(path, batch["_id"]):
+                    continue
+                freed += self._unlink(path)
+                deleted.append(str(path))
+            except Exception as e:
+                logger.error(f"Failed to delete file {path}: {e}")
+                failed.append(str(path))
+        try:
+            batch_path = self._batch_path(batch)
+            if batch_path.is_dir():
+                shutil.rmtree(batch_path)
+        except Exception as e:
+            logger.error(f"Failed to delete batch directory: {e}")
+        return deleted, failed, freed
+
+    def release(self, batch: dict) -> int:
+        """Expire a batch's artifacts, keeping its document; returns bytes freed"""
+        _, _, freed = self.delete_artifacts(batch)
+        self.database["batches"].update_one(
+            {"_id": batch["_id"]},
+            {
+                "$set": {
+                    "artifacts_expired": True,
+                    "pcap_file_path": None,
+                    "flows_files": [],
+                    "flows_file_path": None,
+                    "csv_file_path": None,
+                },
+                "$unset": {"pcap_range": ""},
+            },
+        )
+        return freed
+
+    def disk_usage(self) -> int:
+        roots = [self.batch_dir]
+        if not flow_store.root.is_relative_to(self.batch_dir):
+            roots.append(flow_store.root)
+        total = 0
+        for root in roots:
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    try:
+                        total += os.path.getsize(os.path.join(dirpath, name))
+                    except OSError:
+                        pass
+        return total
+
+    # ---- compaction ----
+
+    def _merge_pcaps(self, hour, batches) -> tuple:
+        """Concatenate the batches' pcaps into a new segment of the hour archive;
+        returns ``(segment, {batch _id: [start, end]})`` with byte ranges in the
+        uncompressed segment"""
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"benign_{hour}"
+        target = (
+            self.archive_dir
+            / f"{stem}_{next_segment(self.archive_dir, stem)}{pcap_suffix()}"
+        )
+        tmp = tmp_path(target)
+        ranges = {}
+        header = None
+        offset = 0
+        try:
+            with open_artifact(tmp, "wb") as out:
+                for batch in batches:
+                    path = batch.get("pcap_file_path")
+                    if not path or not os.path.exists(path):
+                        continue
+                    with open_artifact(path) as f:
+                        batch_header = f.read(PCAP_HEADER_BYTES)
+                        if header is None:
+                            header = batch_header
+                            out.write(header)
+                            offset = PCAP_HEADER_BYTES
+                        elif batch_header != header:
+                            # Other link type / snaplen: stays a file of its own
+                            continue
+                        start = offset
+                        offset += _copy(f, out)
+                        ranges[batch["_id"]] = [start, offset]
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            raise
+        if header is None:
+            tmp.unlink()
+            return None, {}
+        os.replace(tmp, target)
+        return target, ranges
+
+    def _merge_flows(self, batches) -> dict:
+        """Merge the batches' flow files into a new ``compacted_<n>.parquet``
+        per partition; returns ``{batch _id: [flow files]}`` for merged batches.
+
+        A batch is merged only if every one of its files can be (in the flow
+        store, same schema as the other files going into the segment).
+        """
+        schemas = {}  # partition -> schema of its new segment
+        targets = {}  # partition -> new segment
+        members = {}  # partition -> [(batch _id, file)]
+        merged = {}
+        for batch in batches:
+            paths = [Path(p) for p in batch.get("flows_files") or []]
+            if not paths or not all(
+                p.exists() and p.parent.parent == flow_store.root for p in paths
+            ):
+                continue
+            for path in paths:
+                schemas.setdefault(path.parent, pq.read_schema(path))
+            if not all(pq.read_schema(p).equals(schemas[p.parent]) for p in paths):
+                continue
+            for path in paths:
+                if path.parent not in targets:
+                    n = next_segment(path.parent, COMPACTED_FLOWS)
+                    targets[path.parent] = (
+                        path.parent / f"{COMPACTED_FLOWS}_{n}.parquet"
+                    )
+                members.setdefault(path.parent, []).append((batch["_id"], path))
+            merged[batch["_id"]] = [str(targets[p.parent]) for p in paths]
+
+        for partition, files in members.items():
+            target = targets[partition]
+            tmp = tmp_path(target)
+            try:
+                with pq.ParquetWriter(
+                    tmp, schemas[partition], compression=FLOWS_COMPRESSION
+                ) as writer:
+                    for _, path in files:
+                        parquet = pq.ParquetFile(path)
+                        # Row group by row group: each batch keeps its own
+                        for i in range(parquet.metadata.num_row_groups):
+                            writer.write_table(parquet.read_row_group(i))
+            except Exception:
+                tmp.unlink(missing_ok=True)
+                raise
+            os.replace(tmp, target)
+        return merged
+
+    def compact(self, now=None) -> int:
+        """Merge benign batches of finished hours; returns how many batches"""
+        now = now or datetime.now(timezone.utc)
+        cutoff = (now - timedelta(minutes=COMPACT_AFTER_MINUTES)).replace(
+            minute=0, second=0, microsecond=0
+        )
+        batches = self.database["batches"]
+        pending = batches.find(
+            {
+                "is_attack": False,
+                "created_at": {"$lt": cutoff},
+                "compacted": {"$ne": True},
+                "artifacts_expired": {"$ne": True},
+            }
+        ).sort("created_at", 1)
+        hours = {}
+        for batch in pending:
+            hours.setdefault(batch["created_at"].strftime("%Y%m%d%H"), []).append(batch)
+
+        compacted = 0
+        for hour, group in hours.items():
+            try:
+                segment, ranges = self._merge_pcaps(hour, group)
+                flows = self._merge_flows(group)
+            except Exception as e:
+                logger.error(f"Failed to compact batches of hour {hour}: {e}")
+                continue
+            for batch in group:
+                update = {"compacted": True}
+                if batch["_id"] in ranges:
+                    update["pcap_file_path"] = str(segment)
+                    update["pcap_range"] = ranges[batch["_id"]]
+                if batch["_id"] in flows:
+                    update["flows_files"] = flows[batch["_id"]]
+                batches.update_one({"_id": batch["_id"]}, {"$set": update})
+                # The originals go once nothing points at them
+                originals = []
+                if "pcap_range" in update:
+                    originals.append(batch["pcap_file_path"])
+                if "flows_files" in update:
+                    originals.extend(batch["flows_files"])
+                for path in originals:
+                    try:
+                        self._unlink(Path(path))
+                    except FileNotFoundError:
+                        pass
+                    except Exception as e:
+                        logger.error(f"Failed to delete file {path}: {e}")
+                batch_path = self.batch_dir / batch["batch_name"]
+                if batch_path.is_dir() and not any(batch_path.iterdir()):
+                    batch_path.rmdir()
+                compacted += 1
+        return compacted
+
+    # ---- expiry ----
+
+    def expire(self, now=None) -> tuple:
+        """Release batches past their retention; returns ``(batches, bytes)``"""
+        now = now or datetime.now(timezone.utc)
+        expired = freed = 0
+        for is_attack, keep in (
+            (True, timedelta(days=RETAIN_ATTACK_DAYS)),
+            (False, timedelta(hours=RETAIN_BENIGN_HOURS)),
+        ):
+            if not keep:
+                continue
+            query = {
+                "is_attack": is_attack,
+                "created_at": {"$lt": now - keep},
+                "artifacts_expired": {"$ne": True},
+            }
+            for batch in self.database["batches"].find(query).sort("created_at", 1):
+                freed += self.release(batch)
+                expired += 1
+        return expired, freed
+
+    def enforce_size_cap(self) -> tuple:
+        """Release the oldest benign, then attack, batches while over
+        ``RETAIN_MAX_GB``; returns ``(batches, bytes)``"""
+        if RETAIN_MAX_GB <= 0:
+            return 0, 0
+        cap = RETAIN_MAX_GB * 1024**3
+        used = self.disk_usage()
+        expired = freed = 0
+        if used <= cap:
+            return 0, 0
+        oldest = (
+            self.database["batches"]
+            .find({"artifacts_expired": {"$ne": True}})
+            .sort([("is_attack", 1), ("created_at", 1)])
+        )
+        for batch in oldest:
+            if used - freed <= cap:
+                break
+            freed += self.release(batch)
+            expired += 1
+        if used - freed > cap:
+            logger.warning(
+                f"Batch artifacts still take {(used - freed) / 1024**3:.2f} GB "
+                f"(cap {RETAIN_MAX_GB} GB)"
+            )
+        return expired, freed
+
+    def sweep(self) -> dict:
+        """One compaction + expiry pass"""
+        if self.database is None:
+            return {}
+        result = {"compacted": 0, "expired": 0, "freed_bytes": 0}
+        steps = (
+            ("compact", self.compact),
+            ("expire", self.expire),
+            ("size cap", self.enforce_size_cap),
+        )
+        for name, step in steps:
+            try:
+                out = step()
+            except Exception as e:
+                logger.error(f"Retention {name} failed: {e}")
+                continue
+            if name == "compact":
+                result["compacted"] += out
+            else:
+                result["expired"] += out[0]
+                result["freed_bytes"] += out[1]
+        for key, value in result.items():
+            self.totals[key] += value
+        self.last_sweep = datetime.now(timezone.utc)
+        if any(result.values()):
+            logger.info(
+                f"Retention: compacted {result['compacted']} batches, expired "
+                f"{result['expired']}, freed {result['freed_bytes'] / 1e6:.1f} MB"
+            )
+        return result
+
+    def stats(self) -> dict:
+        return {
+            **self.totals,
+            "last_sweep": self.last_sweep.isoformat() if self.last_sweep else None,
+            "pcap_compression": PCAP_COMPRESSION,
+            "retain_attack_days": RETAIN_ATTACK_DAYS,
+            "retain_benign_hours": RETAIN_BENIGN_HOURS,
+            "retain_max_gb": RETAIN_MAX_GB,
+        }
+
+    def _run(self):
+        while not self._stop.wait(RETENTION_INTERVAL):
+            self.sweep()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+retention = Retention()
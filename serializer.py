@@ -0,0 +1,82 @@
+"""The one JSON serializer for REST responses and Socket.IO events.
+
+orjson encodes str/int/float/bool/dict/list/datetime and numpy arrays and
+scalars in C; the ``default`` hook only sees what it can't, such as ObjectId
+and pandas Timestamps. NaN and +/-Inf become ``null``. Naive datetimes (as
+read back from MongoDB) are UTC and are written with an offset.
+
+``extended=True`` writes ObjectIds as ``{"$oid": ...}``, the MongoDB
+extended-JSON shape the dashboard reads batch and alert ids from.
+"""
+
+from datetime import date
+
+from bson import Decimal128, ObjectId
+from flask.json.provider import JSONProvider
+import numpy as np
+import orjson
+import pandas as pd
+
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _extended_default(obj):
+    if isinstance(obj, ObjectId):
+        return {"$oid": str(obj)}
+    return _default(obj)
+
+
+def dumps(obj, extended=False) -> bytes:
+    return orjson.dumps(
+        obj, default=_extended_default if extended else _default, option=OPTIONS
+    )
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider: ``jsonify`` and ``app.json`` go through ``dumps``"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype="application/json")
+
+
+class SocketJSON:
+    """``json`` module stand-in for python-socketio packet encoding; ids are
+    sent in extended form"""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs) -> str:
+        return dumps(obj, extended=True).decode()
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        return loads(s)
@@ -1,5 +1,5 @@
-from flask import Flask, jsonify, request
-from concurrent.futures import ThreadPoolExecutor
+from metrics import startup_timer
+from flask import Flask, Response, jsonify, request, stream_with_context
 import threading
 from flask_socketio import SocketIO
 import logging
@@ -9,13 +9,56 @@ from dotenv import load_dotenv
 import atexit
 import signal
 import sys
-from function2 import handle_packet
+import time
+from function2 import (
+    handle_packet,
+    batcher,
+    flush_capture,
+    start_pipeline,
+    drain_pipeline,
+    pipeline_stats,
+    capture_stats,
+    live_feed,
+    configure_backends,
+    shutdown_executors,
+    work_queue,
+    mongo_writer,
+)
+from raw_capture import open_capture
+from inference import window_builder
+from model_registry import (
+    MODEL_NAMES,
+    MODEL_WARMUP,
+    SELECTABLE_MODELS,
+    model_registry,
+    models_for,
+)
+from ensemble import ensemble
+from flow_summary import flow_summary
+from retention import iter_batch_pcap, retention
+import serializer
+from mongo_schema import (
+    COUNT_MODES,
+    backfill_flow_times,
+    count,
+    ensure_indexes,
+    fetch_page,
+)
+from flow_store import (
+    batch_flows_paths,
+    count_batch_flows,
+    flow_store,
+    iter_batch_flows,
+    local_time,
+    read_batch_page,
+)
 from flask_cors import CORS
-from scapy.all import sniff
+from scapy.all import sniff, conf
 import numpy as np
 import os
-from bson import ObjectId, json_util
-import json
+import psutil
+from bson import ObjectId
+from bson.errors import InvalidId
 from socket_instance import socketio, app
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
@@ -23,11 +66,14 @@ import datetime
 from functools import wraps
 import pandas as pd
 
-from collections import Counter
 from bson.regex import Regex
 from model_state import set_model
 
+startup_timer.mark("imports")
+
 capture_interface = "Wi-Fi"
+# "scapy" = sniff() with dissected packets, "raw" = raw frames, header fields only
+CAPTURE_BACKEND = os.environ.get("CAPTURE_BACKEND", "scapy")
 
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
 
@@ -38,7 +84,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-executor = ThreadPoolExecutor(max_workers=12)
 lock = threading.Lock()
 
 load_dotenv()
@@ -59,7 +104,13 @@ try:
     batches_collection = db["batches"]
     alerts_collection = db["alerts"]
     flows_collection = db["flows"]
+    configure_backends(database=db)
     logger.info("Successfully connected to MongoDB")
+    startup_timer.mark("mongodb")
+    try:
+        ensure_indexes(db)
+    except Exception as e:
+        logger.error(f"Failed to create MongoDB indexes: {e}")
 except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {e}")
     sys.exit(1)
@@ -98,7 +149,9 @@ def cleanup():
     logger.info("Cleaning up resources...")
     if sniff_thread and sniff_thread.is_alive():
         sniff_control.set()
-    executor.shutdown(wait=False)
+    shutdown_executors(wait=False)
+    flow_summary.stop()
+    retention.stop()
     if "client" in globals():
         client.close()
     logger.info("Cleanup complete")
@@ -111,14 +164,79 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 
+def kernel_drop_count(sock):
+    """Packets dropped by the OS/driver before scapy saw them, None if unknown"""
+    try:
+        pcap_fd = getattr(sock, "pcap_fd", None)
+        if pcap_fd is not None:  # libpcap / Npcap: cumulative counters
+            from ctypes import byref
+            from scapy.libs.winpcapy import pcap_stat, pcap_stats
+
+            stat = pcap_stat()
+            if pcap_stats(pcap_fd.pcap, byref(stat)) == 0:
+                return stat.ps_drop + stat.ps_ifdrop
+            return None
+        if sys.platform.startswith("linux"):  # AF_PACKET: counters reset on read
+            import struct
+
+            SOL_PACKET, PACKET_STATISTICS = 263, 6
+            raw = sock.ins.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8)
+            _, drops = struct.unpack("II", raw)
+            return (capture_stats["kernel_drops"] or 0) + drops
+    except Exception as e:
+        logger.debug(f"Kernel drop counters unavailable: {e}")
+    return None
+
+
+def run_raw_capture():
+    """Raw-frame capture loop: no scapy packet is built per frame"""
+    capture = open_capture(capture_interface)
+    capture_stats["kernel_drops"] = None
+    next_poll = 0.0
+
+    def on_frame(frame):
+        nonlocal next_poll
+        handle_packet(frame)
+        if frame.ts >= next_poll:
+            next_poll = frame.ts + 1.0
+            try:
+                capture_stats["kernel_drops"] = capture.dropped()
+            except Exception as e:
+                logger.debug(f"Kernel drop counters unavailable: {e}")
+
+    try:
+        capture.run(on_frame, sniff_control)
+    finally:
+        capture.close()
+
+
 def run_sniff():
     """Wrapper function for sniff that respects the stop signal"""
-    sniff(
-        iface=capture_interface,
-        prn=handle_packet,
-        store=False,
-        stop_filter=lambda x: sniff_control.is_set(),
-    )
+    if CAPTURE_BACKEND == "raw":
+        return run_raw_capture()
+
+    sock = conf.L2listen(iface=capture_interface)
+    capture_stats["kernel_drops"] = None
+    next_poll = [0.0]
+
+    def stop_filter(_):
+        now = time.monotonic()
+        if now >= next_poll[0]:  # poll drop counters at most once a second
+            next_poll[0] = now + 1.0
+            drops = kernel_drop_count(sock)
+            if drops is not None:
+                capture_stats["kernel_drops"] = drops
+        return sniff_control.is_set()
+
+    try:
+        sniff(
+            opened_socket=sock,
+            prn=handle_packet,
+            store=False,
+            stop_filter=stop_filter,
+        )
+    finally:
+        sock.close()
 
 
 def start_packet_capture():
@@ -129,7 +247,9 @@ def start_packet_capture():
             target=run_sniff,
             daemon=True,
         )
+        start_pipeline()
         sniff_thread.start()
+        batcher.start()
         is_sniffing = True
         socketio.emit("capture_status", {"is_sniffing": True})
         logger.info("Packet capture started")
@@ -142,6 +262,10 @@ def stop_packet_capture():
     if is_sniffing:
         sniff_control.set()
         is_sniffing = False
+        # Process the partial batch instead of dropping it
+        batcher.stop(flush=False)
+        drain_pipeline()
+        flush_capture()
         set_total_packet_count(0)
         socketio.emit("capture_status", {"is_sniffing": False})
         socketio.emit("new_packet", {"total_packet_count": 0})
@@ -172,7 +296,85 @@ def update_capture_interface():
         return jsonify({"error": str(e)}), 500
 
 
-import psutil
+@app.route("/api/capture/batching", methods=["GET"])
+def get_batching():
+    return jsonify(batcher.stats())
+
+
+@app.route("/api/capture/batching", methods=["POST"])
+def update_batching():
+    """Change batch size / max latency without restarting capture"""
+    try:
+        data = request.get_json() or {}
+        batcher.configure(
+            max_size=data.get("max_packets"), max_latency=data.get("max_latency")
+        )
+        return jsonify(
+            {"max_packets": batcher.max_size, "max_latency": batcher.max_latency}
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/capture/queue", methods=["GET"])
+def get_work_queue():
+    return jsonify(work_queue.stats())
+
+
+@app.route("/api/capture/queue", methods=["POST"])
+def update_work_queue():
+    """Change the batch queue size, overflow policy and degraded-mode threshold"""
+    try:
+        data = request.get_json() or {}
+        work_queue.configure(
+            maxsize=data.get("capacity"),
+            policy=data.get("policy"),
+            sample_every=data.get("sample_every"),
+            degrade_at=data.get("degrade_at"),
+        )
+        return jsonify(work_queue.stats())
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/feed", methods=["GET"])
+def get_feed_settings():
+    return jsonify(live_feed.stats())
+
+
+@app.route("/api/feed", methods=["POST"])
+def update_feed_settings():
+    """Change live feed interval / sample rate / per-client row budget"""
+    try:
+        data = request.get_json() or {}
+        live_feed.configure(
+            interval=data.get("interval"),
+            sample_rate=data.get("sample_rate"),
+            max_rows_per_client=data.get("max_rows_per_client"),
+        )
+        return jsonify(live_feed.stats())
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/inference", methods=["GET"])
+def get_inference_settings():
+    return jsonify(window_builder.settings())
+
+
+@app.route("/api/inference", methods=["POST"])
+def update_inference_settings():
+    """Change the window mode (sliding / host / batch), window size and stride"""
+    try:
+        data = request.get_json() or {}
+        window_builder.configure(
+            mode=data.get("mode"),
+            window=data.get("window"),
+            stride=data.get("stride"),
+        )
+        return jsonify(window_builder.settings())
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
 
 @app.route("/api/capture/interface", methods=["GET"])
@@ -332,8 +534,15 @@ def api_status():
                 "status": "running" if is_sniffing else "stopped",
                 "packet_count": packet_count,
                 "total_packet_count": get_total_packet_count(),
-                "buffer_size": len(packet_buffer),
+                "buffer_size": batcher.stats()["pending"],
                 "last_processed": file_index,
+                "batching": batcher.stats(),
+                "capture": pipeline_stats(),
+                "work_queue": work_queue.stats(),
+                "mongo_writer": mongo_writer.stats(),
+                "retention": retention.stats(),
+                "models": model_registry.stats(),
+                "startup": startup_timer.summary(),
                 "is_sniffing": is_sniffing,
                 "thread_alive": sniff_thread.is_alive() if sniff_thread else False,
             }
@@ -345,37 +554,114 @@ def api_status():
 
 @app.route("/api/batches/all", methods=["GET"])
 def get_all_batches():
-    """Lấy toàn bộ batches từ MongoDB (không phân trang)"""
+    """
+    Lấy toàn bộ batches từ MongoDB (không phân trang), streamed from a
+    server-side cursor, newest first:
+    - format: json (default, {"data": [...], "total": n}) or ndjson
+    - fields (comma-separated projection; default all)
+    - start, end (ISO time on created_at; end exclusive), is_attack
+    """
+    try:
+        output = request.args.get("format", "json")
+        if output not in ("json", "ndjson"):
+            return jsonify({"error": "format must be json or ndjson"}), 400
 
-    def parse_json(data):
-        return json.loads(json_util.dumps(data))
+        query = {}
+        try:
+            created = {}
+            if request.args.get("start"):
+                created["$gte"] = pd.Timestamp(request.args["start"]).to_pydatetime()
+            if request.args.get("end"):
+                created["$lt"] = pd.Timestamp(request.args["end"]).to_pydatetime()
+        except ValueError:
+            return jsonify({"error": "start/end must be ISO timestamps"}), 400
+        if created:
+            query["created_at"] = created
+        is_attack = request.args.get("is_attack")
+        if is_attack is not None:
+            query["is_attack"] = is_attack.lower() in ("1", "true", "yes")
+
+        fields = request.args.get("fields")
+        projection = (
+            {f.strip(): 1 for f in fields.split(",") if f.strip()} if fields else None
+        )
 
-    try:
-        batches = list(batches_collection.find())
-        return jsonify({"data": parse_json(batches), "total": len(batches)})
+        cursor = (
+            batches_collection.find(query, projection)
+            .sort([("created_at", -1), ("_id", -1)])
+            .batch_size(500)
+        )
+
+        def generate():
+            # One document in memory at a time; the index serves the sort
+            try:
+                if output == "ndjson":
+                    for doc in cursor:
+                        yield serializer.dumps(doc, extended=True) + b"\n"
+                    return
+                yield b'{"data": ['
+                total = 0
+                for doc in cursor:
+                    prefix = b"," if total else b""
+                    yield prefix + serializer.dumps(doc, extended=True)
+                    total += 1
+                yield f'], "total": {total}}}'.encode()
+            finally:
+                cursor.close()
+
+        mimetype = "application/x-ndjson" if output == "ndjson" else "application/json"
+        return Response(stream_with_context(generate()), mimetype=mimetype)
     except Exception as e:
         logger.error(f"Failed to fetch all batches: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+def page_args():
+    """limit / cursor / skip / count query args shared by the listings"""
+    limit = min(max(int(request.args.get("limit", 50)), 1), 1000)
+    skip = max(int(request.args.get("skip", 0)), 0)
+    count_mode = request.args.get("count", "estimated")
+    if count_mode not in COUNT_MODES:
+        raise ValueError(f"count must be one of {COUNT_MODES}")
+    return limit, request.args.get("cursor"), skip, count_mode
+
+
 @app.route("/api/batches", methods=["GET"])
 def get_batches():
-    """Get recent batches from MongoDB"""
+    """Get recent batches from MongoDB, newest first.
+    Pass meta.next_cursor back as ?cursor= for the next page."""
     try:
-        limit = int(request.args.get("limit", 50))
-        skip = int(request.args.get("skip", 0))
-
-        batches = list(
-            batches_collection.find({}, {"_id": 0})
-            .sort("created_at", -1)
-            .skip(skip)
-            .limit(limit)
-        )
+        try:
+            limit, cursor, skip, count_mode = page_args()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        query = {}
+        is_attack = request.args.get("is_attack")
+        if is_attack is not None:
+            query["is_attack"] = is_attack.lower() in ("1", "true", "yes")
 
-        total = batches_collection.count_documents({})
+        try:
+            docs, next_cursor = fetch_page(
+                batches_collection, query, "created_at", limit, cursor, skip=skip
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        for doc in docs:
+            del doc["_id"]
+        counts = count(batches_collection, query, count_mode)
 
         return jsonify(
-            {"data": batches, "meta": {"total": total, "limit": limit, "skip": skip}}
+            {
+                "data": docs,
+                "meta": {
+                    "limit": limit,
+                    "skip": skip,
+                    "next_cursor": next_cursor,
+                    **counts,
+                },
+            }
         )
     except Exception as e:
         logger.error(f"Failed to fetch batches: {e}")
@@ -391,32 +677,8 @@ def delete_batch(batch_id):
         if not batch:
             return jsonify({"error": "Batch not found"}), 404
 
-        # Delete associated files
-        files_to_delete = []
-        if batch.get("pcap_file_path"):
-            files_to_delete.append(Path(batch["pcap_file_path"]))
-        if batch.get("csv_file_path"):
-            files_to_delete.append(Path(batch["csv_file_path"]))
-
-        # Try to delete each file
-        deleted_files = []
-        failed_files = []
-        for file_path in files_to_delete:
-            try:
-                if file_path.exists():
-                    file_path.unlink()
-                    deleted_files.append(str(file_path))
-            except Exception as e:
-                logger.error(f"Failed to delete file {file_path}: {e}")
-                failed_files.append(str(file_path))
-
-        # Delete batch directory if it exists
-        try:
-            batch_dir = Path(batch.get("pcap_file_path")).parent
-            if batch_dir.exists() and batch_dir.is_dir():
-                shutil.rmtree(batch_dir)
-        except Exception as e:
-            logger.error(f"Failed to delete batch directory: {e}")
+        # Files shared with other batches (compacted archives) are kept
+        deleted_files, failed_files, _ = retention.delete_artifacts(batch)
 
         # Delete from database
         result = batches_collection.delete_one({"_id": ObjectId(batch_id)})
@@ -461,30 +723,33 @@ def update_batch(batch_id):
         return jsonify({"error": str(e)}), 500
 
 
-from flask import send_file
-
-
 @app.route("/api/download/csv/<batch_id>")
 def download_csv(batch_id):
     try:
         batch = batches_collection.find_one({"_id": ObjectId(batch_id)})
-        if not batch or not batch.get("csv_file_path"):
+        if not batch or not batch_flows_paths(batch):
             return jsonify({"error": "CSV file not found"}), 404
 
-        csv_path = batch["csv_file_path"]
-        if not os.path.exists(csv_path):
+        try:
+            chunks = iter_batch_flows(batch)
+            first = next(chunks, None)
+        except FileNotFoundError:
             return jsonify({"error": "CSV file missing from disk"}), 404
 
-        df = pd.read_csv(csv_path)
-
-        # 🆕 Thêm cột Label
-        df["Label"] = "Attack" if batch.get("is_attack", False) else "Benign"
-
-        # Lưu file tạm
-        temp_path = csv_path.replace(".csv", "_labeled.csv")
-        df.to_csv(temp_path, index=False)
-
-        return send_file(temp_path, as_attachment=True)
+        def generate():
+            # Chunk by chunk, Label included; nothing is written to disk
+            if first is None:
+                return
+            yield first.to_csv(index=False)
+            for chunk in chunks:
+                yield chunk.to_csv(index=False, header=False)
+
+        filename = f"{batch.get('batch_name', batch_id)}.csv"
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
 
     except Exception as e:
         logger.error(f"Failed to download CSV for batch {batch_id}: {e}")
@@ -493,14 +758,31 @@ def download_csv(batch_id):
 
 @app.route("/api/download/pcap/<batch_id>")
 def download_pcap(batch_id):
-    batch = batches_collection.find_one({"_id": ObjectId(batch_id)})
-    if (
-        batch
-        and batch.get("pcap_file_path")
-        and os.path.exists(batch["pcap_file_path"])
-    ):
-        return send_file(batch["pcap_file_path"], as_attachment=True)
-    return jsonify({"error": "PCAP file not found"}), 404
+    """The batch's packets as a plain .pcap, decompressed (and cut out of the
+    hour archive for compacted batches) on the fly"""
+    try:
+        batch = batches_collection.find_one({"_id": ObjectId(batch_id)})
+    except InvalidId:
+        return jsonify({"error": "Invalid batch id"}), 400
+    except Exception as e:
+        logger.error(f"Failed to download PCAP for batch {batch_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    try:
+        chunks = iter_batch_pcap(batch or {})
+        header = next(chunks)
+    except FileNotFoundError:
+        return jsonify({"error": "PCAP file not found"}), 404
+
+    def generate():
+        yield header
+        yield from chunks
+
+    filename = f"{batch.get('batch_name', batch_id)}.pcap"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/vnd.tcpdump.pcap",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 
 @app.route("/api/batches/<batch_id>", methods=["GET"])
@@ -512,29 +794,8 @@ def get_batch_detail(batch_id):
         if not batch:
             return jsonify({"error": "Batch not found"}), 404
 
-        def serialize_batch(batch_data):
-            if isinstance(batch_data, dict):
-                return {
-                    key: (
-                        str(value)
-                        if isinstance(value, ObjectId)
-                        else (
-                            value.isoformat()
-                            if isinstance(value, datetime.datetime)
-                            else serialize_batch(value)
-                        )
-                    )
-                    for key, value in batch_data.items()
-                }
-            elif isinstance(batch_data, list):
-                return [serialize_batch(item) for item in batch_data]
-            return batch_data
-
-        serialized_batch = serialize_batch(batch)
-
-        return jsonify(
-            {"batch": serialized_batch, "message": "Batch found successfully"}
-        )
+        # ObjectIds / datetimes are handled by the app's JSON provider
+        return jsonify({"batch": batch, "message": "Batch found successfully"})
 
     except Exception as e:
         logger.error(f"Failed to fetch batch {batch_id}: {e}")
@@ -543,27 +804,41 @@ def get_batch_detail(batch_id):
 
 @app.route("/api/csv/<batch_id>")
 def get_csv_data(batch_id):
+    """
+    One page of a batch's flows:
+    - offset (default 0), limit (default 500, max 5000)
+    - columns (comma-separated; default all)
+    """
     try:
+        try:
+            offset = max(int(request.args.get("offset", 0)), 0)
+            limit = min(max(int(request.args.get("limit", 500)), 1), 5000)
+        except ValueError:
+            return jsonify({"error": "offset and limit must be integers"}), 400
+        columns = request.args.get("columns")
+        columns = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+
         batch = batches_collection.find_one({"_id": ObjectId(batch_id)})
-        if not batch or not batch.get("csv_file_path"):
+        if not batch or not batch_flows_paths(batch):
             return jsonify({"error": "CSV file not found"}), 404
 
-        csv_path = batch["csv_file_path"]
-        if not os.path.exists(csv_path):
+        try:
+            # Label is stored with the flows (added on read for legacy CSVs)
+            df = read_batch_page(batch, offset, limit, columns)
+            total = count_batch_flows(batch)
+        except FileNotFoundError:
             return jsonify({"error": "CSV file missing from disk"}), 404
-
-        df = pd.read_csv(csv_path)
-
-        # 🆕 Thêm cột Label nếu chưa có
-        if "Label" not in df.columns:
-            df["Label"] = "Attack" if batch.get("is_attack", False) else "Benign"
-        else:
-            df["Label"] = "Attack" if batch.get("is_attack", False) else "Benign"
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         df = df.replace([np.inf, -np.inf], ["Infinity", "-Infinity"])
-        df = df.fillna("null")
+        df = df.astype(object).where(df.notna(), "null")
 
-        result = {"columns": df.columns.tolist(), "rows": df.to_dict("records")}
+        result = {
+            "columns": df.columns.tolist(),
+            "rows": df.to_dict("records"),
+            "meta": {"total": total, "offset": offset, "limit": limit},
+        }
 
         return jsonify(result)
 
@@ -575,17 +850,20 @@ def get_csv_data(batch_id):
 @app.route("/api/flows", methods=["GET"])
 def get_flows():
     """
-    Lấy danh sách các flow từ MongoDB. Hỗ trợ filter theo:
+    Lấy danh sách các flow từ MongoDB, mới nhất trước. Hỗ trợ filter theo:
     - batch_index
     - src_ip (Src IP)
     - dst_ip (Dst IP)
     - protocol (Protocol)
     - label (Label)
-    - limit, skip
+    - limit, cursor (meta.next_cursor of the previous page; skip still works)
+    - count: estimated (default), exact or none
     """
     try:
-        limit = int(request.args.get("limit", 100))
-        skip = int(request.args.get("skip", 0))
+        try:
+            limit, cursor, skip, count_mode = page_args()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         query = {}
 
@@ -620,36 +898,28 @@ def get_flows():
         if label:
             query["Label"] = label
 
-        raw_flows = list(
-            flows_collection.find(query, {"_id": 0})
-            .sort("Timestamp", -1)
-            .skip(skip)
-            .limit(limit)
-        )
-
-        # ✅ Clean các giá trị không hợp lệ như Infinity
-        import math
-
-        def clean_value(val):
-            if isinstance(val, float) and (math.isinf(val) or math.isnan(val)):
-                return None
-            return val
-
-        def clean_dict(d):
-            return {k: clean_value(v) for k, v in d.items()}
+        try:
+            raw_flows, next_cursor = fetch_page(
+                flows_collection, query, "flow_time", limit, cursor, skip=skip
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        flows = [clean_dict(f) for f in raw_flows]
+        # Infinity / NaN are written as null by the JSON provider
+        for flow in raw_flows:
+            del flow["_id"]
 
-        total = flows_collection.count_documents(query)
+        counts = count(flows_collection, query, count_mode)
 
         return jsonify(
             {
-                "data": flows,
+                "data": raw_flows,
                 "meta": {
-                    "total": total,
                     "limit": limit,
                     "skip": skip,
+                    "next_cursor": next_cursor,
                     "filters": query,
+                    **counts,
                 },
             }
         )
@@ -659,61 +929,86 @@ def get_flows():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/flows/summary", methods=["GET"])
-def get_flow_summary():
+@app.route("/api/flows/archive", methods=["GET"])
+def query_flow_archive():
+    """
+    Query the columnar flow archive across batches. Only the requested columns
+    and the hour partitions / row groups matching the filters are read:
+    - columns (comma-separated; default all)
+    - src_ip, dst_ip, protocol, label, batch (comma-separated values)
+    - start, end (ISO time, flow start time; end exclusive)
+    - limit (default 1000, max 50000)
+    """
     try:
-        flows = list(
-            flows_collection.find(
-                {},
-                {
-                    "_id": 0,
-                    "Src IP": 1,
-                    "Dst IP": 1,
-                    "Dst Port": 1,
-                    "Protocol": 1,
-                    "Timestamp": 1,
-                },
-            )
-        )
+        try:
+            limit = min(max(int(request.args.get("limit", 1000)), 1), 50000)
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
 
-        # Bộ đếm
-        src_ips = Counter()
-        dst_ips = Counter()
-        dst_ports = Counter()
-        protocols = Counter()
-        traffic_time = Counter()
-
-        for flow in flows:
-            src_ips[flow.get("Src IP")] += 1
-            dst_ips[flow.get("Dst IP")] += 1
-            dst_ports[str(flow.get("Dst Port"))] += 1
-            proto = flow.get("Protocol")
-            protocols[str(proto)] += 1
-
-            ts = flow.get("Timestamp")
-            try:
-                t = datetime.datetime.strptime(ts, "%d/%m/%Y %I:%M:%S %p")
-                label = t.isoformat()  # chuyển sang dạng chuẩn ISO 8601
-                traffic_time[label] += 1
-            except Exception:
-                continue
+        def values(name):
+            value = request.args.get(name)
+            return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+        try:
+            start = request.args.get("start") or None
+            end = request.args.get("end") or None
+            start = pd.Timestamp(start) if start else None
+            end = pd.Timestamp(end) if end else None
+        except ValueError:
+            return jsonify({"error": "start/end must be ISO timestamps"}), 400
 
-        def top_n(counter):
-            return [{"name": k, "value": v} for k, v in counter.most_common(10)]
+        try:
+            df = flow_store.query(
+                columns=values("columns"),
+                src_ip=values("src_ip"),
+                dst_ip=values("dst_ip"),
+                protocol=values("protocol"),
+                label=values("label"),
+                batch=values("batch"),
+                start=start,
+                end=end,
+                limit=limit,
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         return jsonify(
             {
-                "top_source_ips": top_n(src_ips),
-                "top_destination_ips": top_n(dst_ips),
-                "top_destination_ports": top_n(dst_ports),
-                "top_protocols": top_n(protocols),
-                "traffic_over_time": [
-                    {"time": k, "count": v} for k, v in sorted(traffic_time.items())
-                ],
-                "updated_at": datetime.datetime.utcnow().isoformat(),
+                "columns": df.columns.tolist(),
+                "rows": df.to_dict("records"),
+                "meta": {"count": len(df), "limit": limit},
             }
         )
 
+    except Exception as e:
+        logger.error(f"Failed to query flow archive: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/flows/summary", methods=["GET"])
+def get_flow_summary():
+    """
+    Top values and per-minute traffic from the incrementally kept rollups:
+    - start, end (ISO time; end exclusive)
+    - top (default 10, max 100)
+    """
+    try:
+        try:
+            top = min(max(int(request.args.get("top", 10)), 1), 100)
+            start = request.args.get("start") or None
+            end = request.args.get("end") or None
+            if start:
+                start = local_time(start).to_pydatetime()
+            if end:
+                end = local_time(end).to_pydatetime()
+        except ValueError:
+            return jsonify({"error": "top must be an integer, start/end ISO"}), 400
+
+        summary = flow_summary.summary(start, end, top)
+        return jsonify(
+            {**summary, "updated_at": datetime.datetime.utcnow().isoformat()}
+        )
+
     except Exception as e:
         logger.error(f"Failed to summarize flows: {e}")
         return jsonify({"error": str(e)}), 500
@@ -780,9 +1075,11 @@ from model_state import set_model, get_total_packet_count, set_total_packet_coun
 def select_model():
     data = request.get_json()
     model_name = data.get("model")
-    if model_name not in ["autoencoder", "kmeans", "svm"]:
+    if model_name not in SELECTABLE_MODELS:
         return jsonify({"status": "error", "message": "Invalid model"}), 400
     set_model(model_name)  # ✅ cập nhật model qua setter
+    # load now instead of in the next batch
+    model_registry.warm_up(models_for(model_name))
     return jsonify({"status": "success", "model": model_name})
 
 
@@ -794,6 +1091,47 @@ def get_current_model():
     return jsonify({"model": get_model()})  # ✅ dùng getter
 
 
+@app.route("/api/ensemble", methods=["GET"])
+def get_ensemble_settings():
+    return jsonify(ensemble.settings())
+
+
+@app.route("/api/ensemble", methods=["POST"])
+def update_ensemble_settings():
+    """Change ensemble voting (any / majority / weighted), weights and threshold"""
+    try:
+        data = request.get_json() or {}
+        ensemble.configure(
+            voting=data.get("voting"),
+            weights=data.get("weights"),
+            threshold=data.get("threshold"),
+        )
+        return jsonify(ensemble.settings())
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/model/reload", methods=["POST"])
+def reload_models():
+    """Load new artifacts from Model/ and swap them in without restarting
+
+    Body ``{"model": "kmeans"}`` reloads one model; without it every loaded
+    model is reloaded. Batches already running finish on the old snapshot.
+    """
+    data = request.get_json(silent=True) or {}
+    model_name = data.get("model")
+    if model_name is not None and model_name not in MODEL_NAMES:
+        return jsonify({"status": "error", "message": "Invalid model"}), 400
+    try:
+        swapped = model_registry.reload([model_name] if model_name else None)
+    except Exception as e:
+        logger.error(f"Model reload failed: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify(
+        {"status": "success", "swapped": swapped, "models": model_registry.stats()}
+    )
+
+
 @socketio.on("connect")
 def handle_connect():
     logger.info("Client connected")
@@ -813,6 +1151,7 @@ def handle_start_capture():
 @socketio.on("connect")
 def handle_connect():
     logger.info("Client connected")
+    live_feed.add_client(request.sid)
 
     socketio.emit(
         "capture_status", {"is_sniffing": is_sniffing, "packet_count": packet_count}
@@ -822,6 +1161,7 @@ def handle_connect():
 @socketio.on("disconnect")
 def handle_disconnect():
     logger.info("Client disconnected")
+    live_feed.remove_client(request.sid)
 
 
 # Add debug event handler
@@ -843,6 +1183,22 @@ if __name__ == "__main__":
     HOST = os.getenv("BACKEND_HOST", "0.0.0.0")
     PORT = int(os.getenv("BACKEND_PORT", 5000))
 
+    if MODEL_WARMUP == "all":
+        model_registry.warm_up(MODEL_NAMES)
+    elif MODEL_WARMUP == "current":
+        model_registry.warm_up(models_for(get_model()))
+    # Flows stored before flow_time existed get it, for sorting and paging
+    threading.Thread(target=backfill_flow_times, args=(db,), daemon=True).start()
+    # Restores persisted rollups (or rebuilds them once from the flows)
+    threading.Thread(
+        target=flow_summary.load, args=(flows_collection,), daemon=True
+    ).start()
+    flow_summary.start()
+    # Compacts old benign batches and expires artifacts past retention
+    retention.start()
+    startup_timer.mark("ready")
+    logger.info(f"Startup timings: {startup_timer.summary()}")
+
     try:
         socketio.run(
             app,
@@ -2,7 +2,10 @@ from flask import Flask
 from flask_socketio import SocketIO
 from flask_cors import CORS
 
+from serializer import OrjsonProvider, SocketJSON
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 socketio = SocketIO(
@@ -14,4 +17,5 @@ socketio = SocketIO(
     ping_timeout=60000,
     ping_interval=25000,
     allow_upgrades=True,
+    json=SocketJSON,
 )
@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from autoencoder_runtime import (
+    AUTOENCODER_BACKENDS,
+    KerasAutoencoder,
+    NumpyAutoencoder,
+    load_autoencoder,
+)
+
+MODEL_DIR = Path(__file__).resolve().parent.parent / "Model"
+
+
+def _dense(kernel):
+    model = NumpyAutoencoder.__new__(NumpyAutoencoder)
+    model.layers = [(kernel, None, "linear")]
+    model.input_dim = kernel.shape[0]
+    return model
+
+
+def test_verdicts_flag_high_reconstruction_error_as_attack():
+    data = np.full((3, 4), 5.0, dtype=np.float32)
+    # Perfect reconstruction: error 0, below any positive threshold -> normal
+    assert _dense(np.eye(4, dtype=np.float32)).verdicts(data, 1.0).tolist() == [0] * 3
+    # Reconstructs zeros: error 5 -> attack; exactly at the threshold counts too
+    zeros = _dense(np.zeros((4, 4), dtype=np.float32))
+    assert zeros.verdicts(data, 1.0).tolist() == [1] * 3
+    assert zeros.verdicts(data, 5.0).tolist() == [1] * 3
+
+
+def test_keras_backends_share_the_verdict_rule():
+    assert KerasAutoencoder.verdicts is NumpyAutoencoder.verdicts
+
+
+@pytest.mark.parametrize("backend", AUTOENCODER_BACKENDS)
+def test_trained_model_flags_outliers(backend):
+    if backend != "numpy":
+        pytest.importorskip("tensorflow")
+    model = load_autoencoder(MODEL_DIR / "autoencoder.h5", backend)
+    threshold = np.load(MODEL_DIR / "autoencoder_train_info.npz")["threshold"].item()
+    outliers = np.full((2, model.input_dim), 1e3, dtype=np.float32)
+    assert model.verdicts(outliers, threshold).tolist() == [1, 1]
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from inference import WindowBuilder, feature_spec
+
+
+def _flows(n, hosts=None):
+    columns, config = feature_spec("ensemble")
+    data = {col: np.arange(1, n + 1, dtype=np.float64) for col in config}
+    data["Src IP"] = hosts or ["10.0.0.1"] * n
+    return pd.DataFrame(data)
+
+
+def test_one_flow_host_has_zero_std():
+    flows = _flows(3, hosts=["10.0.0.1", "10.0.0.1", "10.0.0.2"])
+    features, windows = WindowBuilder(mode="host").build(flows, "ensemble")
+    assert [w["flows"] for w in windows] == [2, 1]
+    assert not features.isna().any().any()
+    assert features.loc[1, "Fwd IAT Tot_std"] == 0.0
+
+
+def test_window_of_one_flow_has_zero_std():
+    features, windows = WindowBuilder(mode="sliding", window=200).build(
+        _flows(1), "ensemble"
+    )
+    assert windows == [{"start": 0, "end": 1}]
+    assert not features.isna().any().any()
+    assert features.loc[0, "Fwd IAT Tot_std"] == 0.0
+    assert features.loc[0, "Flow Duration_mean"] == 1.0
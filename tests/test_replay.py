@@ -0,0 +1,38 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from scapy.all import IP, TCP, Ether, wrpcap
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _files(*dirs):
+    return {p for d in dirs if d.exists() for p in d.rglob("*") if p.is_file()}
+
+
+def test_process_workers_write_into_the_replay_dir(tmp_path):
+    pcap = tmp_path / "capture.pcap"
+    packets = []
+    for i in range(200):
+        pkt = Ether() / IP(src=f"10.0.0.{i % 5 + 1}", dst="10.0.1.1") / TCP(
+            sport=40000 + i % 20, dport=80, flags="PA"
+        )
+        pkt.time = 1700000000 + i * 0.01
+        packets.append(pkt)
+    wrpcap(str(pcap), packets)
+
+    production = (ROOT / "batches", ROOT / "flow_store")
+    before = _files(*production)
+    out = subprocess.run(
+        [sys.executable, str(ROOT / "replay.py"), str(pcap), "--model", "kmeans",
+         "--execution", "processes", "--json"],
+        capture_output=True, text=True, cwd=ROOT, timeout=600,
+    )
+    line = next(l for l in out.stdout.splitlines() if l.startswith("REPORT "))
+    report = json.loads(line[len("REPORT "):])
+
+    assert report["batches"] >= 1
+    assert _files(*production) == before
+    assert _files(Path(report["batch_dir"]))
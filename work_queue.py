@@ -0,0 +1,175 @@
+"""Bounded batch queue between the micro-batcher and the batch workers.
+
+What happens when the queue is full is set by the overflow policy:
+
+- ``block``: the submitter (batch stage) waits for a free slot, so the capture
+  queue absorbs the backlog and drops packets once it is full itself
+- ``drop_oldest``: the oldest waiting batch is shed to make room
+- ``sample``: only every ``sample_every``-th incoming batch is admitted (in
+  place of the oldest); the others are shed
+
+A batch picked up while the queue is at least ``degrade_at`` full runs
+degraded (the handler is told to skip optional work such as pcap archiving).
+"""
+
+from collections import deque
+import logging
+import threading
+import time
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("block", "drop_oldest", "sample")
+# Recent queue waits kept for the mean/max reported by stats()
+WAIT_SAMPLES = 200
+
+
+class WorkQueue:
+    def __init__(
+        self,
+        handler,
+        maxsize=24,
+        policy="block",
+        workers=4,
+        sample_every=10,
+        degrade_at=0.5,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.items = deque()
+        self.maxsize = 1
+        self.policy = "block"
+        self.sample_every = 1
+        self.degrade_at = 1.0
+        self.configure(maxsize, policy, sample_every, degrade_at)
+        self.threads = []
+        self.active = 0
+        self.closed = False
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.counters = {
+            "submitted": 0,
+            "completed": 0,
+            "shed": 0,
+            "degraded": 0,
+            "blocked_seconds": 0.0,
+        }
+        self._overflow = 0
+
+    def configure(self, maxsize=None, policy=None, sample_every=None, degrade_at=None):
+        if policy is not None:
+            if policy not in POLICIES:
+                raise ValueError(f"policy must be one of {POLICIES}")
+            self.policy = policy
+        if maxsize is not None:
+            if int(maxsize) < 1:
+                raise ValueError("maxsize must be >= 1")
+            self.maxsize = int(maxsize)
+        if sample_every is not None:
+            if int(sample_every) < 1:
+                raise ValueError("sample_every must be >= 1")
+            self.sample_every = int(sample_every)
+        if degrade_at is not None:
+            if float(degrade_at) <= 0:
+                raise ValueError("degrade_at must be > 0 (above 1 disables it)")
+            self.degrade_at = float(degrade_at)
+        with self.cond:
+            self.cond.notify_all()
+
+    def _start_workers(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work, name=f"batch-worker-{len(self.threads)}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, *args) -> bool:
+        """Queue a batch; False if it (or nothing) was shed instead"""
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("work queue is shut down")
+            self._start_workers()
+            self.counters["submitted"] += 1
+            if len(self.items) >= self.maxsize:
+                if self.policy == "block":
+                    start = time.perf_counter()
+                    while len(self.items) >= self.maxsize and not self.closed:
+                        self.cond.wait()
+                    self.counters["blocked_seconds"] += time.perf_counter() - start
+                else:
+                    self._overflow += 1
+                    if self.policy == "sample" and self._overflow % self.sample_every:
+                        self.counters["shed"] += 1
+                        return False
+                    self.items.popleft()
+                    self.counters["shed"] += 1
+            self.items.append((time.monotonic(), args))
+            self.cond.notify_all()
+            return True
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while not self.items and not self.closed:
+                    self.cond.wait()
+                if not self.items:
+                    return
+                enqueued, args = self.items.popleft()
+                degraded = len(self.items) + 1 >= self.degrade_at * self.maxsize
+                self.active += 1
+                self.cond.notify_all()
+            wait = time.monotonic() - enqueued
+            self.waits.append(wait)
+            stage_timer.record("queue_wait", wait)
+            if degraded:
+                self.counters["degraded"] += 1
+            try:
+                self.handler(*args, degraded=degraded)
+            except Exception as e:
+                logger.error(f"Batch worker failed: {e}")
+            finally:
+                with self.cond:
+                    self.active -= 1
+                    self.counters["completed"] += 1
+                    self.cond.notify_all()
+
+    def join(self, timeout=None) -> bool:
+        """Wait until every queued batch has been processed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while self.items or self.active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def shutdown(self, wait=True):
+        """Stop accepting batches; workers finish what is queued, then exit"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def stats(self) -> dict:
+        with self.cond:
+            waits = list(self.waits)
+            return {
+                "policy": self.policy,
+                "depth": len(self.items),
+                "capacity": self.maxsize,
+                "active": self.active,
+                "sample_every": self.sample_every,
+                "degrade_at": self.degrade_at,
+                "wait_mean_ms": (
+                    round(sum(waits) / len(waits) * 1000, 2) if waits else None
+                ),
+                "wait_max_ms": round(max(waits) * 1000, 2) if waits else None,
+                **self.counters,
+                "blocked_seconds": round(self.counters["blocked_seconds"], 3),
+            }